@@ -1,10 +1,12 @@
-from typing import Type
+from typing import Iterable, Type
 
 import django.forms.models
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
+from django.core.exceptions import FieldDoesNotExist
 
 from core import models as core_models
+from core.paginator import EstimatedCountPaginator
 from core.settings import Settings
 from logger import Logger
 
@@ -25,6 +27,10 @@ class CoreAdmin(admin.ModelAdmin):
     not_required_fields = ()
     not_show_list = ()
     reorder_fields: dict[str, str] = {}
+    # связи, которые нужны __str__ связанных объектов, например, ("attempt__user",)
+    extra_list_select_related = ()
+    # для больших таблиц - оценка количества строк вместо COUNT(*)
+    estimated_count = False
 
     def __init__(self, model, admin_site):
         self.logger = Logger(self.__class__.__name__)
@@ -44,6 +50,15 @@ class CoreAdmin(admin.ModelAdmin):
                 self.list_display.insert(self.list_display.index(before_field), field)
 
         self.list_display = tuple(x for x in self.list_display if x not in self.not_show_list)
+        # иначе каждая связь в строке списка - отдельный запрос
+        # (select_related() без аргументов пропускает связи с null = True)
+        if self.list_select_related is False:
+            self.list_select_related = self.get_related_fields(self.list_display) + tuple(
+                self.extra_list_select_related
+            )
+        if self.estimated_count:
+            self.paginator = EstimatedCountPaginator
+            self.show_full_result_count = False
         if self.fieldsets is not None:
             self.fieldsets += self._fieldsets
         else:
@@ -57,6 +72,18 @@ class CoreAdmin(admin.ModelAdmin):
             form.base_fields[field_name].required = False
         return form
 
+    def get_related_fields(self, field_names: Iterable[str]) -> tuple[str, ...]:
+        related_fields = []
+        for field_name in field_names:
+            try:
+                # noinspection PyProtectedMember
+                field = self.model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                continue
+            if field.many_to_one or field.one_to_one:
+                related_fields.append(field_name)
+        return tuple(related_fields)
+
     @property
     def _list_display(self) -> tuple:
         # noinspection PyProtectedMember
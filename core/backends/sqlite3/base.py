@@ -0,0 +1,20 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite, в котором транзакции записи сразу берут блокировку записи (BEGIN IMMEDIATE).
+
+    Транзакция, начатая обычным BEGIN, при первой записи после чтения получает "database is locked" без ожидания
+    busy_timeout, если другое соединение успело записать раньше. Транзакции только для чтения (например, снимок
+    каталога опросов) начинаются обычным BEGIN и не ждут пишущие транзакции. Транзакцию записи открывает
+    core.database.write_atomic.
+    """
+
+    # выставляется write_atomic на время начала транзакции
+    begin_immediate = False
+
+    def _start_transaction_under_autocommit(self) -> None:
+        if self.begin_immediate:
+            self.cursor().execute("BEGIN IMMEDIATE")
+        else:
+            super()._start_transaction_under_autocommit()
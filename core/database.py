@@ -0,0 +1,130 @@
+import copy
+import threading
+import time
+from contextlib import ExitStack
+from typing import Any
+
+import django
+from django.db import connections, transaction
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.signals import connection_created
+
+from core.settings import Settings
+
+
+def get_databases(databases: dict, settings: Settings) -> dict:
+    """Дополняет DATABASES из секретов настройками соединений для работы под нагрузкой."""
+
+    databases = copy.deepcopy(databases)
+    for database in databases.values():
+        options = database.setdefault("OPTIONS", {})
+        engine = database.get("ENGINE", "")
+        if engine.endswith("sqlite3"):
+            # таймаут sqlite3.connect - ожидание блокировки, остальные параметры выставляет configure_connection
+            options.setdefault("timeout", settings.SQLITE_BUSY_TIMEOUT)
+            # transaction_mode из Django 5.1 применяется ко всем транзакциям, а BEGIN IMMEDIATE нужен только
+            # транзакциям записи (write_atomic)
+            if engine == "django.db.backends.sqlite3":
+                database["ENGINE"] = "core.backends.sqlite3"
+        elif engine.endswith("postgresql"):
+            if settings.POSTGRES_POOL is not None and django.VERSION >= (5, 1):
+                options.setdefault("pool", settings.POSTGRES_POOL)
+            if settings.POSTGRES_PGBOUNCER:
+                # PgBouncer в режиме transaction может выполнить следующий запрос в другом серверном соединении,
+                # где серверного курсора iterator() уже нет
+                database.setdefault("DISABLE_SERVER_SIDE_CURSORS", True)
+        if options.get("pool"):
+            # пул сам переиспользует соединения, постоянные соединения с ним несовместимы
+            database.setdefault("CONN_MAX_AGE", 0)
+        else:
+            database.setdefault("CONN_MAX_AGE", settings.DATABASE_CONN_MAX_AGE)
+        database.setdefault("CONN_HEALTH_CHECKS", settings.DATABASE_CONN_HEALTH_CHECKS)
+    return databases
+
+
+class WriteAtomic(transaction.Atomic):
+    """transaction.atomic для транзакций с записью: в SQLite блокировка записи берется сразу при BEGIN."""
+
+    def __enter__(self) -> None:
+        connection = transaction.get_connection(self.using)
+        # вложенный блок создает точку сохранения, а транзакцию начинает только внешний
+        connection.begin_immediate = True
+        try:
+            super().__enter__()
+        finally:
+            connection.begin_immediate = False
+
+
+def write_atomic(using: str = None) -> WriteAtomic:
+    return WriteAtomic(using, True, False)
+
+
+# noinspection PyUnusedLocal
+def configure_connection(sender, connection: BaseDatabaseWrapper, **kwargs) -> None:
+    # в Django 5.0 у SQLite нет init_command, поэтому PRAGMA выполняются при открытии соединения
+    if connection.vendor != "sqlite":
+        return
+    settings = Settings()
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.SQLITE_BUSY_TIMEOUT * 1000)}")
+
+
+class QueryCounter:
+    """Считает SQL-запросы во всех потоках: в соединениях текущего потока и в соединениях, открытых после start."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    # noinspection PyUnusedLocal
+    def install(self, sender, connection: BaseDatabaseWrapper, **kwargs) -> None:
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def start(self) -> None:
+        connection_created.connect(self.install, dispatch_uid = id(self))
+        for connection in connections.all(initialized_only = True):
+            self.install(None, connection)
+
+    def stop(self) -> None:
+        connection_created.disconnect(dispatch_uid = id(self))
+        for connection in connections.all(initialized_only = True):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class QueryLog:
+    """Запоминает SQL-запросы соединений текущего потока и их длительность."""
+
+    def __init__(self) -> None:
+        # [(sql, параметры, длительность в секундах)]
+        self.queries: list[tuple[str, Any, float]] = []
+        self._exit_stack = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    def __enter__(self) -> "QueryLog":
+        for connection in connections.all():
+            self._exit_stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._exit_stack.close()
+
+    def __str__(self) -> str:
+        total = sum(x[2] for x in self.queries)
+        lines = [f"{len(self.queries)} queries, {total * 1000:.1f} ms"]
+        lines.extend(f"    {duration * 1000:.1f} ms: {sql} {params}" for sql, params, duration in self.queries)
+        return "\n".join(lines)
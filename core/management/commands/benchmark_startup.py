@@ -0,0 +1,82 @@
+import json
+import statistics
+import subprocess
+import sys
+import timeit
+
+from core.management.commands import core_command
+from core.settings import Settings
+from secret_keeper import SecretKeeper
+
+
+# запускается в отдельном процессе, чтобы модули импортировались заново
+STARTUP_PROBE = """
+import json, os, sys, time
+
+start = time.perf_counter()
+import secret_keeper
+
+reads = []
+read_json = secret_keeper.SecretKeeper.read_json
+secret_keeper.SecretKeeper.read_json = staticmethod(lambda path: reads.append(path) or read_json(path))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "teleeng.settings")
+import django
+
+django.setup()
+for module in sys.argv[1:]:
+    __import__(module)
+print(json.dumps({"seconds": time.perf_counter() - start, "secret_reads": len(reads)}))
+"""
+
+
+def legacy_settings() -> Settings:
+    # создание настроек до мемоизации: новый объект и чтение всех файлов секретов
+    settings = type.__call__(Settings)
+    secrets = SecretKeeper(settings)
+    for name in secrets.paths:
+        getattr(secrets, name)
+    return settings
+
+
+class Command(core_command.CoreCommand):
+    help = "Измеряет время запуска: создание настроек и импорт модулей бота в новом процессе"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--number", type = int, default = 1000, help = "Количество созданий настроек")
+        parser.add_argument("--runs", type = int, default = 5, help = "Количество запусков процесса для каждого набора")
+        parser.add_argument(
+            "--modules",
+            nargs = "*",
+            default = ["telegram_bot.bot", "telegram_bot.async_bot", "survey.admin"],
+            help = "Модули, импортируемые после django.setup()"
+        )
+
+    def handle(self, *args, **options) -> None:
+        number = options["number"]
+        results = {
+            "legacy": timeit.timeit(legacy_settings, number = number) / number * 1_000_000,
+            "current": timeit.timeit(Settings, number = number) / number * 1_000_000
+        }
+        self.logger.info(
+            f"Settings(): legacy {results['legacy']:.2f} us, current {results['current']:.2f} us, "
+            f"speedup x{results['legacy'] / results['current']:.1f}"
+        )
+
+        for modules in ([], *([x] for x in options["modules"])):
+            runs = [self.probe(modules) for _ in range(options["runs"])]
+            seconds = [x["seconds"] for x in runs]
+            self.logger.info(
+                f"django.setup() {' + '.join(modules)}: median {statistics.median(seconds) * 1000:.1f} ms, "
+                f"min {min(seconds) * 1000:.1f} ms, secret files read: {runs[-1]['secret_reads']}"
+            )
+
+    @staticmethod
+    def probe(modules: list[str]) -> dict:
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, *modules],
+            capture_output = True,
+            check = True,
+            text = True
+        ).stdout
+        # последняя строка - результат, выше может быть вывод логгеров
+        return json.loads(output.strip().splitlines()[-1])
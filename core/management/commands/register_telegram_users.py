@@ -0,0 +1,31 @@
+import csv
+import itertools
+import time
+
+from core import models
+from core.management.commands import core_command
+
+
+class Command(core_command.CoreCommand):
+    help = "Регистрирует существующих пользователей Telegram из CSV-файла (telegram_user_id[,telegram_chat_id])"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("path", help = "CSV-файл без заголовка, chat_id по умолчанию равен user_id")
+        parser.add_argument("--batch-size", type = int, default = 1000, help = "Количество пользователей в пачке")
+
+    def handle(self, *args, **options) -> None:
+        start = time.perf_counter()
+        registered_count = 0
+        total_count = 0
+        with open(options["path"], 'r', encoding = "utf-8", newline = "") as file:
+            rows = (
+                (int(row[0]), int(row[1]) if len(row) > 1 and row[1] else int(row[0]))
+                for row in csv.reader(file) if row
+            )
+            while batch := list(itertools.islice(rows, options["batch_size"])):
+                registered_count += models.User.bulk_register(batch)
+                total_count += len(batch)
+                self.logger.info(f"Processed users: {total_count}, registered: {registered_count}")
+        self.logger.info(
+            f"Registered users: {registered_count} of {total_count} in {time.perf_counter() - start:.3f} s"
+        )
@@ -0,0 +1,269 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import logger
+from core import settings
+
+
+class Metric:
+    TYPE: str
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def get_key(self, labels: dict[str, str]) -> tuple:
+        return tuple(str(labels[x]) for x in self.label_names)
+
+    @staticmethod
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def format_labels(self, key: tuple, **extra) -> str:
+        pairs = [*zip(self.label_names, key), *extra.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{self.escape(value)}"' for name, value in pairs) + "}"
+
+    def get_snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(f"{self.name}{self.format_labels(key)} {value}" for key, value in self.get_snapshot().items())
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self.get_key(labels)] = value
+
+
+class StatsGauge(Gauge):
+    """Gauge с метками (component, name), значения которого читаются из get_stats компонентов при выводе метрик."""
+
+    def __init__(self, name: str, documentation: str) -> None:
+        super().__init__(name, documentation, ("component", "name"))
+        self.sources: dict[str, Callable[[], dict[str, float]]] = {}
+
+    def add_source(self, component: str, get_stats: Callable[[], dict[str, float]]) -> None:
+        with self._lock:
+            self.sources[component] = get_stats
+
+    def remove_source(self, component: str) -> None:
+        with self._lock:
+            self.sources.pop(component, None)
+
+    def get_snapshot(self) -> dict[tuple, float]:
+        with self._lock:
+            sources = list(self.sources.items())
+        return {(component, name): value for component, get_stats in sources for name, value in get_stats().items()}
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+    # границы (в секундах), подходящие и для запросов к БД, и для запросов к Telegram
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = buckets
+        # {метки: [количество в каждой корзине (без накопления), сумма, количество]}
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.get_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = data
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_snapshot(self) -> dict[tuple, tuple[list[int], float, int]]:
+        with self._lock:
+            return {key: (list(data[0]), data[1], data[2]) for key, data in self._values.items()}
+
+    def get_quantile(self, bucket_counts: list[int], count: int, quantile: float) -> float:
+        # верхняя граница корзины, в которую попадает квантиль
+        rank = quantile * count
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for key, (bucket_counts, total, count) in self.get_snapshot().items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self.format_labels(key, le = bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """Метрики процесса в формате Prometheus."""
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+PREFIX = "teleeng"
+# kind - что измеряется: handler - обработчик бота, step - часть обработчика (например, отправка следующего вопроса),
+# telegram_api - запрос к Bot API, db_write - запись в БД
+DURATION = REGISTRY.register(Histogram(f"{PREFIX}_duration_seconds", "Operation duration", ("kind", "name")))
+ERRORS = REGISTRY.register(
+    Counter(f"{PREFIX}_errors_total", "Operations finished with an exception", ("kind", "name"))
+)
+IN_FLIGHT = REGISTRY.register(Gauge(f"{PREFIX}_in_flight", "Operations being executed now", ("kind", "name")))
+# component - источник показателей: outbound_scheduler - планировщик отправки сообщений,
+# update_dispatcher - очереди обработчиков обновлений, user_cache - кэш пользователей
+COMPONENT_STATS = REGISTRY.register(StatsGauge(f"{PREFIX}_component_stats", "Current state of bot components"))
+
+
+@contextmanager
+def track(kind: str, name: str) -> Iterator[None]:
+    IN_FLIGHT.inc(kind = kind, name = name)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        ERRORS.inc(kind = kind, name = name)
+        raise
+    finally:
+        DURATION.observe(time.perf_counter() - start, kind = kind, name = name)
+        IN_FLIGHT.dec(kind = kind, name = name)
+
+
+def timed(kind: str, name: str = None) -> Callable[[Callable], Callable]:
+    """Декоратор, измеряющий время выполнения функции (в том числе асинхронной)."""
+
+    def decorator(function: Callable) -> Callable:
+        metric_name = function.__name__ if name is None else name
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with track(kind, metric_name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with track(kind, metric_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsLogger:
+    """Периодически пишет в лог сводку по длительностям операций (для процесса с long polling без web-сервера)."""
+
+    settings = settings.Settings()
+
+    def __init__(self) -> None:
+        self.logger = logger.Logger(self.__class__.__name__)
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running or not self.settings.METRICS_LOG_PERIOD:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target = self.work, name = self.__class__.__name__, daemon = True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def work(self) -> None:
+        while not self._stopped.wait(self.settings.METRICS_LOG_PERIOD):
+            self.dump()
+
+    def dump(self) -> None:
+        errors = ERRORS.get_snapshot()
+        for (kind, name), (bucket_counts, total, count) in sorted(DURATION.get_snapshot().items()):
+            self.logger.info(
+                f"{kind} {name}: count {count}, errors {int(errors.get((kind, name), 0))}, "
+                f"avg {total / count * 1000:.1f} ms, "
+                f"p50 <= {DURATION.get_quantile(bucket_counts, count, 0.5) * 1000:g} ms, "
+                f"p99 <= {DURATION.get_quantile(bucket_counts, count, 0.99) * 1000:g} ms"
+            )
+        components: dict[str, list[str]] = {}
+        for (component, name), value in COMPONENT_STATS.get_snapshot().items():
+            components.setdefault(component, []).append(f"{name} {value}")
+        for component, values in sorted(components.items()):
+            self.logger.info(f"{component}: {', '.join(values)}")
@@ -1,6 +1,11 @@
+import uuid
+from typing import Iterable
+
 from django.contrib.auth import models as auth_models
 from django.db import models
+from django.db.models.functions import Cast, Concat
 
+from core import database
 from core.settings import Settings
 from logger import Logger
 
@@ -18,15 +23,62 @@ class CoreModel(models.Model):
 
 
 class User(CoreModel, auth_models.AbstractUser):
-    telegram_user_id = models.BigIntegerField("Telegram user_id", null = True)
+    telegram_user_id = models.BigIntegerField("Telegram user_id", null = True, db_index = True)
     telegram_chat_id = models.BigIntegerField("Telegram chat_id", null = True)
 
     def get_default_username(self) -> str:
         return f"user_{self.id}"
 
+    def get_placeholder_username(self) -> str:
+        # username вида user_<id> известен только после INSERT, а до него нужно уникальное имя,
+        # ":" не проходит проверку username, поэтому временное имя не совпадет с именем другого пользователя
+        if self.telegram_user_id is not None:
+            return f"telegram:{self.telegram_user_id}"
+        return f"new:{uuid.uuid4().hex}"
+
     def save(self, *args, **kwargs) -> None:
-        super().save(*args, **kwargs)
-        if self.username == "" or self.username is None:
-            self.username = self.get_default_username()
-        # для сохранения username с выданным id (не None)
-        super().save()
+        if self.username:
+            super().save(*args, **kwargs)
+            return
+        # временное имя не остается в БД, если username с выданным id (не None) не удалось сохранить
+        with database.write_atomic():
+            try:
+                self.username = self.get_placeholder_username()
+                super().save(*args, **kwargs)
+                self.username = self.get_default_username()
+                super().save(update_fields = ["username"])
+            except Exception:
+                self.username = ""
+                raise
+
+    @classmethod
+    def bulk_register(cls, telegram_ids: Iterable[tuple[int, int]], batch_size: int = None) -> int:
+        """Регистрирует пользователей Telegram пачками по (telegram_user_id, telegram_chat_id).
+
+        Уже зарегистрированные пользователи пропускаются. bulk_create не вызывает save и сигналы, поэтому username
+        выставляется здесь.
+        """
+
+        telegram_ids = dict(telegram_ids)
+        # транзакция сразу блокирует запись, поэтому бот не зарегистрирует тех же пользователей между запросами
+        with database.write_atomic():
+            # пользователи, зарегистрированные раньше, могли получить username по id,
+            # поэтому проверяется telegram_user_id
+            telegram_ids_to_skip = cls.objects.filter(
+                telegram_user_id__in = telegram_ids
+            ).values_list("telegram_user_id", flat = True)
+            for telegram_user_id in telegram_ids_to_skip:
+                telegram_ids.pop(telegram_user_id, None)
+
+            users = []
+            for telegram_user_id, telegram_chat_id in telegram_ids.items():
+                user = cls(telegram_user_id = telegram_user_id, telegram_chat_id = telegram_chat_id)
+                user.username = user.get_placeholder_username()
+                users.append(user)
+            # временные имена не совпадают с именами других пользователей, а повторная регистрация исключена
+            # проверкой выше под блокировкой записи, поэтому все пользователи вставляются
+            cls.objects.bulk_create(users, batch_size = batch_size)
+            cls.objects.filter(telegram_user_id__in = telegram_ids).update(
+                username = Concat(models.Value("user_"), Cast("id", models.CharField()))
+            )
+            return len(users)
@@ -1,12 +1,32 @@
 import logging
+import threading
 
 from core.apps import CoreConfig
 from secret_keeper import SecretKeeper
 
 
-class Settings:
+class SettingsMeta(type):
+    """Создает один объект настроек на класс: повторный вызов Settings() возвращает уже созданный объект."""
+
+    def __init__(cls, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        cls._instance = None
+        cls._instance_lock = threading.Lock()
+
+    def __call__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = super().__call__()
+        return cls._instance
+
+
+class Settings(metaclass = SettingsMeta):
     APP_NAME = CoreConfig.name
 
+    _secrets: SecretKeeper | None = None
+    _secrets_lock = threading.Lock()
+
     def __init__(self) -> None:
         # Пути секретов
         self.SECRETS_FOLDER = "secrets"
@@ -31,5 +51,39 @@ class Settings:
         self.LOG_FOLDER = "logs"
         self.CONSOLE_LOG_LEVEL = logging.DEBUG
         self.FILE_LOG_LEVEL = logging.DEBUG
+        # писать в файл JSON Lines вместо текста
+        self.LOG_JSON = False
+        # доля записываемых DEBUG-сообщений (1 - все)
+        self.LOG_DEBUG_SAMPLE_RATE = 1
+
+        # Метрики
+        # период (в секундах) записи сводки метрик в лог процессом бота, 0 - не записывать
+        self.METRICS_LOG_PERIOD = 60
+
+        # Настройки БД (значения из секретов имеют приоритет)
+        # время (в секундах) жизни постоянного соединения, None - без ограничения
+        self.DATABASE_CONN_MAX_AGE = 600
+        # проверять постоянное соединение перед использованием в новом запросе
+        self.DATABASE_CONN_HEALTH_CHECKS = True
+        # WAL позволяет читать во время записи
+        self.SQLITE_JOURNAL_MODE = "WAL"
+        # в режиме WAL NORMAL не теряет целостность, но не ждет fsync на каждую транзакцию
+        self.SQLITE_SYNCHRONOUS = "NORMAL"
+        # время (в секундах) ожидания блокировки записи вместо ошибки "database is locked"
+        self.SQLITE_BUSY_TIMEOUT = 5
+        # пул соединений PostgreSQL (Django 5.1+ и psycopg[pool]), None - постоянные соединения без пула;
+        # с закрепленной в requirements.txt Django 5.0 не применяется, пул в этом случае дает PgBouncer
+        self.POSTGRES_POOL = {"min_size": 2, "max_size": 20}
+        # соединения идут через PgBouncer в режиме pool_mode = transaction
+        self.POSTGRES_PGBOUNCER = False
+
+        # настройки приложений наследуют эти пути, поэтому секреты общие для всех классов настроек
+        self.secrets = self.get_secret_keeper(self)
 
-        self.secrets = SecretKeeper(self)
+    @staticmethod
+    def get_secret_keeper(settings: "Settings") -> SecretKeeper:
+        if Settings._secrets is None:
+            with Settings._secrets_lock:
+                if Settings._secrets is None:
+                    Settings._secrets = SecretKeeper(settings)
+        return Settings._secrets
@@ -0,0 +1,20 @@
+from pathlib import Path
+
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Создает тестовые БД SQLite в файле рядом с рабочей БД, если TEST.NAME не задан явно.
+
+    Тестовая БД в памяти с общим кэшем блокирует таблицы без ожидания, поэтому тесты с потоками бота
+    (SimulatorTests) падали бы с "database table is locked".
+    """
+
+    def setup_databases(self, **kwargs):
+        for connection in connections.all(initialized_only = False):
+            test_settings = connection.settings_dict["TEST"]
+            if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+                name = Path(str(connection.settings_dict["NAME"]))
+                test_settings["NAME"] = str(name.with_name(f"test_{name.name}"))
+        return super().setup_databases(**kwargs)
@@ -1,3 +1,290 @@
-from django.test import TestCase
+import json
+import logging
+import queue
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+from unittest import mock
 
-# Create your tests here.
+import django
+from django.contrib import admin
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import logger
+from core import database, models
+from core.admin import CoreAdmin
+from core.paginator import EstimatedCountPaginator
+from core.settings import Settings
+from secret_keeper import SecretKeeper
+from survey import models as survey_models
+from survey.settings import Settings as SurveySettings
+
+
+class UserTests(TestCase):
+    def test_default_usernames_do_not_collide(self) -> None:
+        user = models.User.objects.create()
+        # telegram_user_id совпадает с id уже зарегистрированного пользователя
+        telegram_user = models.User.objects.create(telegram_user_id = user.id, telegram_chat_id = user.id)
+
+        self.assertEqual(user.username, f"user_{user.id}")
+        self.assertEqual(telegram_user.username, f"user_{telegram_user.id}")
+        self.assertEqual(
+            set(models.User.objects.values_list("username", flat = True)),
+            {user.username, telegram_user.username}
+        )
+
+    def test_failed_registration_leaves_no_placeholder(self) -> None:
+        last_id = models.User.objects.create().id
+        # имя следующего пользователя уже занято
+        models.User.objects.create(username = f"user_{last_id + 2}")
+        user = models.User(telegram_user_id = 1, telegram_chat_id = 1)
+
+        with self.assertRaises(IntegrityError):
+            user.save()
+        self.assertEqual(user.username, "")
+        self.assertFalse(models.User.objects.filter(telegram_user_id = 1).exists())
+
+    def test_bulk_register_returns_inserted_count(self) -> None:
+        models.User.objects.create(telegram_user_id = 1, telegram_chat_id = 1)
+
+        self.assertEqual(models.User.bulk_register([(1, 1), (2, 2), (3, 3)]), 2)
+        self.assertEqual(
+            {x.telegram_user_id: x.username for x in models.User.objects.exclude(telegram_user_id = None)},
+            {x.telegram_user_id: f"user_{x.id}" for x in models.User.objects.exclude(telegram_user_id = None)}
+        )
+        self.assertEqual(models.User.objects.filter(telegram_user_id__in = [2, 3]).count(), 2)
+        self.assertEqual(models.User.bulk_register([(3, 3)]), 0)
+
+
+class CoreAdminTests(TestCase):
+    def test_list_select_related_is_derived_from_foreign_keys(self) -> None:
+        class AnswerAdmin(CoreAdmin):
+            model = survey_models.Answer
+            hidden_fields = ("user",)
+            extra_list_select_related = ("attempt__user",)
+
+        model_admin = AnswerAdmin(survey_models.Answer, admin.site)
+        # скрытые колонки не загружаются, message_id и answered - не связи
+        self.assertEqual(
+            model_admin.list_select_related,
+            ("attempt", "quiz", "question", "prepared_answer", "attempt__user")
+        )
+
+        class ExplicitAnswerAdmin(AnswerAdmin):
+            list_select_related = ("quiz",)
+
+        self.assertEqual(ExplicitAnswerAdmin(survey_models.Answer, admin.site).list_select_related, ("quiz",))
+
+    def test_changelist_queries_do_not_depend_on_rows(self) -> None:
+        user = models.User.objects.create_superuser("admin", password = "password")
+        self.client.force_login(user)
+        quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        question = survey_models.Question.objects.create(quiz = quiz, text = "Вопрос")
+        prepared_answer = survey_models.PreparedAnswer.objects.create(question = question, text = "Да")
+        url = reverse("admin:survey_answer_changelist")
+
+        queries = []
+        for _ in range(2):
+            # во второй раз в списке три ответа разных пользователей
+            for _ in range(1 + 2 * len(queries)):
+                answer_user = models.User.objects.create()
+                attempt = survey_models.QuizAttempt.objects.create(user = answer_user, quiz = quiz)
+                survey_models.Answer.objects.create(
+                    attempt = attempt,
+                    user = answer_user,
+                    quiz = quiz,
+                    question = question,
+                    prepared_answer = prepared_answer
+                )
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self) -> None:
+        self.users = [models.User.objects.create() for _ in range(5)]
+
+    def test_unfiltered_count_is_estimated(self) -> None:
+        self.users[1].delete()
+        paginator = EstimatedCountPaginator(models.User.objects.order_by("id"), 2)
+
+        with mock.patch.object(EstimatedCountPaginator, "ESTIMATE_THRESHOLD", 1):
+            # оценка SQLite - MAX(rowid), удаленная строка ее не уменьшает
+            self.assertEqual(paginator.count, self.users[-1].id)
+            self.assertEqual(paginator.num_pages, (self.users[-1].id + 1) // 2)
+
+    def test_small_table_is_counted(self) -> None:
+        self.users[1].delete()
+        paginator = EstimatedCountPaginator(models.User.objects.order_by("id"), 2)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(paginator.count, 4)
+
+    def test_filtered_count_is_exact(self) -> None:
+        queryset = models.User.objects.filter(id__in = [x.id for x in self.users[:2]]).order_by("id")
+
+        with mock.patch.object(EstimatedCountPaginator, "ESTIMATE_THRESHOLD", 1):
+            with self.assertNumQueries(1):
+                self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 2)
+
+    def test_empty_table(self) -> None:
+        models.User.objects.all().delete()
+
+        with mock.patch.object(EstimatedCountPaginator, "ESTIMATE_THRESHOLD", 0):
+            self.assertIsNone(EstimatedCountPaginator.get_estimate(models.User, "default"))
+            self.assertEqual(EstimatedCountPaginator(models.User.objects.order_by("id"), 2).count, 0)
+
+
+class DatabaseSettingsTests(TestCase):
+    SQLITE = {"ENGINE": "django.db.backends.sqlite3", "NAME": "db.sqlite3"}
+    POSTGRES = {"ENGINE": "django.db.backends.postgresql", "NAME": "teleeng"}
+
+    def setUp(self) -> None:
+        self.settings = Settings()
+
+    def get_database(self, database_settings: dict) -> dict:
+        return database.get_databases({"default": database_settings}, self.settings)["default"]
+
+    def test_sqlite(self) -> None:
+        database_settings = self.get_database(self.SQLITE)
+
+        self.assertEqual(database_settings["ENGINE"], "core.backends.sqlite3")
+        # BEGIN IMMEDIATE нужен только транзакциям записи, поэтому transaction_mode не выставляется
+        self.assertEqual(database_settings["OPTIONS"], {"timeout": self.settings.SQLITE_BUSY_TIMEOUT})
+        self.assertEqual(database_settings["CONN_MAX_AGE"], self.settings.DATABASE_CONN_MAX_AGE)
+        self.assertEqual(self.SQLITE["ENGINE"], "django.db.backends.sqlite3")
+
+    def test_postgres_without_pool(self) -> None:
+        # закрепленная в requirements.txt версия Django не поддерживает пул соединений
+        with mock.patch.object(django, "VERSION", (5, 0, 5, "final", 0)):
+            database_settings = self.get_database(self.POSTGRES)
+
+        self.assertEqual(database_settings["OPTIONS"], {})
+        self.assertEqual(database_settings["CONN_MAX_AGE"], self.settings.DATABASE_CONN_MAX_AGE)
+        self.assertNotIn("DISABLE_SERVER_SIDE_CURSORS", database_settings)
+
+    def test_postgres_pool(self) -> None:
+        with mock.patch.object(django, "VERSION", (5, 1, 0, "final", 0)):
+            database_settings = self.get_database(self.POSTGRES)
+
+        self.assertEqual(database_settings["OPTIONS"], {"pool": self.settings.POSTGRES_POOL})
+        self.assertEqual(database_settings["CONN_MAX_AGE"], 0)
+
+    def test_postgres_pgbouncer(self) -> None:
+        with mock.patch.object(self.settings, "POSTGRES_PGBOUNCER", True):
+            database_settings = self.get_database(self.POSTGRES)
+
+        self.assertTrue(database_settings["DISABLE_SERVER_SIDE_CURSORS"])
+
+
+class WriteAtomicTests(TransactionTestCase):
+    def get_begin_queries(self, atomic: Callable) -> list[str]:
+        with CaptureQueriesContext(connection) as context:
+            with atomic():
+                models.User.objects.exists()
+        return [x["sql"] for x in context.captured_queries if x["sql"].startswith("BEGIN")]
+
+    def test_only_write_transactions_are_immediate(self) -> None:
+        # транзакция только для чтения (снимок каталога) не ждет блокировку записи
+        self.assertEqual(self.get_begin_queries(transaction.atomic), ["BEGIN"])
+        self.assertEqual(self.get_begin_queries(database.write_atomic), ["BEGIN IMMEDIATE"])
+        self.assertFalse(connection.begin_immediate)
+
+    def test_nested_write_transaction(self) -> None:
+        with transaction.atomic():
+            with database.write_atomic():
+                models.User.objects.create()
+            self.assertFalse(connection.begin_immediate)
+        self.assertEqual(models.User.objects.count(), 1)
+
+
+class SettingsTests(TestCase):
+    def test_instance_is_shared(self) -> None:
+        self.assertIs(Settings(), Settings())
+        self.assertIs(SurveySettings(), SurveySettings())
+        # у каждого класса настроек свой объект, но секреты общие
+        self.assertIsNot(SurveySettings(), Settings())
+        self.assertIsInstance(SurveySettings(), SurveySettings)
+        self.assertIs(SurveySettings().secrets, Settings().secrets)
+
+    def test_instance_is_created_once_by_threads(self) -> None:
+        calls = []
+
+        class CountingSettings(Settings):
+            def __init__(self) -> None:
+                calls.append(threading.current_thread())
+                # другие потоки успевают вызвать CountingSettings(), пока объект создается
+                time.sleep(0.01)
+                super().__init__()
+
+        barrier = threading.Barrier(4)
+        instances = []
+
+        def create() -> None:
+            barrier.wait()
+            instances.append(CountingSettings())
+
+        threads = [threading.Thread(target = create) for _ in range(barrier.parties)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({id(x) for x in instances}), 1)
+
+
+class SecretKeeperTests(TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        (self.directory / "telegram_bot.json").write_text(json.dumps({"token": "token"}), encoding = "utf-8")
+        settings = mock.Mock(
+            DATABASE_CREDENTIALS_PATH = str(self.directory / "missing.json"),
+            TELEGRAM_BOT_CREDENTIALS_PATH = str(self.directory / "telegram_bot.json"),
+            DJANGO_CREDENTIALS_PATH = str(self.directory / "missing.json"),
+            ADMIN_USER_CREDENTIALS_PATH = str(self.directory / "missing.json")
+        )
+        self.keeper = SecretKeeper(settings)
+
+    def test_module_is_loaded_on_first_access(self) -> None:
+        # файлы не читаются при создании, поэтому отсутствующие секреты не мешают остальным
+        self.assertNotIn("telegram_bot", self.keeper.__dict__)
+
+        with mock.patch.object(SecretKeeper, "read_json", wraps = SecretKeeper.read_json) as read_json:
+            self.assertEqual(self.keeper.telegram_bot.token, "token")
+            self.assertIs(self.keeper.telegram_bot, self.keeper.telegram_bot)
+        read_json.assert_called_once_with(str(self.directory / "telegram_bot.json"))
+        self.assertEqual(self.keeper.telegram_bot.get_dict(), {"token": "token"})
+
+    def test_missing_secrets(self) -> None:
+        with self.assertRaises(FileNotFoundError):
+            # noinspection PyStatementEffect
+            self.keeper.database
+        with self.assertRaises(AttributeError):
+            # noinspection PyStatementEffect
+            self.keeper.unknown
+
+
+class LoggerTests(TestCase):
+    def test_queued_exception_is_formatted_as_json(self) -> None:
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            record = logging.LogRecord("test", logging.ERROR, __file__, 1, "failed: %s", ("update",), sys.exc_info())
+        queued = logger.QueueHandler(queue.SimpleQueue()).prepare(record)
+
+        data = json.loads(logger.JsonFormatter().format(queued))
+        self.assertEqual(data["message"], "failed: update")
+        self.assertIn("ValueError: broken", data["exception"])
+        # текстовый формат по-прежнему выводит traceback после сообщения
+        self.assertIn("ValueError: broken", logging.Formatter().format(queued))
@@ -1,3 +1,9 @@
-from django.shortcuts import render
+from django.http import HttpRequest, HttpResponse
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from core import metrics as core_metrics
+
+
+@require_GET
+def metrics(request: HttpRequest) -> HttpResponse:
+    return HttpResponse(core_metrics.REGISTRY.render(), content_type = "text/plain; version=0.0.4; charset=utf-8")
@@ -1,11 +1,80 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
 from pathlib import Path
 
 from core import settings
 
 
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON, для загрузки логов в системы сбора логов."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "name": record.name,
+            "file": record.filename,
+            "function": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        # из очереди запись приходит с готовым текстом исключения (exc_text) и без exc_info
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, ensure_ascii = False)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Передает в очередь сообщение без traceback, а текст исключения - отдельно в exc_text.
+
+    Стандартный prepare дописывает traceback в текст сообщения и удаляет exc_info, поэтому JsonFormatter не видел
+    исключений. Сам exc_info в очередь не передается: traceback держит ссылки на кадры стека потока, который записал
+    сообщение.
+    """
+
+    EXCEPTION_FORMATTER = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.EXCEPTION_FORMATTER.formatException(record.exc_info)
+        record.message = message
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class DebugSampleFilter(logging.Filter):
+    """Пропускает только часть DEBUG-сообщений, остальные уровни - все."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno != logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
 class Logger:
-    """Обертка для logging <https://docs.python.org/3/library/logging.html>."""
+    """Обертка для logging <https://docs.python.org/3/library/logging.html>.
+
+    Все логгеры пишут через одну очередь, а в файлы и консоль записи выводит фоновый поток QueueListener,
+    поэтому запись лога не блокирует обработчики, а каждый файл открыт один раз.
+    """
 
     settings = settings.Settings()
 
@@ -16,41 +85,85 @@ class Logger:
         logging.DEBUG: "debug"
     }
 
+    _queue_handler: logging.handlers.QueueHandler | None = None
+    _listener: logging.handlers.QueueListener | None = None
+    _lock = threading.Lock()
+
     @staticmethod
     def get_function_real_filename(function):
         return function.__globals__["__file__"].split('\\')[-1]
 
     @classmethod
     def get_log_filepath(cls, filename):
-        return f"{cls.settings.LOG_FOLDER}/{filename}.log"
+        extension = "jsonl" if cls.settings.LOG_JSON else "log"
+        return f"{cls.settings.LOG_FOLDER}/{filename}.{extension}"
 
     @classmethod
     def construct_handler(cls, log_level = logging.INFO, to_console = False):
         if to_console:
             handler = logging.StreamHandler()
+            handler.setFormatter(cls.LOG_FORMATTER)
         else:
             # в файл
-            handler = logging.FileHandler(cls.get_log_filepath(cls.LOG_LEVEL_NAMES[log_level]))
+            handler = logging.FileHandler(cls.get_log_filepath(cls.LOG_LEVEL_NAMES[log_level]), encoding = "utf-8")
+            handler.setFormatter(JsonFormatter() if cls.settings.LOG_JSON else cls.LOG_FORMATTER)
         handler.setLevel(log_level)
-        handler.setFormatter(cls.LOG_FORMATTER)
         return handler
 
+    @classmethod
+    def get_queue_handler(cls) -> logging.handlers.QueueHandler:
+        if cls._queue_handler is None:
+            with cls._lock:
+                if cls._queue_handler is None:
+                    # создает папку для логов, если ее нет
+                    Path(cls.settings.LOG_FOLDER).mkdir(parents = True, exist_ok = True)
+                    handlers = (
+                        # в файл
+                        cls.construct_handler(cls.settings.FILE_LOG_LEVEL),
+                        # в консоль
+                        cls.construct_handler(cls.settings.CONSOLE_LOG_LEVEL, True)
+                    )
+                    # неограниченная очередь - put никогда не ждет
+                    queue_handler = QueueHandler(queue.SimpleQueue())
+                    queue_handler.addFilter(DebugSampleFilter(cls.settings.LOG_DEBUG_SAMPLE_RATE))
+                    cls._listener = logging.handlers.QueueListener(
+                        queue_handler.queue,
+                        *handlers,
+                        respect_handler_level = True
+                    )
+                    cls._listener.start()
+                    # при завершении процесса записи из очереди дописываются
+                    atexit.register(cls.stop_listener)
+                    cls._queue_handler = queue_handler
+        return cls._queue_handler
+
+    @classmethod
+    def stop_listener(cls) -> None:
+        if cls._listener is not None and cls._listener._thread is not None:
+            cls._listener.stop()
+
+    @classmethod
+    def restart_listener(cls) -> None:
+        # поток не переживает fork (например, в воркерах web-сервера), поэтому в дочернем процессе запускается заново
+        if cls._listener is not None:
+            # записи, не выведенные до fork, выведет родительский процесс
+            cls._queue_handler.queue = cls._listener.queue = queue.SimpleQueue()
+            cls._listener._thread = None
+            cls._listener.start()
+
     # уровни отображения логов описаны в documentation/LOGGING.md в разделе Информация о логировании
     def __new__(cls, logger_name: str) -> logging.LoggerAdapter:
-        # создает папку для логов, если ее нет
-        Path(cls.settings.LOG_FOLDER).mkdir(parents = True, exist_ok = True)
         logger = logging.getLogger(logger_name)
         logger.setLevel(logging.DEBUG)
-        logger.handlers = [
-            # в файл
-            cls.construct_handler(cls.settings.FILE_LOG_LEVEL),
-            # в консоль
-            cls.construct_handler(cls.settings.CONSOLE_LOG_LEVEL, True)
-        ]
+        logger.handlers = [cls.get_queue_handler()]
         logger = logging.LoggerAdapter(logger)
         return logger
 
 
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = Logger.restart_listener)
+
+
 # для проверки логгера
 if __name__ == "__main__":
     test_logger = Logger(__name__)
@@ -1,4 +1,5 @@
 import json
+import threading
 
 from typing import TYPE_CHECKING
 
@@ -27,6 +28,8 @@ class SecretKeeper:
 
     class TelegramBot(Module):
         token: str
+        webhook_url: str
+        webhook_secret_token: str
 
     class Django(Module):
         secret_key: str
@@ -43,11 +46,25 @@ class SecretKeeper:
     admin_user: User
 
     def __init__(self, settings: "Settings") -> None:
+        # {модуль: путь к файлу}, файл читается при первом обращении к модулю
+        self.paths: dict[str, str] = {}
+        self._lock = threading.Lock()
+
         self.add_module("database", settings.DATABASE_CREDENTIALS_PATH)
         self.add_module("telegram_bot", settings.TELEGRAM_BOT_CREDENTIALS_PATH)
         self.add_module("django", settings.DJANGO_CREDENTIALS_PATH)
         self.add_module("admin_user", settings.ADMIN_USER_CREDENTIALS_PATH)
 
+    def __getattr__(self, name: str) -> Module:
+        # вызывается только для модулей, которые еще не загружены
+        paths = self.__dict__.get("paths", {})
+        if name not in paths:
+            raise AttributeError(f"{self.__class__.__name__} has no module {name}")
+        with self._lock:
+            if name not in self.__dict__:
+                self.load_module(name, paths[name])
+        return self.__dict__[name]
+
     @staticmethod
     def read_json(path: str) -> dict:
         with open(path, 'r') as file:
@@ -55,6 +72,9 @@ class SecretKeeper:
         return data
 
     def add_module(self, name: str, secrets_path: str) -> None:
+        self.paths[name] = secrets_path
+
+    def load_module(self, name: str, secrets_path: str) -> None:
         json_dict = self.read_json(secrets_path)
         module = type(name, (self.Module,), json_dict)()
         module.name = name
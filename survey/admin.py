@@ -1,5 +1,9 @@
+from django.contrib import admin
+from django.http import StreamingHttpResponse
+
 from core import admin as core_admin
 from survey import models as survey_models
+from survey.exporter import AnswerExporter
 from survey.settings import Settings
 
 
@@ -10,19 +14,80 @@ class SurveyAdmin(core_admin.CoreAdmin):
 
 class QuizAdmin(SurveyAdmin):
     model = survey_models.Quiz
+    actions = ("export_answers_csv", "export_answers_json_lines")
+
+    @staticmethod
+    def export_answers(queryset, export_format: str) -> StreamingHttpResponse:
+        exporter = AnswerExporter(queryset.values_list("id", flat = True))
+        response = StreamingHttpResponse(
+            exporter.stream(export_format),
+            content_type = exporter.CONTENT_TYPES[export_format]
+        )
+        response["Content-Disposition"] = f'attachment; filename="answers.{export_format}"'
+        return response
+
+    # noinspection PyUnusedLocal
+    @admin.action(description = "Выгрузить ответы в CSV")
+    def export_answers_csv(self, request, queryset) -> StreamingHttpResponse:
+        return self.export_answers(queryset, AnswerExporter.CSV)
+
+    # noinspection PyUnusedLocal
+    @admin.action(description = "Выгрузить ответы в JSON Lines")
+    def export_answers_json_lines(self, request, queryset) -> StreamingHttpResponse:
+        return self.export_answers(queryset, AnswerExporter.JSON_LINES)
 
 
 class QuestionAdmin(SurveyAdmin):
     model = survey_models.Question
+    list_filter = ("quiz",)
 
 
 class PreparedQuestionAdmin(SurveyAdmin):
     model = survey_models.PreparedAnswer
+    extra_list_select_related = ("question__quiz",)
+    list_filter = ("question__quiz",)
+
+
+class QuizAttemptAdmin(SurveyAdmin):
+    model = survey_models.QuizAttempt
+    estimated_count = True
+    list_filter = ("quiz", "archived")
+    # поиск пользователя по индексу, а не выбор из списка всех пользователей
+    search_fields = ("=user__telegram_user_id",)
 
 
 class AnswerAdmin(SurveyAdmin):
     model = survey_models.Answer
+    extra_list_select_related = ("attempt__user", "attempt__quiz")
+    estimated_count = True
+    list_filter = ("quiz",)
+    search_fields = ("=user__telegram_user_id",)
+
+
+class QuizStatisticsAdmin(SurveyAdmin):
+    model = survey_models.QuizStatistics
+
+
+class QuestionStatisticsAdmin(SurveyAdmin):
+    model = survey_models.QuestionStatistics
+    extra_list_select_related = ("question__quiz",)
+    list_filter = ("question__quiz",)
+
+
+class PreparedAnswerStatisticsAdmin(SurveyAdmin):
+    model = survey_models.PreparedAnswerStatistics
+    extra_list_select_related = ("prepared_answer__question__quiz",)
+    list_filter = ("prepared_answer__question__quiz",)
 
 
-model_admins_to_register = [QuizAdmin, QuestionAdmin, PreparedQuestionAdmin, AnswerAdmin]
+model_admins_to_register = [
+    QuizAdmin,
+    QuestionAdmin,
+    PreparedQuestionAdmin,
+    QuizAttemptAdmin,
+    AnswerAdmin,
+    QuizStatisticsAdmin,
+    QuestionStatisticsAdmin,
+    PreparedAnswerStatisticsAdmin
+]
 core_admin.register_models(model_admins_to_register)
@@ -0,0 +1,134 @@
+import atexit
+import threading
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, close_old_connections, connections
+
+import logger
+from survey import models as survey_models
+from survey.settings import Settings
+
+
+class AnswerSink:
+    """Накапливает ответы в памяти и записывает их в БД пачками.
+
+    Пачка записывается при накоплении ANSWER_SINK_BATCH_SIZE ответов, раз в ANSWER_SINK_FLUSH_PERIOD секунд и при
+    завершении процесса. При ANSWER_SINK_DURABLE ответы записываются сразу, без буфера. Буфер не превышает
+    ANSWER_SINK_MAX_BUFFER_SIZE: заполненный буфер записывает поток, добавивший ответ.
+    """
+
+    settings = Settings()
+
+    def __init__(self) -> None:
+        self.logger = logger.Logger(self.__class__.__name__)
+        self.batch_size = self.settings.ANSWER_SINK_BATCH_SIZE
+        self.flush_period = self.settings.ANSWER_SINK_FLUSH_PERIOD
+        self.durable = self.settings.ANSWER_SINK_DURABLE
+        self.max_buffer_size = self.settings.ANSWER_SINK_MAX_BUFFER_SIZE
+        self._buffer: list[survey_models.Answer] = []
+        self._buffer_lock = threading.Lock()
+        # не дает двум записям пачек выполняться одновременно
+        self._flush_lock = threading.Lock()
+        self._full = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        atexit.register(self.flush)
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def add(self, answer: survey_models.Answer) -> None:
+        if self.durable or not self.running:
+            survey_models.Answer.upsert([answer])
+        elif self.append(answer):
+            self.flush()
+
+    async def aadd(self, answer: survey_models.Answer) -> None:
+        if self.durable or not self.running:
+            await sync_to_async(survey_models.Answer.upsert)([answer])
+        elif self.append(answer):
+            await sync_to_async(self.flush)()
+
+    def append(self, answer: survey_models.Answer) -> bool:
+        # True, если буфер заполнен: фоновая запись не успевает, и пачку записывает добавивший ответ поток
+        with self._buffer_lock:
+            self._buffer.append(answer)
+            size = len(self._buffer)
+        if size >= self.batch_size:
+            self._full.set()
+        return size >= self.max_buffer_size
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._buffer_lock:
+                answers = self._buffer
+                self._buffer = []
+            if not answers:
+                return 0
+            try:
+                survey_models.Answer.upsert(answers, self.batch_size)
+                written = len(answers)
+            except IntegrityError:
+                # ответ на попытку или вопрос, удаленные после ответа, не должен блокировать остальные ответы
+                written = self.write_separately(answers)
+            except Exception:
+                # ответы вернутся в буфер и будут записаны со следующей пачкой
+                self.requeue(answers)
+                raise
+        self.logger.debug(f"Flushed answers: {written}")
+        return written
+
+    def write_separately(self, answers: list[survey_models.Answer]) -> int:
+        written = 0
+        for number, answer in enumerate(answers):
+            try:
+                survey_models.Answer.upsert([answer])
+                written += 1
+            except IntegrityError as error:
+                self.logger.warning(
+                    f"Answer is dropped (attempt {answer.attempt_id}, question {answer.question_id}): {error}"
+                )
+            except Exception:
+                self.requeue(answers[number:])
+                raise
+        return written
+
+    def requeue(self, answers: list[survey_models.Answer]) -> None:
+        with self._buffer_lock:
+            self._buffer[:0] = answers
+            overflow = len(self._buffer) - self.max_buffer_size
+            if overflow > 0:
+                del self._buffer[:overflow]
+        if overflow > 0:
+            self.logger.error(f"Answer buffer is full, the oldest answers are dropped: {overflow}")
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target = self.work, name = self.__class__.__name__, daemon = True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._full.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def work(self) -> None:
+        while not self._stopped.is_set():
+            self._full.wait(self.flush_period)
+            self._full.clear()
+            try:
+                self.flush()
+            except Exception as error:
+                self.logger.exception(error)
+            close_old_connections()
+        # постоянные соединения завершившегося потока иначе остались бы открытыми до сборки мусора
+        connections.close_all()
@@ -0,0 +1,79 @@
+import csv
+import json
+from typing import Iterable, Iterator, TextIO
+
+from survey import models, settings
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи, чтобы ее можно было отдавать по частям."""
+
+    @staticmethod
+    def write(value: str) -> str:
+        return value
+
+
+class AnswerExporter:
+    """Выгружает ответы построчно, не загружая их в память целиком."""
+
+    settings = settings.Settings()
+
+    CSV = "csv"
+    JSON_LINES = "jsonl"
+    FORMATS = (CSV, JSON_LINES)
+    CONTENT_TYPES = {
+        CSV: "text/csv",
+        JSON_LINES: "application/jsonl"
+    }
+
+    # (название колонки, поле для values_list)
+    COLUMNS = (
+        ("quiz_id", "quiz_id"),
+        ("quiz", "quiz__name"),
+        ("attempt_id", "attempt_id"),
+        ("user_id", "user_id"),
+        ("telegram_user_id", "user__telegram_user_id"),
+        ("question_id", "question_id"),
+        ("question", "question__text"),
+        ("prepared_answer", "prepared_answer__text"),
+        ("message_id", "message_id"),
+        ("answered", "answered")
+    )
+
+    def __init__(self, quiz_ids: Iterable[int] = None, chunk_size: int = None) -> None:
+        self.quiz_ids = None if quiz_ids is None else list(quiz_ids)
+        if chunk_size is None:
+            chunk_size = self.settings.ANSWER_EXPORT_CHUNK_SIZE
+        self.chunk_size = chunk_size
+        self.count = 0
+
+    def get_queryset(self):
+        answers = models.Answer.objects.all()
+        if self.quiz_ids is not None:
+            answers = answers.filter(quiz_id__in = self.quiz_ids)
+        # values_list делает JOIN в том же запросе (как select_related), но не создает объекты моделей
+        return answers.order_by("quiz_id", "id").values_list(*(field for _, field in self.COLUMNS))
+
+    def get_rows(self) -> Iterator[tuple]:
+        # iterator читает строки с сервера частями, не кэшируя весь результат
+        for row in self.get_queryset().iterator(chunk_size = self.chunk_size):
+            self.count += 1
+            yield row
+
+    def stream(self, export_format: str) -> Iterator[str]:
+        header = [name for name, _ in self.COLUMNS]
+        if export_format == self.CSV:
+            writer = csv.writer(Echo())
+            yield writer.writerow(header)
+            for row in self.get_rows():
+                yield writer.writerow(row)
+        elif export_format == self.JSON_LINES:
+            for row in self.get_rows():
+                yield json.dumps(dict(zip(header, row)), ensure_ascii = False, default = str) + "\n"
+        else:
+            raise ValueError(f"Unknown export format: {export_format}")
+
+    def write(self, file: TextIO, export_format: str) -> int:
+        for line in self.stream(export_format):
+            file.write(line)
+        return self.count
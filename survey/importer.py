@@ -0,0 +1,166 @@
+import json
+from typing import Iterable, Iterator
+
+import logger
+from survey import models, settings
+
+
+class QuizReader:
+    """Читает опросы из файла по одному, не загружая файл целиком.
+
+    Поддерживаются JSON-массив опросов и JSON Lines (один опрос на строку, расширение .jsonl).
+    """
+
+    settings = settings.Settings()
+    JSON_LINES_EXTENSION = ".jsonl"
+    WHITESPACE = " \t\r\n"
+    # самая длинная лексема JSON, которую может разрезать граница части файла (суррогатная пара \uXXXX\uXXXX)
+    MAX_TOKEN_LENGTH = 12
+
+    def __init__(self, path: str, chunk_size: int = None) -> None:
+        self.path = path
+        if chunk_size is None:
+            chunk_size = self.settings.QUIZ_IMPORT_CHUNK_SIZE
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+    def __iter__(self) -> Iterator[dict]:
+        with open(self.path, 'r', encoding = "utf-8") as file:
+            if self.path.endswith(self.JSON_LINES_EXTENSION):
+                yield from self.read_lines(file)
+            else:
+                yield from self.read_array(file)
+
+    @classmethod
+    def is_incomplete(cls, error: json.JSONDecodeError, buffer_size: int) -> bool:
+        # строка может продолжаться в следующей части файла, остальные ошибки недочитанного опроса
+        # указывают на начало лексемы, разрезанной границей части
+        return error.msg.startswith("Unterminated string") or error.pos + cls.MAX_TOKEN_LENGTH >= buffer_size
+
+    def read_lines(self, file) -> Iterator[dict]:
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as error:
+                    raise ValueError(f"Malformed quiz in {self.path} at line {number}: {error.msg}") from error
+
+    def read_array(self, file) -> Iterator[dict]:
+        buffer = ""
+        position = 0
+        # количество символов файла, отброшенных из начала буфера
+        offset = 0
+        # ожидается: "[" - начало массива, "item" - опрос, "item_or_end" - первый опрос или "]",
+        # "separator" - "," или "]" после опроса
+        expected = "["
+        eof = False
+        while expected is not None:
+            while position < len(buffer) and buffer[position] in self.WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                char = buffer[position]
+                if expected == "[":
+                    if char != "[":
+                        raise ValueError(f"{self.path} must contain a JSON array of quizzes")
+                    expected = "item_or_end"
+                    position += 1
+                    continue
+                if expected in ("item_or_end", "separator") and char == "]":
+                    expected = None
+                    continue
+                if expected == "separator":
+                    if char != ",":
+                        raise ValueError(f"Malformed quiz list in {self.path} at character {offset + position}")
+                    expected = "item"
+                    position += 1
+                    continue
+                try:
+                    quiz_json, end = self.decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as error:
+                    # недочитанный опрос разбирается после чтения следующей части файла, а ошибка далеко от конца
+                    # буфера означает испорченный файл, и остаток файла не нужно читать в память
+                    if eof or not self.is_incomplete(error, len(buffer)):
+                        raise ValueError(
+                            f"Malformed quiz in {self.path} at character {offset + error.pos}: {error.msg}"
+                        ) from error
+                else:
+                    yield quiz_json
+                    position = end
+                    expected = "separator"
+                    continue
+            if eof:
+                raise ValueError(f"Unexpected end of {self.path}")
+            # прочитанная часть буфера больше не нужна
+            buffer = buffer[position:]
+            offset += position
+            position = 0
+            chunk = file.read(self.chunk_size)
+            eof = chunk == ""
+            buffer += chunk
+
+
+class QuizImporter:
+    """Создает опросы пачками ограниченного размера, поэтому память не растет вместе с размером каталога."""
+
+    settings = settings.Settings()
+
+    def __init__(self, batch_size: int = None) -> None:
+        self.logger = logger.Logger(self.__class__.__name__)
+        if batch_size is None:
+            batch_size = self.settings.QUIZ_IMPORT_BATCH_SIZE
+        self.batch_size = batch_size
+        self.quizzes: list[models.Quiz] = []
+        self.questions: list[models.Question] = []
+        self.prepared_answers: list[models.PreparedAnswer] = []
+        self.quizzes_count = 0
+        self.questions_count = 0
+        self.prepared_answers_count = 0
+
+    @staticmethod
+    def build_quiz(
+            quiz_json: dict,
+            questions: list[models.Question],
+            prepared_answers: list[models.PreparedAnswer],
+            quiz: models.Quiz = None
+    ) -> models.Quiz:
+        if quiz is None:
+            quiz = models.Quiz(name = quiz_json["name"])
+        for question_json in quiz_json["questions"]:
+            question = models.Question(
+                quiz = quiz,
+                text = question_json["text"]
+            )
+            questions.append(question)
+            prepared_answers.extend(
+                models.PreparedAnswer(question = question, text = text)
+                for text in question_json.get("prepared_answers", [])
+            )
+        return quiz
+
+    def import_quizzes(self, quizzes_json: Iterable[dict]) -> None:
+        for quiz_json in quizzes_json:
+            self.quizzes.append(self.build_quiz(quiz_json, self.questions, self.prepared_answers))
+            if len(self.quizzes) + len(self.questions) + len(self.prepared_answers) >= self.batch_size:
+                self.flush()
+        self.flush()
+        self.logger.info(f"Created new quizzes: {self.quizzes_count}")
+        self.logger.info(f"Created new questions: {self.questions_count}")
+        self.logger.info(f"Created new prepared answers: {self.prepared_answers_count}")
+
+    def flush(self) -> None:
+        if not self.quizzes:
+            return
+        # id опросов и вопросов нужны следующей модели, поэтому порядок вставки важен
+        models.Quiz.objects.bulk_create(self.quizzes, batch_size = self.batch_size)
+        models.Question.objects.bulk_create(self.questions, batch_size = self.batch_size)
+        models.PreparedAnswer.objects.bulk_create(self.prepared_answers, batch_size = self.batch_size)
+        self.quizzes_count += len(self.quizzes)
+        self.questions_count += len(self.questions)
+        self.prepared_answers_count += len(self.prepared_answers)
+        self.quizzes.clear()
+        self.questions.clear()
+        self.prepared_answers.clear()
+        self.logger.info(
+            f"Imported {self.quizzes_count} quizzes, {self.questions_count} questions, "
+            f"{self.prepared_answers_count} prepared answers"
+        )
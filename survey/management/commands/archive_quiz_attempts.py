@@ -0,0 +1,57 @@
+import datetime
+
+from django.db import models as django_models
+from django.utils import timezone
+
+from core import database
+from survey import models
+from survey.statistics import Statistics
+from survey.management.commands import survey_command
+
+
+class Command(survey_command.SurveyCommand):
+    help = "Помечает попытки, замененные повторным прохождением опроса, и удаляет старые архивные попытки"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--purge-days",
+            type = int,
+            default = None,
+            help = "Удалить архивные попытки (вместе с ответами), начатые раньше указанного числа дней назад"
+        )
+        parser.add_argument("--batch-size", type = int, default = 1000, help = "Размер пачки удаляемых попыток")
+
+    def handle(self, *args, **options) -> None:
+        self.archive()
+        if options["purge_days"] is not None:
+            self.purge(options["purge_days"], options["batch_size"])
+
+    def archive(self) -> None:
+        newer_attempts = models.QuizAttempt.objects.filter(
+            user = django_models.OuterRef("user"),
+            quiz = django_models.OuterRef("quiz"),
+            id__gt = django_models.OuterRef("id")
+        )
+        archived_count = models.QuizAttempt.objects.filter(
+            django_models.Exists(newer_attempts),
+            archived = False
+        ).update(archived = True)
+        self.logger.info(f"Archived quiz attempts: {archived_count}")
+
+    def purge(self, days: int, batch_size: int) -> None:
+        border = timezone.now() - datetime.timedelta(days = days)
+        old_attempts = models.QuizAttempt.objects.filter(archived = True, started__lt = border)
+        # пачками, чтобы не держать долгую блокировку таблицы ответов
+        deleted_count = 0
+        while True:
+            # счетчики статистики уменьшаются в той же транзакции, что и удаление
+            with database.write_atomic():
+                ids = list(old_attempts.values_list("id", flat = True)[:batch_size])
+                if not ids:
+                    break
+                Statistics.subtract_attempts(ids)
+                deleted_count += models.QuizAttempt.objects.filter(id__in = ids).delete()[1].get(
+                    models.QuizAttempt._meta.label,
+                    0
+                )
+        self.logger.info(f"Deleted archived quiz attempts: {deleted_count}")
@@ -0,0 +1,30 @@
+import time
+
+from survey.exporter import AnswerExporter
+from survey.management.commands import survey_command
+
+
+class Command(survey_command.SurveyCommand):
+    help = "Выгружает ответы пользователей в CSV или JSON Lines"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--format", choices = AnswerExporter.FORMATS, default = AnswerExporter.CSV)
+        parser.add_argument("--output", default = None, help = "Файл для выгрузки (по умолчанию - stdout)")
+        parser.add_argument("--quiz", type = int, nargs = "+", default = None, help = "id выгружаемых опросов")
+        parser.add_argument(
+            "--chunk-size",
+            type = int,
+            default = self.settings.ANSWER_EXPORT_CHUNK_SIZE,
+            help = "Количество строк, получаемых из БД за раз"
+        )
+
+    def handle(self, *args, **options) -> None:
+        start = time.perf_counter()
+        exporter = AnswerExporter(options["quiz"], options["chunk_size"])
+        if options["output"] is None:
+            # строки уже заканчиваются переводом строки, поэтому OutputWrapper не добавит второй
+            count = exporter.write(self.stdout, options["format"])
+        else:
+            with open(options["output"], 'w', encoding = "utf-8", newline = "") as file:
+                count = exporter.write(file, options["format"])
+        self.logger.info(f"Exported answers: {count} in {time.perf_counter() - start:.3f} s")
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import Counter
+
+from django.core.management import CommandError
+from django.db import OperationalError, close_old_connections, connection
+
+from core import models as core_models
+from survey import models
+from survey.management.commands import survey_command
+
+
+class Command(survey_command.SurveyCommand):
+    help = "Измеряет скорость записи ответов из нескольких потоков (как у обработчиков бота)"
+
+    USERNAME = "load_test_answers"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--threads", type = int, default = 8, help = "Количество пишущих потоков")
+        parser.add_argument("--answers", type = int, default = 500, help = "Количество ответов на поток")
+        parser.add_argument(
+            "--batch-size",
+            type = int,
+            default = 1,
+            help = "Ответов в одной записи: 1 - как ANSWER_SINK_DURABLE, больше - как буфер AnswerSink"
+        )
+        parser.add_argument(
+            "--baseline",
+            action = "store_true",
+            help = "SQLite без настроек: journal_mode = DELETE, synchronous = FULL, без ожидания блокировки "
+                   "(транзакции записи по-прежнему начинаются с BEGIN IMMEDIATE)"
+        )
+
+    def handle(self, *args, **options) -> None:
+        quiz = models.Quiz.objects.filter(question__isnull = False).order_by("id").first()
+        if quiz is None:
+            raise CommandError("There are no quizzes with questions, run recreate_quizzes first")
+        user, _ = core_models.User.objects.get_or_create(username = self.USERNAME)
+
+        if options["baseline"]:
+            self.set_pragmas("DELETE", "FULL", 0)
+        # journal_mode сохраняется в файле БД, поэтому настройки восстанавливаются и при ошибке или прерывании
+        try:
+            self.logger.info(f"SQLite pragmas: {self.get_pragmas()}")
+            written, elapsed, latencies, errors = self.run(options, quiz, user)
+        finally:
+            if options["baseline"]:
+                self.set_pragmas(
+                    self.settings.SQLITE_JOURNAL_MODE,
+                    self.settings.SQLITE_SYNCHRONOUS,
+                    int(self.settings.SQLITE_BUSY_TIMEOUT * 1000)
+                )
+            self.cleanup(user)
+
+        latencies.sort()
+        self.logger.info(f"Written answers: {written} in {elapsed:.3f} s, {written / elapsed:.1f} answers/s")
+        if latencies:
+            self.logger.info(
+                f"Write latency: p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+            )
+        for error, count in errors.items():
+            self.logger.warning(f"Failed answers: {count} ({error})")
+
+    def run(
+            self,
+            options: dict,
+            quiz: models.Quiz,
+            user: core_models.User
+    ) -> tuple[int, float, list[float], Counter]:
+        questions = list(models.Question.objects.filter(quiz = quiz).order_by("id"))
+        prepared_answers = {
+            x.question_id: x for x in models.PreparedAnswer.objects.filter(question__quiz = quiz).order_by("-id")
+        }
+        # попытки создаются заранее, чтобы потоки только записывали ответы
+        attempts_per_thread = -(-options["answers"] // len(questions))
+        attempts = models.QuizAttempt.objects.bulk_create(
+            models.QuizAttempt(user = user, quiz = quiz) for _ in range(options["threads"] * attempts_per_thread)
+        )
+
+        errors = Counter()
+        latencies = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(options["threads"])
+
+        def write(thread_number: int) -> None:
+            if options["baseline"]:
+                self.set_pragmas("DELETE", "FULL", 0)
+            thread_attempts = attempts[thread_number * attempts_per_thread:(thread_number + 1) * attempts_per_thread]
+            thread_latencies = []
+            answers = []
+            barrier.wait()
+            for number in range(options["answers"]):
+                question = questions[number % len(questions)]
+                answers.append(models.Answer(
+                    attempt = thread_attempts[number // len(questions)],
+                    user = user,
+                    quiz = quiz,
+                    question = question,
+                    message_id = None if question.id in prepared_answers else number,
+                    prepared_answer = prepared_answers.get(question.id)
+                ))
+                if len(answers) >= options["batch_size"] or number == options["answers"] - 1:
+                    start = time.perf_counter()
+                    try:
+                        models.Answer.upsert(answers)
+                    except OperationalError as error:
+                        with lock:
+                            errors[str(error)] += len(answers)
+                    thread_latencies.append(time.perf_counter() - start)
+                    answers = []
+            with lock:
+                latencies.extend(thread_latencies)
+            close_old_connections()
+            connection.close()
+
+        threads = [threading.Thread(target = write, args = (x,)) for x in range(options["threads"])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return models.Answer.objects.filter(user = user).count(), elapsed, latencies, errors
+
+    @staticmethod
+    def get_pragmas() -> dict[str, str]:
+        if connection.vendor != "sqlite":
+            return {}
+        pragmas = {}
+        with connection.cursor() as cursor:
+            for name in ("journal_mode", "synchronous", "busy_timeout"):
+                cursor.execute(f"PRAGMA {name}")
+                pragmas[name] = cursor.fetchone()[0]
+        return pragmas
+
+    @staticmethod
+    def set_pragmas(journal_mode: str, synchronous: str, busy_timeout: int) -> None:
+        if connection.vendor != "sqlite":
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+            cursor.execute(f"PRAGMA synchronous = {synchronous}")
+            cursor.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+
+    @staticmethod
+    def cleanup(user: core_models.User) -> None:
+        # счетчики статистики не должны учитывать тестовые ответы
+        answers = models.Answer.objects.filter(user = user)
+        question_deltas = Counter(answers.values_list("question_id", flat = True))
+        prepared_answer_deltas = Counter(
+            answers.exclude(prepared_answer = None).values_list("prepared_answer_id", flat = True)
+        )
+        models.QuestionStatistics.increment("answers_count", {x: -y for x, y in question_deltas.items()})
+        models.PreparedAnswerStatistics.increment("answers_count", {x: -y for x, y in prepared_answer_deltas.items()})
+        user.delete()
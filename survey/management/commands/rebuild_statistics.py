@@ -0,0 +1,13 @@
+import time
+
+from survey.management.commands import survey_command
+from survey.statistics import Statistics
+
+
+class Command(survey_command.SurveyCommand):
+    help = "Пересчитывает статистику опросов по текущим попыткам и ответам"
+
+    def handle(self, *args, **options) -> None:
+        start = time.perf_counter()
+        Statistics.rebuild()
+        self.logger.info(f"Statistics are rebuilt in {time.perf_counter() - start:.3f} s")
@@ -1,50 +1,139 @@
-import json
+import time
+from collections import defaultdict
+from typing import Iterable
 
-from survey import models
+from core import database
+from survey import importer, models
 from survey.management.commands import survey_command
 
 
 class Command(survey_command.SurveyCommand):
-    help = "Заполняет БД опросами, удаляя старые"
+    help = "Заполняет БД опросами, удаляя старые, или синхронизирует опросы с файлом, сохраняя ответы"
+
+    RECREATE = "recreate"
+    SYNC = "sync"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--mode",
+            choices = (self.RECREATE, self.SYNC),
+            default = self.RECREATE,
+            help = f"{self.RECREATE} - удалить все опросы (вместе с ответами) и создать заново, "
+                   f"{self.SYNC} - применить только отличия от файла"
+        )
+        parser.add_argument(
+            "--path",
+            default = self.settings.QUIZZES_PATH,
+            help = "Файл с опросами: JSON-массив или JSON Lines (.jsonl)"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type = int,
+            default = self.settings.QUIZ_IMPORT_BATCH_SIZE,
+            help = "Количество объектов, создаваемых одной пачкой"
+        )
 
     def handle(self, *args, **options) -> None:
-        self.delete_old()
-        self.create_new()
+        start = time.perf_counter()
+        # файл читается по одному опросу
+        quizzes_json = importer.QuizReader(options["path"])
+        with database.write_atomic():
+            if options["mode"] == self.SYNC:
+                # для сравнения с каталогом нужен весь файл
+                self.sync(list(quizzes_json))
+            else:
+                self.delete_old()
+                self.create_new(quizzes_json, options["batch_size"])
+        self.logger.info(f"Quizzes are imported in {time.perf_counter() - start:.3f} s")
 
     def delete_old(self) -> None:
-        old_quizzes = models.Quiz.objects.all()
-        old_quizzes_count = len(models.Quiz.objects.all())
-        old_quizzes.delete()
+        old_quizzes_count = models.Quiz.objects.all().delete()[1].get(models.Quiz._meta.label, 0)
         self.logger.info(f"Deleted old quizzes: {old_quizzes_count}")
 
-    def create_new(self) -> None:
-        with open(self.settings.QUIZZES_PATH, 'r', encoding = "utf-8") as file:
-            quizzes_json = json.load(file)
+    def create_new(self, quizzes_json: Iterable[dict], batch_size: int = None) -> None:
+        importer.QuizImporter(batch_size).import_quizzes(quizzes_json)
+
+    @staticmethod
+    def match(objects: list, texts: list[str]) -> tuple[list, list[int], list]:
+        """Сопоставляет объекты строкам файла по тексту.
+
+        Возвращает объекты (или None) для каждой строки, номера строк без объекта и объекты без строки.
+        """
+
+        by_text: dict[str, list] = defaultdict(list)
+        for x in objects:
+            by_text[x.text].append(x)
+        matched = [by_text[text].pop(0) if by_text[text] else None for text in texts]
+        unmatched_texts = [number for number, x in enumerate(matched) if x is None]
+        unmatched_objects = [x for values in by_text.values() for x in values]
+        return matched, unmatched_texts, unmatched_objects
+
+    def sync(self, quizzes_json: list[dict]) -> None:
+        # опрос сопоставляется по названию, вопрос - по тексту в опросе, вариант ответа - по тексту в вопросе,
+        # поэтому ответы не переходят к другому вопросу при вставке или перестановке вопросов в файле,
+        # а несопоставленные объекты удаляются или создаются
+        existing_quizzes: dict[str, models.Quiz] = {}
+        extra_quizzes = []
+        for quiz in models.Quiz.objects.order_by("id"):
+            if quiz.name in existing_quizzes:
+                extra_quizzes.append(quiz)
+            else:
+                existing_quizzes[quiz.name] = quiz
+        existing_questions: dict[int, list[models.Question]] = defaultdict(list)
+        for question in models.Question.objects.order_by("id"):
+            existing_questions[question.quiz_id].append(question)
+        existing_prepared_answers: dict[int, list[models.PreparedAnswer]] = defaultdict(list)
+        for prepared_answer in models.PreparedAnswer.objects.order_by("id"):
+            existing_prepared_answers[prepared_answer.question_id].append(prepared_answer)
 
-        quizzes = []
-        questions = []
-        prepared_answers = []
+        new_quizzes = []
+        new_questions = []
+        new_prepared_answers = []
+        deleted_questions = []
+        deleted_prepared_answers = []
         for quiz_json in quizzes_json:
-            quiz = models.Quiz(
-                name = quiz_json["name"]
+            quiz = existing_quizzes.pop(quiz_json["name"], None)
+            if quiz is None:
+                new_quizzes.append(importer.QuizImporter.build_quiz(quiz_json, new_questions, new_prepared_answers))
+                continue
+
+            questions_json = quiz_json["questions"]
+            questions, new_numbers, unmatched_questions = self.match(
+                existing_questions[quiz.id],
+                [x["text"] for x in questions_json]
+            )
+            deleted_questions.extend(unmatched_questions)
+            importer.QuizImporter.build_quiz(
+                {"questions": [questions_json[x] for x in new_numbers]},
+                new_questions,
+                new_prepared_answers,
+                quiz
             )
-            quizzes.append(quiz)
-            for question_json in quiz_json["questions"]:
-                question = models.Question(
-                    quiz = quiz,
-                    text = question_json["text"]
+            # бот задает вопросы в порядке id, поэтому новые вопросы задаются после существующих
+            texts = [x.text for x in sorted((x for x in questions if x is not None), key = lambda x: x.id)]
+            if texts + [questions_json[x]["text"] for x in new_numbers] != [x["text"] for x in questions_json]:
+                self.logger.warning(f"Quiz {quiz.name}: questions will be asked in a different order than in the file")
+
+            for question, question_json in zip(questions, questions_json):
+                if question is None:
+                    continue
+                texts = question_json.get("prepared_answers", [])
+                _, new_numbers, unmatched_prepared_answers = self.match(existing_prepared_answers[question.id], texts)
+                deleted_prepared_answers.extend(unmatched_prepared_answers)
+                new_prepared_answers.extend(
+                    models.PreparedAnswer(question = question, text = texts[x]) for x in new_numbers
                 )
-                questions.append(question)
-                if "prepared_answers" in question_json:
-                    question_prepared_answers = [models.PreparedAnswer(
-                        question = question,
-                        text = text
-                    ) for text in question_json["prepared_answers"]]
-                    prepared_answers.extend(question_prepared_answers)
-
-        models.Quiz.objects.bulk_create(quizzes)
-        models.Question.objects.bulk_create(questions)
-        models.PreparedAnswer.objects.bulk_create(prepared_answers)
-        self.logger.info(f"Created new quizzes: {len(quizzes)}")
-        self.logger.info(f"Created new questions: {len(questions)}")
-        self.logger.info(f"Created new prepared answers: {len(prepared_answers)}")
+        deleted_quizzes = extra_quizzes + list(existing_quizzes.values())
+
+        models.Quiz.objects.filter(id__in = [x.id for x in deleted_quizzes]).delete()
+        models.Question.objects.filter(id__in = [x.id for x in deleted_questions]).delete()
+        models.PreparedAnswer.objects.filter(id__in = [x.id for x in deleted_prepared_answers]).delete()
+        models.Quiz.objects.bulk_create(new_quizzes)
+        models.Question.objects.bulk_create(new_questions)
+        models.PreparedAnswer.objects.bulk_create(new_prepared_answers)
+
+        self.logger.info(f"Quizzes: created {len(new_quizzes)}, deleted {len(deleted_quizzes)}")
+        self.logger.info(f"Questions: created {len(new_questions)}, deleted {len(deleted_questions)}")
+        self.logger.info(
+            f"Prepared answers: created {len(new_prepared_answers)}, deleted {len(deleted_prepared_answers)}"
+        )
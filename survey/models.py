@@ -1,6 +1,9 @@
+from collections import Counter
+
 from django.db import models
+from django.utils import timezone
 
-from core import models as core_models
+from core import database, metrics, models as core_models
 
 
 class SurveyModel(core_models.CoreModel):
@@ -8,7 +11,15 @@ class SurveyModel(core_models.CoreModel):
         abstract = True
 
 
-class Quiz(SurveyModel):
+class CatalogModel(SurveyModel):
+    class Meta:
+        abstract = True
+
+    # по этому полю бот замечает изменения каталога опросов без перезапуска
+    updated = models.DateTimeField(auto_now = True, db_index = True)
+
+
+class Quiz(CatalogModel):
     class Meta:
         verbose_name_plural = "Quizzes"
 
@@ -18,7 +29,7 @@ class Quiz(SurveyModel):
         return self.name
 
 
-class Question(SurveyModel):
+class Question(CatalogModel):
     quiz = models.ForeignKey(Quiz, models.CASCADE)
     text = models.CharField(max_length = 100)
 
@@ -26,7 +37,7 @@ class Question(SurveyModel):
         return self.text
 
 
-class PreparedAnswer(SurveyModel):
+class PreparedAnswer(CatalogModel):
     question = models.ForeignKey(Question, models.CASCADE)
     text = models.CharField(max_length = 100)
 
@@ -34,9 +45,142 @@ class PreparedAnswer(SurveyModel):
         return self.text
 
 
+class QuizAttempt(SurveyModel):
+    """Прохождение опроса пользователем. Повторное прохождение открывает новую попытку, старые ответы сохраняются."""
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ("user", "quiz"), name = "attempt_user_quiz_index")
+        ]
+
+    user = models.ForeignKey(core_models.User, models.CASCADE)
+    quiz = models.ForeignKey(Quiz, models.CASCADE)
+    started = models.DateTimeField(auto_now_add = True)
+    finished = models.DateTimeField(null = True)
+    # попытка заменена более новой попыткой того же опроса, выставляется фоновой командой archive_quiz_attempts
+    archived = models.BooleanField(default = False)
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.quiz} ({self.started})"
+
+    @classmethod
+    @metrics.timed("db_write", "QuizAttempt.start")
+    def start(cls, user: core_models.User, quiz: Quiz) -> "QuizAttempt":
+        with database.write_atomic():
+            attempt = cls.objects.create(user = user, quiz = quiz)
+            QuizStatistics.increment("started_count", {quiz.id: 1})
+        return attempt
+
+    @classmethod
+    @metrics.timed("db_write", "QuizAttempt.finish")
+    def finish(cls, attempt_id: int, quiz_id: int) -> None:
+        with database.write_atomic():
+            # повторное завершение той же попытки не учитывается в статистике
+            if cls.objects.filter(id = attempt_id, finished = None).update(finished = timezone.now()):
+                QuizStatistics.increment("finished_count", {quiz_id: 1})
+
+
 class Answer(SurveyModel):
+    class Meta:
+        constraints = [
+            # повторное нажатие кнопки не создаст второй ответ на тот же вопрос
+            models.UniqueConstraint(fields = ("attempt", "question"), name = "answer_unique_attempt_question")
+        ]
+        indexes = [
+            models.Index(fields = ("user", "quiz"), name = "answer_user_quiz_index")
+        ]
+
+    attempt = models.ForeignKey(QuizAttempt, models.CASCADE)
     user = models.ForeignKey(core_models.User, models.CASCADE)
+    # дублирует question.quiz, чтобы выборка и удаление ответов опроса не требовали JOIN с вопросами
+    quiz = models.ForeignKey(Quiz, models.CASCADE)
     question = models.ForeignKey(Question, models.CASCADE)
     # https://core.telegram.org/constructor/message
     message_id = models.IntegerField(null = True)
     prepared_answer = models.ForeignKey(PreparedAnswer, models.CASCADE, null = True)
+    answered = models.DateTimeField(auto_now = True)
+
+    UPSERT_UNIQUE_FIELDS = ("attempt", "question")
+    UPSERT_UPDATE_FIELDS = ("message_id", "prepared_answer", "answered")
+
+    @classmethod
+    @metrics.timed("db_write", "Answer.upsert")
+    def upsert(cls, answers: list["Answer"], batch_size: int = None) -> None:
+        # при повторном ответе на вопрос заменяется старый ответ
+        # в одной пачке пара (попытка, вопрос) должна встречаться один раз, остается последний ответ
+        unique_answers = {(x.attempt_id, x.question_id): x for x in answers}
+        with database.write_atomic():
+            # заменяемые ответы не должны посчитаться в статистике второй раз
+            previous_answers = {
+                (attempt_id, question_id): prepared_answer_id
+                for attempt_id, question_id, prepared_answer_id in cls.objects.filter(
+                    attempt_id__in = {x[0] for x in unique_answers},
+                    question_id__in = {x[1] for x in unique_answers}
+                ).values_list("attempt_id", "question_id", "prepared_answer_id")
+            }
+            cls.objects.bulk_create(
+                unique_answers.values(),
+                batch_size = batch_size,
+                update_conflicts = True,
+                unique_fields = cls.UPSERT_UNIQUE_FIELDS,
+                update_fields = cls.UPSERT_UPDATE_FIELDS
+            )
+
+            question_deltas = Counter()
+            prepared_answer_deltas = Counter()
+            for key, answer in unique_answers.items():
+                if key in previous_answers:
+                    if previous_answers[key] is not None:
+                        prepared_answer_deltas[previous_answers[key]] -= 1
+                else:
+                    question_deltas[answer.question_id] += 1
+                if answer.prepared_answer_id is not None:
+                    prepared_answer_deltas[answer.prepared_answer_id] += 1
+            QuestionStatistics.increment("answers_count", question_deltas)
+            PreparedAnswerStatistics.increment("answers_count", prepared_answer_deltas)
+
+
+class StatisticsModel(SurveyModel):
+    """Счетчики, которые обновляются при записи попыток и ответов, чтобы отчеты не сканировали таблицу ответов.
+
+    Команда rebuild_statistics пересчитывает их по текущим данным.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def increment(cls, field_name: str, deltas: dict[int, int]) -> None:
+        for key, delta in deltas.items():
+            if delta == 0:
+                continue
+            counter = cls.objects.filter(pk = key)
+            # строка счетчика создается при первом изменении
+            if not counter.update(**{field_name: models.F(field_name) + delta}):
+                cls.objects.bulk_create([cls(pk = key)], ignore_conflicts = True)
+                counter.update(**{field_name: models.F(field_name) + delta})
+
+
+class QuizStatistics(StatisticsModel):
+    class Meta:
+        verbose_name_plural = "Quiz statistics"
+
+    quiz = models.OneToOneField(Quiz, models.CASCADE, primary_key = True)
+    started_count = models.IntegerField(default = 0)
+    finished_count = models.IntegerField(default = 0)
+
+
+class QuestionStatistics(StatisticsModel):
+    class Meta:
+        verbose_name_plural = "Question statistics"
+
+    question = models.OneToOneField(Question, models.CASCADE, primary_key = True)
+    answers_count = models.IntegerField(default = 0)
+
+
+class PreparedAnswerStatistics(StatisticsModel):
+    class Meta:
+        verbose_name_plural = "Prepared answer statistics"
+
+    prepared_answer = models.OneToOneField(PreparedAnswer, models.CASCADE, primary_key = True)
+    answers_count = models.IntegerField(default = 0)
@@ -4,3 +4,26 @@ from survey.apps import SurveyConfig
 
 class Settings(settings.Settings):
     APP_NAME = SurveyConfig.name
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        # Запись ответов
+        # размер пачки ответов, при накоплении которой она сразу записывается в БД
+        self.ANSWER_SINK_BATCH_SIZE = 100
+        # период (в секундах) записи накопленных ответов
+        self.ANSWER_SINK_FLUSH_PERIOD = 1
+        # записывать каждый ответ сразу (ответы не теряются при аварийном завершении процесса)
+        self.ANSWER_SINK_DURABLE = False
+        # наибольшее количество ответов в буфере, пока БД недоступна (самые старые ответы отбрасываются)
+        self.ANSWER_SINK_MAX_BUFFER_SIZE = 10000
+
+        # Импорт опросов
+        # количество объектов (опросов, вопросов и вариантов ответов), создаваемых одной пачкой
+        self.QUIZ_IMPORT_BATCH_SIZE = 1000
+        # размер (в символах) части файла, читаемой за раз
+        self.QUIZ_IMPORT_CHUNK_SIZE = 1024 * 1024
+
+        # Выгрузка ответов
+        # количество строк, получаемых из БД за раз
+        self.ANSWER_EXPORT_CHUNK_SIZE = 2000
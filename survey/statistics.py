@@ -0,0 +1,126 @@
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from django.db import models as django_models
+
+from core import database
+from survey import models
+
+
+class Statistics:
+    """Отчеты по предрассчитанным счетчикам и их пересчет по текущим данным."""
+
+    @staticmethod
+    def rebuild() -> None:
+        # подсчет и замена счетчиков в одной транзакции, иначе ответы, записанные между ними, потеряются
+        with database.write_atomic():
+            quiz_counts = {
+                x["quiz"]: x for x in models.QuizAttempt.objects.values("quiz").annotate(
+                    started = django_models.Count("id"),
+                    finished = django_models.Count("finished")
+                )
+            }
+            question_counts = dict(
+                models.Answer.objects.values("question").annotate(count = django_models.Count("id")).values_list(
+                    "question",
+                    "count"
+                )
+            )
+            prepared_answer_counts = dict(
+                models.Answer.objects.exclude(prepared_answer = None).values("prepared_answer").annotate(
+                    count = django_models.Count("id")
+                ).values_list("prepared_answer", "count")
+            )
+
+            for model in (models.QuizStatistics, models.QuestionStatistics, models.PreparedAnswerStatistics):
+                model.objects.all().delete()
+            # строки создаются и для опросов без ответов, чтобы отчет показывал нули
+            models.QuizStatistics.objects.bulk_create(
+                models.QuizStatistics(
+                    quiz_id = quiz_id,
+                    started_count = quiz_counts.get(quiz_id, {}).get("started", 0),
+                    finished_count = quiz_counts.get(quiz_id, {}).get("finished", 0)
+                ) for quiz_id in models.Quiz.objects.values_list("id", flat = True)
+            )
+            models.QuestionStatistics.objects.bulk_create(
+                models.QuestionStatistics(
+                    question_id = question_id,
+                    answers_count = question_counts.get(question_id, 0)
+                ) for question_id in models.Question.objects.values_list("id", flat = True)
+            )
+            models.PreparedAnswerStatistics.objects.bulk_create(
+                models.PreparedAnswerStatistics(
+                    prepared_answer_id = prepared_answer_id,
+                    answers_count = prepared_answer_counts.get(prepared_answer_id, 0)
+                ) for prepared_answer_id in models.PreparedAnswer.objects.values_list("id", flat = True)
+            )
+
+    @staticmethod
+    def subtract_attempts(attempt_ids: list[int]) -> None:
+        """Вычитает из счетчиков попытки и их ответы перед удалением, вызывается в транзакции удаления."""
+
+        attempts = models.QuizAttempt.objects.filter(id__in = attempt_ids)
+        started_deltas = Counter(attempts.values_list("quiz_id", flat = True))
+        finished_deltas = Counter(attempts.exclude(finished = None).values_list("quiz_id", flat = True))
+        answers = models.Answer.objects.filter(attempt_id__in = attempt_ids)
+        question_deltas = Counter(answers.values_list("question_id", flat = True))
+        prepared_answer_deltas = Counter(
+            answers.exclude(prepared_answer = None).values_list("prepared_answer_id", flat = True)
+        )
+        models.QuizStatistics.increment("started_count", {x: -y for x, y in started_deltas.items()})
+        models.QuizStatistics.increment("finished_count", {x: -y for x, y in finished_deltas.items()})
+        models.QuestionStatistics.increment("answers_count", {x: -y for x, y in question_deltas.items()})
+        models.PreparedAnswerStatistics.increment("answers_count", {x: -y for x, y in prepared_answer_deltas.items()})
+
+    @staticmethod
+    def get_report(quiz_ids: Iterable[int] = None) -> list[dict]:
+        # три запроса, каждый читает O(количества вопросов и вариантов ответов) строк
+        quizzes = models.Quiz.objects.order_by("id")
+        questions = models.Question.objects.order_by("id")
+        prepared_answers = models.PreparedAnswer.objects.order_by("id")
+        if quiz_ids is not None:
+            quiz_ids = list(quiz_ids)
+            quizzes = quizzes.filter(id__in = quiz_ids)
+            questions = questions.filter(quiz_id__in = quiz_ids)
+            prepared_answers = prepared_answers.filter(question__quiz_id__in = quiz_ids)
+
+        prepared_answers_report = defaultdict(list)
+        for prepared_answer_id, question_id, text, count in prepared_answers.values_list(
+                "id",
+                "question_id",
+                "text",
+                "preparedanswerstatistics__answers_count"
+        ):
+            prepared_answers_report[question_id].append(
+                {"prepared_answer_id": prepared_answer_id, "text": text, "answers": count or 0}
+            )
+
+        questions_report = defaultdict(list)
+        for question_id, quiz_id, text, count in questions.values_list(
+                "id",
+                "quiz_id",
+                "text",
+                "questionstatistics__answers_count"
+        ):
+            questions_report[quiz_id].append({
+                "question_id": question_id,
+                "text": text,
+                "answers": count or 0,
+                "prepared_answers": prepared_answers_report.get(question_id, [])
+            })
+
+        return [
+            {
+                "quiz_id": quiz_id,
+                "name": name,
+                "started": started or 0,
+                "finished": finished or 0,
+                # воронка: сколько попыток дошло до каждого вопроса
+                "questions": questions_report.get(quiz_id, [])
+            } for quiz_id, name, started, finished in quizzes.values_list(
+                "id",
+                "name",
+                "quizstatistics__started_count",
+                "quizstatistics__finished_count"
+            )
+        ]
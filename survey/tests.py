@@ -1,3 +1,457 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from core import models as core_models
+from survey import models as survey_models
+from survey.exporter import AnswerExporter
+from survey.importer import QuizReader
+from survey.management.commands.load_test_answers import Command as LoadTestAnswersCommand
+from survey.answer_sink import AnswerSink
+from survey.statistics import Statistics
+
+
+class AnswerSinkTests(TransactionTestCase):
+    # внешние ключи SQLite проверяются при COMMIT, поэтому ответы записываются вне транзакции теста
+
+    def setUp(self) -> None:
+        self.user = core_models.User.objects.create(telegram_user_id = 1, telegram_chat_id = 1)
+        self.quiz = survey_models.Quiz.objects.create(name = "Quiz")
+        self.questions = [survey_models.Question.objects.create(quiz = self.quiz, text = str(x)) for x in range(3)]
+        self.attempt = survey_models.QuizAttempt.objects.create(user = self.user, quiz = self.quiz)
+        self.sink = AnswerSink()
+        # иначе оставшиеся ответы запишет atexit уже после удаления тестовой БД
+        self.addCleanup(lambda: self.sink._buffer.clear())
+
+    def make_answer(self, question_id: int) -> survey_models.Answer:
+        return survey_models.Answer(
+            attempt_id = self.attempt.id,
+            user_id = self.user.id,
+            quiz_id = self.quiz.id,
+            question_id = question_id
+        )
+
+    def test_broken_answer_is_dropped(self) -> None:
+        missing_question_id = max(x.id for x in self.questions) + 1
+        self.sink._buffer = [self.make_answer(x.id) for x in self.questions] + [self.make_answer(missing_question_id)]
+
+        self.assertEqual(self.sink.flush(), len(self.questions))
+        self.assertEqual(len(self.sink), 0)
+        self.assertEqual(survey_models.Answer.objects.count(), len(self.questions))
+
+    def test_buffer_is_limited(self) -> None:
+        self.sink.max_buffer_size = 2
+        self.sink._buffer = [self.make_answer(x.id) for x in self.questions]
+
+        with mock.patch.object(survey_models.Answer, "upsert", side_effect = DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.sink.flush()
+        # самый старый ответ отброшен
+        self.assertEqual([x.question_id for x in self.sink._buffer], [x.id for x in self.questions[1:]])
+
+    def test_full_buffer_is_written_by_add(self) -> None:
+        self.sink.max_buffer_size = 2
+        # фоновый поток не записывает пачки, поэтому буфер заполняется
+        with mock.patch.object(AnswerSink, "running", True):
+            for question in self.questions:
+                self.sink.add(self.make_answer(question.id))
+                self.assertLess(len(self.sink), self.sink.max_buffer_size)
+
+        self.assertEqual(len(self.sink), 1)
+        self.assertEqual(survey_models.Answer.objects.count(), 2)
+
+
+class AnswerUpsertTests(TestCase):
+    def setUp(self) -> None:
+        self.user = core_models.User.objects.create(telegram_user_id = 1, telegram_chat_id = 1)
+        self.quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        self.question = survey_models.Question.objects.create(quiz = self.quiz, text = "Вопрос")
+        self.prepared_answers = [
+            survey_models.PreparedAnswer.objects.create(question = self.question, text = x) for x in ("Да", "Нет")
+        ]
+        Statistics.rebuild()
+        self.attempt = survey_models.QuizAttempt.start(self.user, self.quiz)
+
+    def make_answer(
+            self,
+            prepared_answer: survey_models.PreparedAnswer = None,
+            attempt: survey_models.QuizAttempt = None
+    ) -> survey_models.Answer:
+        return survey_models.Answer(
+            attempt = attempt or self.attempt,
+            user = self.user,
+            quiz = self.quiz,
+            question = self.question,
+            prepared_answer = prepared_answer
+        )
+
+    def get_counts(self) -> tuple[int, list[int]]:
+        question_report = Statistics.get_report()[0]["questions"][0]
+        return question_report["answers"], [x["answers"] for x in question_report["prepared_answers"]]
+
+    def check_statistics(self, counts: tuple[int, list[int]]) -> None:
+        self.assertEqual(self.get_counts(), counts)
+        # счетчики совпадают с пересчитанными по таблице ответов
+        Statistics.rebuild()
+        self.assertEqual(self.get_counts(), counts)
+
+    def test_answer_is_replaced(self) -> None:
+        survey_models.Answer.upsert([self.make_answer(self.prepared_answers[0])])
+        survey_models.Answer.upsert([self.make_answer(self.prepared_answers[1])])
+
+        answer = survey_models.Answer.objects.get()
+        self.assertEqual(answer.prepared_answer, self.prepared_answers[1])
+        self.check_statistics((1, [0, 1]))
+
+    def test_repeated_answer_is_counted_once(self) -> None:
+        for _ in range(2):
+            survey_models.Answer.upsert([self.make_answer(self.prepared_answers[0])])
+
+        self.assertEqual(survey_models.Answer.objects.count(), 1)
+        self.check_statistics((1, [1, 0]))
+
+    def test_last_answer_in_batch_is_kept(self) -> None:
+        survey_models.Answer.upsert([self.make_answer(x) for x in self.prepared_answers])
+
+        self.assertEqual(survey_models.Answer.objects.get().prepared_answer, self.prepared_answers[1])
+        self.check_statistics((1, [0, 1]))
+
+    def test_text_answer_replaces_prepared_answer(self) -> None:
+        survey_models.Answer.upsert([self.make_answer(self.prepared_answers[0])])
+        answer = self.make_answer()
+        answer.message_id = 10
+        survey_models.Answer.upsert([answer])
+
+        self.assertEqual(
+            survey_models.Answer.objects.values_list("prepared_answer", "message_id").get(),
+            (None, 10)
+        )
+        self.check_statistics((1, [0, 0]))
+
+    def test_retake_keeps_previous_answers(self) -> None:
+        survey_models.Answer.upsert([self.make_answer(self.prepared_answers[0])])
+        attempt = survey_models.QuizAttempt.start(self.user, self.quiz)
+        survey_models.Answer.upsert([self.make_answer(self.prepared_answers[1], attempt)])
+
+        self.assertEqual(
+            list(survey_models.Answer.objects.order_by("id").values_list("attempt", "prepared_answer")),
+            [(self.attempt.id, self.prepared_answers[0].id), (attempt.id, self.prepared_answers[1].id)]
+        )
+        self.check_statistics((2, [1, 1]))
+
+
+class QuizReaderTests(TestCase):
+    QUIZZES = [
+        {"name": "Опрос 1", "questions": [{"text": "Вопрос \"1\"", "prepared_answers": ["Да", "Нет"]}]},
+        {"name": "Опрос 2 \U0001F600", "questions": [{"text": "Вопрос 1\n"}], "order": -1.5e3, "hidden": False},
+        {"name": "Опрос 3", "questions": []}
+    ]
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write(self, text: str, name: str = "quizzes.json") -> str:
+        path = self.directory / name
+        path.write_text(text, encoding = "utf-8")
+        return str(path)
+
+    def test_array_is_split_across_chunks(self) -> None:
+        for indent in (None, 4):
+            # ensure_ascii добавляет в файл escape-последовательности, которые тоже разрезаются границами частей
+            for ensure_ascii in (False, True):
+                path = self.write(json.dumps(self.QUIZZES, ensure_ascii = ensure_ascii, indent = indent))
+                for chunk_size in range(1, 50):
+                    with self.subTest(indent = indent, ensure_ascii = ensure_ascii, chunk_size = chunk_size):
+                        self.assertEqual(list(QuizReader(path, chunk_size)), self.QUIZZES)
+
+    def test_empty_array(self) -> None:
+        self.assertEqual(list(QuizReader(self.write(" [ ]\n"), 1)), [])
+
+    def test_json_lines(self) -> None:
+        text = "\n".join(json.dumps(x, ensure_ascii = False) for x in self.QUIZZES) + "\n\n"
+        self.assertEqual(list(QuizReader(self.write(text, "quizzes.jsonl"))), self.QUIZZES)
+
+    def test_malformed_json_lines(self) -> None:
+        path = self.write('{"name": "Опрос 1", "questions": []}\n{"name": "Опрос 2",}\n', "quizzes.jsonl")
+        with self.assertRaisesRegex(ValueError, "line 2"):
+            list(QuizReader(path))
+
+    def test_malformed_array(self) -> None:
+        quiz = '{"name": "Опрос", "questions": []}'
+        texts = [
+            f"{{{quiz}}}",
+            f"[{quiz},,{quiz}]",
+            f"[,{quiz}]",
+            f"[{quiz},]",
+            f"[{quiz} {quiz}]",
+            f"[{quiz}",
+            '[{"name": "Опрос",, "questions": []}]',
+            '[{"name": "Опрос", "questions": [}]'
+        ]
+        for text in texts:
+            for chunk_size in (1, 7, 1024):
+                with self.subTest(text = text, chunk_size = chunk_size):
+                    with self.assertRaises(ValueError):
+                        list(QuizReader(self.write(text), chunk_size))
+
+    def test_malformed_quiz_stops_reading(self) -> None:
+        tail = ", ".join(json.dumps(self.QUIZZES[2]) for _ in range(1000))
+        file = io.StringIO(f'[{{"name": "Опрос", "questions": [{{"text": "Вопрос"}},, ]}}, {tail}]')
+        reader = QuizReader("quizzes.json", 64)
+
+        with self.assertRaisesRegex(ValueError, "Malformed quiz"):
+            list(reader.read_array(file))
+        # остаток файла не читается в память в поисках конца испорченного опроса
+        self.assertLess(file.tell(), 256)
+
+
+class RecreateQuizzesSyncTests(TestCase):
+    QUIZZES = [
+        {
+            "name": "Опрос 1",
+            "questions": [
+                {"text": "Вопрос 1", "prepared_answers": ["Да", "Нет"]},
+                {"text": "Вопрос 2"}
+            ]
+        },
+        {"name": "Опрос 2", "questions": [{"text": "Вопрос 1"}]}
+    ]
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "quizzes.json"
+
+    def sync(self, quizzes: list[dict], mode: str = "sync") -> None:
+        self.path.write_text(json.dumps(quizzes, ensure_ascii = False), encoding = "utf-8")
+        call_command("recreate_quizzes", mode = mode, path = str(self.path))
+
+    @staticmethod
+    def get_catalog() -> list[tuple[str, str, list[str]]]:
+        return [
+            (x.quiz.name, x.text, [y.text for y in x.preparedanswer_set.order_by("id")])
+            for x in survey_models.Question.objects.select_related("quiz").order_by("quiz__name", "id")
+        ]
+
+    def test_unchanged_catalog_keeps_objects_and_answers(self) -> None:
+        self.sync(self.QUIZZES, "recreate")
+        question = survey_models.Question.objects.get(quiz__name = "Опрос 1", text = "Вопрос 1")
+        user = core_models.User.objects.create(telegram_user_id = 1, telegram_chat_id = 1)
+        attempt = survey_models.QuizAttempt.objects.create(user = user, quiz = question.quiz)
+        survey_models.Answer.objects.create(attempt = attempt, user = user, quiz = question.quiz, question = question)
+        ids = set(survey_models.PreparedAnswer.objects.values_list("id", flat = True))
+
+        self.sync(self.QUIZZES)
+
+        self.assertEqual(set(survey_models.PreparedAnswer.objects.values_list("id", flat = True)), ids)
+        self.assertEqual(survey_models.Answer.objects.count(), 1)
+
+    def test_differences_are_applied(self) -> None:
+        self.sync(self.QUIZZES, "recreate")
+        prepared_answer_ids = set(
+            survey_models.PreparedAnswer.objects.filter(text__in = ("Да", "Нет")).values_list("id", flat = True)
+        )
+        quizzes = [
+            {
+                "name": "Опрос 1",
+                "questions": [
+                    {"text": "Измененный вопрос 1", "prepared_answers": ["Да", "Скорее да", "Нет"]},
+                ]
+            },
+            {"name": "Опрос 3", "questions": [{"text": "Вопрос 1", "prepared_answers": ["Да"]}]}
+        ]
+
+        self.sync(quizzes)
+
+        self.assertEqual(
+            self.get_catalog(),
+            [
+                ("Опрос 1", "Измененный вопрос 1", ["Да", "Скорее да", "Нет"]),
+                ("Опрос 3", "Вопрос 1", ["Да"])
+            ]
+        )
+        # вопрос с другим текстом - это новый вопрос, а варианты ответов "Да" и "Нет" удалены вместе со старым
+        self.assertFalse(survey_models.PreparedAnswer.objects.filter(id__in = prepared_answer_ids).exists())
+
+    def test_inserted_question_keeps_answers(self) -> None:
+        self.sync(self.QUIZZES, "recreate")
+        user = core_models.User.objects.create(telegram_user_id = 1, telegram_chat_id = 1)
+        quiz = survey_models.Quiz.objects.get(name = "Опрос 1")
+        attempt = survey_models.QuizAttempt.objects.create(user = user, quiz = quiz)
+        for question in quiz.question_set.all():
+            survey_models.Answer.objects.create(
+                attempt = attempt,
+                user = user,
+                quiz = quiz,
+                question = question,
+                prepared_answer = question.preparedanswer_set.filter(text = "Нет").first()
+            )
+        answers = set(survey_models.Answer.objects.values_list("id", "question__text", "prepared_answer__text"))
+        quizzes = [
+            {
+                "name": "Опрос 1",
+                "questions": [
+                    {"text": "Новый вопрос"},
+                    {"text": "Вопрос 1", "prepared_answers": ["Скорее да", "Да", "Нет"]},
+                    {"text": "Вопрос 2"}
+                ]
+            },
+            self.QUIZZES[1]
+        ]
+
+        self.sync(quizzes)
+
+        # ответы остаются у своих вопросов и вариантов ответов, а не у тех, что теперь стоят на их месте в файле
+        self.assertEqual(
+            set(survey_models.Answer.objects.values_list("id", "question__text", "prepared_answer__text")),
+            answers
+        )
+        self.assertEqual(
+            self.get_catalog()[:3],
+            [
+                ("Опрос 1", "Вопрос 1", ["Да", "Нет", "Скорее да"]),
+                ("Опрос 1", "Вопрос 2", []),
+                ("Опрос 1", "Новый вопрос", [])
+            ]
+        )
+
+
+class ExportAnswersTests(TestCase):
+    def setUp(self) -> None:
+        user = core_models.User.objects.create(telegram_user_id = 10, telegram_chat_id = 10)
+        self.quizzes = [survey_models.Quiz.objects.create(name = f"Опрос {x}") for x in (1, 2)]
+        self.answers = []
+        for quiz in self.quizzes:
+            attempt = survey_models.QuizAttempt.objects.create(user = user, quiz = quiz)
+            question = survey_models.Question.objects.create(quiz = quiz, text = f"Вопрос, \"{quiz.name}\"")
+            prepared_answer = survey_models.PreparedAnswer.objects.create(question = question, text = "Да")
+            text_question = survey_models.Question.objects.create(quiz = quiz, text = "Текстовый вопрос")
+            for answer_question, answer_prepared_answer, message_id in (
+                    (question, prepared_answer, None),
+                    (text_question, None, 5)
+            ):
+                self.answers.append(survey_models.Answer.objects.create(
+                    attempt = attempt,
+                    user = user,
+                    quiz = quiz,
+                    question = answer_question,
+                    prepared_answer = answer_prepared_answer,
+                    message_id = message_id
+                ))
+
+    def get_expected(self, quiz: survey_models.Quiz = None) -> list[dict]:
+        return [
+            {
+                "quiz_id": x.quiz_id,
+                "quiz": x.quiz.name,
+                "attempt_id": x.attempt_id,
+                "user_id": x.user_id,
+                "telegram_user_id": 10,
+                "question_id": x.question_id,
+                "question": x.question.text,
+                "prepared_answer": None if x.prepared_answer is None else x.prepared_answer.text,
+                "message_id": x.message_id,
+                "answered": str(x.answered)
+            } for x in self.answers if quiz is None or x.quiz == quiz
+        ]
+
+    @staticmethod
+    def export(*args) -> str:
+        stdout = io.StringIO()
+        # chunk_size меньше количества ответов, чтобы строки читались из БД несколькими частями
+        call_command("export_answers", *args, "--chunk-size", "1", stdout = stdout)
+        return stdout.getvalue()
+
+    def test_csv(self) -> None:
+        rows = list(csv.DictReader(io.StringIO(self.export("--format", "csv"))))
+
+        # csv не различает None и пустую строку, а числа выгружаются строками
+        expected = [
+            {key: "" if value is None else str(value) for key, value in x.items()} for x in self.get_expected()
+        ]
+        self.assertEqual(rows, expected)
+
+    def test_json_lines(self) -> None:
+        rows = [json.loads(x) for x in self.export("--format", "jsonl").splitlines()]
+
+        self.assertEqual(rows, self.get_expected())
+
+    def test_quiz_filter_and_output_file(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "answers.jsonl"
+
+        self.assertEqual(self.export("--format", "jsonl", "--quiz", str(self.quizzes[1].id), "--output", str(path)), "")
+        rows = [json.loads(x) for x in path.read_text(encoding = "utf-8").splitlines()]
+        self.assertEqual(rows, self.get_expected(self.quizzes[1]))
+
+    def test_unknown_format(self) -> None:
+        with self.assertRaises(ValueError):
+            list(AnswerExporter().stream("xml"))
+
+
+class LoadTestAnswersTests(TransactionTestCase):
+    # journal_mode нельзя изменить внутри транзакции теста
+
+    def setUp(self) -> None:
+        quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        survey_models.Question.objects.create(quiz = quiz, text = "Вопрос")
+        self.pragmas = LoadTestAnswersCommand.get_pragmas()
+
+    def test_baseline_restores_pragmas(self) -> None:
+        call_command("load_test_answers", threads = 2, answers = 5, baseline = True)
+
+        self.assertEqual(LoadTestAnswersCommand.get_pragmas(), self.pragmas)
+        self.assertFalse(core_models.User.objects.filter(username = LoadTestAnswersCommand.USERNAME).exists())
+
+    def test_baseline_restores_pragmas_on_error(self) -> None:
+        with mock.patch.object(LoadTestAnswersCommand, "run", side_effect = KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("load_test_answers", baseline = True)
+
+        self.assertEqual(LoadTestAnswersCommand.get_pragmas(), self.pragmas)
+        self.assertFalse(core_models.User.objects.filter(username = LoadTestAnswersCommand.USERNAME).exists())
+
+
+class ArchiveQuizAttemptsTests(TestCase):
+    def setUp(self) -> None:
+        user = core_models.User.objects.create(telegram_user_id = 1, telegram_chat_id = 1)
+        quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        question = survey_models.Question.objects.create(quiz = quiz, text = "Вопрос")
+        prepared_answer = survey_models.PreparedAnswer.objects.create(question = question, text = "Да")
+        Statistics.rebuild()
+        # счетчики меняются так же, как при прохождении опроса в боте
+        for _ in range(2):
+            attempt = survey_models.QuizAttempt.start(user, quiz)
+            survey_models.Answer.upsert([survey_models.Answer(
+                attempt = attempt,
+                user = user,
+                quiz = quiz,
+                question = question,
+                prepared_answer = prepared_answer
+            )])
+            survey_models.QuizAttempt.finish(attempt.id, quiz.id)
+        survey_models.QuizAttempt.objects.update(started = timezone.now() - datetime.timedelta(days = 2))
+
+    def test_purge_updates_statistics(self) -> None:
+        call_command("archive_quiz_attempts", purge_days = 1)
+
+        self.assertEqual(survey_models.QuizAttempt.objects.count(), 1)
+        self.assertEqual(survey_models.Answer.objects.count(), 1)
+        report = Statistics.get_report()
+        # счетчики совпадают с пересчитанными по оставшимся данным
+        Statistics.rebuild()
+        self.assertEqual(report, Statistics.get_report())
+        self.assertEqual((report[0]["started"], report[0]["finished"]), (1, 1))
+        self.assertEqual(report[0]["questions"][0]["prepared_answers"][0]["answers"], 1)
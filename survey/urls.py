@@ -0,0 +1,10 @@
+from django.urls import path
+
+from survey import views
+
+
+app_name = "survey"
+urlpatterns = [
+    path("statistics/", views.statistics, name = "statistics"),
+    path("statistics/<int:quiz_id>/", views.statistics, name = "quiz_statistics"),
+]
@@ -1,3 +1,12 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpRequest, JsonResponse
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from survey.statistics import Statistics
+
+
+@staff_member_required
+@require_GET
+def statistics(request: HttpRequest, quiz_id: int = None) -> JsonResponse:
+    report = Statistics.get_report(None if quiz_id is None else [quiz_id])
+    return JsonResponse({"quizzes": report}, json_dumps_params = {"ensure_ascii": False})
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 
+from core import database
 from core.settings import Settings as CoreSettings
 from survey.settings import Settings as SurveySettings
 from telegram_bot.settings import Settings as TelegramBotSettings
@@ -77,7 +78,10 @@ WSGI_APPLICATION = "teleeng.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
-DATABASES = core_settings.secrets.database.get_dict()
+DATABASES = database.get_databases(core_settings.secrets.database.get_dict(), core_settings)
+
+# тестовая SQLite создается в файле, а не в памяти, см. core.test_runner
+TEST_RUNNER = "core.test_runner.TestRunner"
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -15,8 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
+
+from core import views as core_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('telegram_bot/', include('telegram_bot.urls')),
+    path('survey/', include('survey.urls')),
+    path('metrics/', core_views.metrics, name = 'metrics'),
 ]
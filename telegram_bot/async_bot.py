@@ -0,0 +1,367 @@
+import asyncio
+import functools
+from typing import Any, Callable, Coroutine, Iterable
+
+import telebot
+from asgiref.sync import sync_to_async
+from telebot.async_telebot import AsyncTeleBot
+
+from core import metrics, models as core_models
+from survey import models as survey_models
+from telegram_bot.bot import BotServiceMixin, CATALOG
+from telegram_bot.callback_data import CallbackPayload
+from telegram_bot.catalog import Catalog
+from telegram_bot.dispatcher import ChatDispatcher
+from telegram_bot.scheduler import OutboundScheduler
+from telegram_bot.state import ChatState
+
+
+class AsyncBot(BotServiceMixin, AsyncTeleBot):
+    """Асинхронный вариант Bot: все запросы к Telegram и БД выполняются без блокировки потока."""
+
+    # запросы к БД выполняются в потоках sync_to_async, а не в потоке обработчика
+    log_update_queries = False
+
+    def __init__(self, token: str = None):
+        if token is None:
+            token = self.settings.secrets.telegram_bot.token
+
+        super().__init__(token)
+        self.scheduler = OutboundScheduler()
+        # {chat_id: задача обработки последнего обновления чата}
+        self._chat_tasks: dict[int, asyncio.Task] = {}
+
+    async def submit(
+            self,
+            chat_id: int | str,
+            function: Callable[..., Coroutine],
+            *args,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE,
+            **kwargs
+    ) -> Any:
+        # без запущенного планировщика запрос выполнился бы в потоке цикла событий и заблокировал бы его
+        if not self.scheduler.running:
+            return await function(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+
+        def send() -> Any:
+            # поток планировщика ждет выполнения запроса в цикле событий,
+            # поэтому лимиты, порядок сообщений чата и повторы после 429 общие с Bot
+            return asyncio.run_coroutine_threadsafe(function(*args, **kwargs), loop).result()
+
+        return await asyncio.wrap_future(self.scheduler.submit(chat_id, send, priority = priority))
+
+    async def send_message(
+            self,
+            chat_id: int | str,
+            text: Iterable[str] | str,
+            parse_mode: str = None,
+            reply_markup: telebot.REPLY_MARKUP_TYPES = None,
+            link_preview_options: telebot.types.LinkPreviewOptions = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE,
+            **kwargs
+    ) -> telebot.types.Message:
+        if isinstance(text, str):
+            text = [text]
+        if parse_mode is None:
+            parse_mode = self.ParseMode.MARKDOWN
+
+        text_chunks = telebot.util.smart_split(self.Formatter.join(text))
+        message = None
+        for number, text_chunk in enumerate(text_chunks):
+            message = await self.submit(
+                chat_id,
+                super().send_message,
+                chat_id,
+                text_chunk,
+                parse_mode,
+                reply_markup = reply_markup if number == len(text_chunks) - 1 else None,
+                link_preview_options = link_preview_options,
+                priority = priority,
+                **kwargs
+            )
+        return message
+
+    async def delete_message(
+            self,
+            chat_id: int | str,
+            message_id: int,
+            timeout: int = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE
+    ) -> bool:
+        return await self.submit(
+            chat_id,
+            super().delete_message,
+            chat_id,
+            message_id,
+            timeout = timeout,
+            priority = priority
+        )
+
+    async def answer_callback_query(
+            self,
+            callback_query_id: int,
+            text: str = None,
+            show_alert: bool = None,
+            url: str = None,
+            cache_time: int = None,
+            chat_id: int | str = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE
+    ) -> bool:
+        return await self.submit(
+            callback_query_id if chat_id is None else chat_id,
+            super().answer_callback_query,
+            callback_query_id,
+            text,
+            show_alert,
+            url,
+            cache_time,
+            priority = priority
+        )
+
+    async def process_new_updates(self, updates: list[telebot.types.Update]) -> None:
+        # AsyncTeleBot обрабатывает обновления конкурентно,
+        # поэтому обновление чата ждет окончания обработки предыдущего обновления того же чата
+        tasks = []
+        for update in updates:
+            chat_id = ChatDispatcher.get_chat_id(update)
+            task = asyncio.create_task(self.process_chat_update(update, self._chat_tasks.get(chat_id)))
+            task.add_done_callback(functools.partial(self.forget_chat_task, chat_id))
+            self._chat_tasks[chat_id] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+    async def process_chat_update(self, update: telebot.types.Update, previous_task: asyncio.Task | None) -> None:
+        if previous_task is not None:
+            await asyncio.wait([previous_task])
+        await super().process_new_updates([update])
+
+    def forget_chat_task(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._chat_tasks.get(chat_id) is task:
+            del self._chat_tasks[chat_id]
+
+    async def set_command_list(self) -> None:
+        user_scope = telebot.types.BotCommandScopeAllPrivateChats()
+        await self.set_my_commands(self.commands, user_scope)
+
+    async def start_polling(self) -> None:
+        self.register_handlers()
+        await self.set_command_list()
+
+        metrics.COMPONENT_STATS.add_source("user_cache", self.users.get_stats)
+        await sync_to_async(CATALOG.start)()
+        self.answers.start()
+        self.scheduler.start()
+        metrics_logger = metrics.MetricsLogger()
+        metrics_logger.start()
+        self.logger.info("Async telegram bot is running")
+        try:
+            await self.infinity_polling(allowed_updates = telebot.util.update_types)
+        finally:
+            await sync_to_async(metrics_logger.stop)()
+            # отправляемые планировщиком запросы выполняются в цикле событий, поэтому он не блокируется остановкой
+            await sync_to_async(self.scheduler.stop, thread_sensitive = False)()
+            await sync_to_async(self.answers.stop)()
+            metrics.COMPONENT_STATS.remove_source("user_cache")
+
+    @staticmethod
+    async def get_catalog() -> Catalog:
+        # снимок пересобирается в фоновом потоке, запрос к БД нужен только если снимка еще нет
+        catalog = CATALOG.snapshot
+        if catalog is None:
+            catalog = await sync_to_async(CATALOG.load)()
+        return catalog
+
+    @classmethod
+    async def get_user(cls, telegram_user: telebot.types.User) -> core_models.User:
+        return await cls.users.aget(telegram_user.id)
+
+    async def start(self, message: telebot.types.Message) -> None:
+        try:
+            user = await self.get_user(message.from_user)
+            text = ["Вы уже были зарегистрированы. Повторная регистрация невозможна."]
+        except core_models.User.DoesNotExist:
+            user = core_models.User(
+                telegram_user_id = message.from_user.id,
+                telegram_chat_id = message.chat.id
+            )
+            await user.asave()
+            self.users.put(user)
+            text = ["Вы были успешно зарегистрированы."]
+
+        await self.send_message(user.telegram_chat_id, text)
+
+    async def get_chat_id(self, message: telebot.types.Message) -> None:
+        await self.send_message(message.chat.id, self.Formatter.copyable(message.chat.id))
+
+    async def quiz(self, message: telebot.types.Message) -> None:
+        user = await self.get_user(message.from_user)
+        await self.send_message(
+            user.telegram_chat_id,
+            "Выберите опрос из предложенных.",
+            reply_markup = self.get_quizzes_markup(await self.get_catalog())
+        )
+
+    async def process_callback(self, callback: telebot.types.CallbackQuery) -> None:
+        catalog = await self.get_catalog()
+        resolved = self.resolve_callback(callback, catalog)
+        if resolved is None:
+            await self.reject_callback(callback, catalog)
+        else:
+            handler, callback_object, payload = resolved
+            await handler(callback, callback_object, payload, catalog)
+
+    @metrics.timed("handler")
+    async def reject_callback(self, callback: telebot.types.CallbackQuery, catalog: Catalog) -> None:
+        await asyncio.gather(
+            self.states.adelete(callback.message.chat.id),
+            self.answer_callback_query(
+                callback.id,
+                "Опросы были изменены. Выберите опрос заново.",
+                show_alert = True,
+                chat_id = callback.message.chat.id
+            ),
+            self.delete_message(callback.message.chat.id, callback.message.id)
+        )
+        await self.send_message(
+            callback.message.chat.id,
+            "Выберите опрос из предложенных.",
+            reply_markup = self.get_quizzes_markup(catalog)
+        )
+
+    # noinspection PyUnusedLocal
+    async def start_quiz(
+            self,
+            callback: telebot.types.CallbackQuery,
+            quiz: survey_models.Quiz,
+            payload: CallbackPayload,
+            catalog: Catalog
+    ) -> None:
+        user = await self.get_user(callback.from_user)
+
+        # старые ответы остаются в прошлых попытках, повторное прохождение - это один INSERT
+        attempt, _ = await asyncio.gather(
+            sync_to_async(survey_models.QuizAttempt.start)(user, quiz),
+            self.delete_message(user.telegram_chat_id, callback.message.id)
+        )
+        await self.send_message(
+            user.telegram_chat_id,
+            quiz.name
+        )
+
+        await self.ask_question(user, quiz, attempt.id, 0, catalog)
+
+    @metrics.timed("step")
+    async def ask_question(
+            self,
+            user: core_models.User,
+            quiz: survey_models.Quiz,
+            attempt_id: int,
+            question_index: int,
+            catalog: Catalog = None
+    ) -> None:
+        if catalog is None:
+            catalog = await self.get_catalog()
+        next_questions = catalog.QUESTIONS.get(quiz, [])[question_index:]
+        if len(next_questions) == 0:
+            await self.end_quiz(user, quiz, attempt_id)
+        else:
+            question = next_questions[0]
+            if question in catalog.PREPARED_ANSWERS:
+                question_message = await self.send_message(
+                    user.telegram_chat_id,
+                    [question.text, "Выберите ответ."],
+                    reply_markup = self.get_prepared_answers_markup(question, question_index, catalog)
+                )
+            else:
+                question_message = await self.send_message(
+                    user.telegram_chat_id,
+                    [question.text, "Введите ответ."],
+                )
+            await self.states.aset(
+                user.telegram_chat_id,
+                ChatState(user.id, quiz.id, attempt_id, question_index, question_message.id)
+            )
+
+    async def retrieve_prepared_answer(
+            self,
+            callback: telebot.types.CallbackQuery,
+            prepared_answer: survey_models.PreparedAnswer,
+            payload: CallbackPayload,
+            catalog: Catalog
+    ) -> None:
+        user, state = await asyncio.gather(
+            self.get_user(callback.from_user),
+            self.states.aget(callback.message.chat.id)
+        )
+        # повторное нажатие или кнопка вопроса, который уже не ожидает ответа
+        if state is None or state.question_index != payload.question_index:
+            return
+        resolved = self.resolve_state(state, catalog)
+        if resolved is None or resolved[1] != prepared_answer.question:
+            return
+        quiz, question = resolved
+
+        answer = survey_models.Answer(
+            attempt_id = state.attempt_id,
+            user = user,
+            quiz = quiz,
+            question = question,
+            prepared_answer = prepared_answer
+        )
+        await asyncio.gather(
+            self.delete_message(user.telegram_chat_id, callback.message.id),
+            self.answers.aadd(answer)
+        )
+        await self.ask_question(user, quiz, state.attempt_id, state.question_index + 1, catalog)
+
+    async def retrieve_text_answer(self, message: telebot.types.Message) -> None:
+        state = await self.states.aget(message.chat.id)
+        if state is None:
+            return
+        user, catalog = await asyncio.gather(
+            self.get_user(message.from_user),
+            self.get_catalog()
+        )
+        resolved = self.resolve_state(state, catalog)
+        # на вопрос с вариантами ответов отвечают кнопками, а не текстом
+        if resolved is not None and resolved[1] in catalog.PREPARED_ANSWERS:
+            return
+
+        # состояние следующего вопроса перезапишет текущее, а после последнего вопроса его удалит end_quiz
+        if resolved is None:
+            await asyncio.gather(
+                self.states.adelete(message.chat.id),
+                self.delete_message(user.telegram_chat_id, state.question_message_id),
+                self.send_message(
+                    user.telegram_chat_id,
+                    ["Опросы были изменены. Выберите опрос заново."],
+                    reply_markup = self.get_quizzes_markup(catalog)
+                )
+            )
+            return
+        quiz, question = resolved
+
+        answer = survey_models.Answer(
+            attempt_id = state.attempt_id,
+            user = user,
+            quiz = quiz,
+            question = question,
+            message_id = message.id
+        )
+        await asyncio.gather(
+            self.delete_message(user.telegram_chat_id, state.question_message_id),
+            self.delete_message(user.telegram_chat_id, message.id),
+            self.answers.aadd(answer)
+        )
+        await self.ask_question(user, quiz, state.attempt_id, state.question_index + 1, catalog)
+
+    async def end_quiz(self, user: core_models.User, quiz: survey_models.Quiz, attempt_id: int) -> None:
+        await asyncio.gather(
+            self.states.adelete(user.telegram_chat_id),
+            sync_to_async(survey_models.QuizAttempt.finish)(attempt_id, quiz.id),
+            self.send_message(
+                user.telegram_chat_id,
+                f"Спасибо, что прошли опрос {quiz}."
+            )
+        )
@@ -1,56 +1,25 @@
-from collections import defaultdict
-from typing import Any, Iterable
+import functools
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable
 
+import requests
 import telebot
 
 import logger
-from core import models as core_models
+from core import metrics, models as core_models
+from core.database import QueryLog
 from survey import models as survey_models
+from survey.answer_sink import AnswerSink
 from telegram_bot import settings
+from telegram_bot.callback_data import CallbackData, CallbackPayload, CallbackType
+from telegram_bot.catalog import Catalog, CatalogKeeper
+from telegram_bot.dispatcher import ChatDispatcher
+from telegram_bot.scheduler import OutboundScheduler
+from telegram_bot.state import ChatState, get_state_store
+from telegram_bot.user_cache import UserCache
 
 
-class PrefetchedData:
-    def __init__(self) -> None:
-        self.QUIZZES_BY_ID: dict[int, survey_models.Quiz] = {x.id: x for x in survey_models.Quiz.objects.all()}
-
-        self.QUESTIONS: dict[survey_models.Quiz, list[survey_models.Question]] = defaultdict(list)
-        for question in survey_models.Question.objects.prefetch_related("quiz"):
-            self.QUESTIONS[question.quiz].append(question)
-
-        self.PREPARED_ANSWERS: dict[survey_models.Question, list[survey_models.PreparedAnswer]] = defaultdict(list)
-        for prepared_answer in survey_models.PreparedAnswer.objects.prefetch_related("question", "question__quiz"):
-            self.PREPARED_ANSWERS[prepared_answer.question].append(prepared_answer)
-
-        self.PREPARED_ANSWERS_BY_ID: dict[int, survey_models.PreparedAnswer] = {
-            y.id: y for x in self.PREPARED_ANSWERS.values() for y in x
-        }
-
-
-PREFETCHED_DATA = PrefetchedData()
-
-
-class CallbackData:
-    DELIMITER = ":"
-    QUIZ = "q"
-    PREPARED_ANSWER = "pa"
-
-    def __init__(self) -> None:
-        self.QUIZZES = {x: f"{self.QUIZ}{self.DELIMITER}{x}" for x in PREFETCHED_DATA.QUIZZES_BY_ID}
-        self.PREPARED_ANSWERS = {}
-
-        for question, prepared_answers in PREFETCHED_DATA.PREPARED_ANSWERS.items():
-            for prepared_answer in prepared_answers:
-                self.PREPARED_ANSWERS[prepared_answer.id] = (f"{self.PREPARED_ANSWER}{self.DELIMITER}"
-                                                             f"{prepared_answer.id}")
-
-    def get_quiz(self, callback_data: str) -> survey_models.Quiz:
-        return PREFETCHED_DATA.QUIZZES_BY_ID[int(callback_data.split(self.DELIMITER)[1])]
-
-    def get_prepared_answer(self, callback_data: str) -> survey_models.PreparedAnswer:
-        return PREFETCHED_DATA.PREPARED_ANSWERS_BY_ID[int(callback_data.split(self.DELIMITER)[1])]
-
-    def get_question_index(self, callback_data: str) -> int:
-        return int(callback_data.split(self.DELIMITER)[2])
+CATALOG = CatalogKeeper()
 
 
 CALLBACK_DATA = CallbackData()
@@ -119,19 +88,28 @@ class BotServiceMixin:
         def link(cls, data: Any, link: str) -> str:
             return cls.wall(f"[{cls.wall(data)}]({link})")
 
+        CHARS_TO_ESCAPE = ('_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!')
+        ESCAPE_PAIRS = tuple((char, '\\' + char) for char in CHARS_TO_ESCAPE)
+
+        @classmethod
+        def escape_chunk(cls, string: str) -> str:
+            # проверка вхождения не копирует строку, поэтому замены выполняются только для встречающихся символов
+            for char, escaped_char in cls.ESCAPE_PAIRS:
+                if char in string:
+                    string = string.replace(char, escaped_char)
+            return string
+
         @classmethod
         def escape(cls, string: str) -> str:
             # текст между cls.ESCAPE_WALL не будет экранирован
             # "escaped text |wall| not escaped text |wall| more escaped text
-            chars_to_escape = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+            if cls.ESCAPE_WALL not in string:
+                return cls.escape_chunk(string)
 
             chunks = string.split(cls.ESCAPE_WALL)
             if len(chunks) % 2 == 0:
                 raise NotEnoughEscapeWallsException()
-            for number in range(len(chunks)):
-                if number % 2 == 0:
-                    for char in chars_to_escape:
-                        chunks[number] = chunks[number].replace(char, '\\' + char)
+            chunks[::2] = [cls.escape_chunk(chunk) for chunk in chunks[::2]]
             return "".join(chunks)
 
         @staticmethod
@@ -148,26 +126,144 @@ class BotServiceMixin:
             return "\n".join([cls.escape(string) for string in text])
 
     settings = settings.Settings()
+    commands = [
+        telebot.types.BotCommand("start", "Регистрация пользователя"),
+        telebot.types.BotCommand("get_chat_id", "Возвращение идентификатора чата"),
+        telebot.types.BotCommand("quiz", "Выбор опроса")
+    ]
+    users = UserCache()
+    answers = AnswerSink()
+    states = get_state_store()
+    # QueryLog видит только запросы потока, в котором выполняется обработчик
+    log_update_queries = True
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.logger = logger.Logger(self.settings.APP_NAME)
 
+    def wrap_handler(self, handler: Callable, timed: bool = True) -> Callable:
+        if timed:
+            handler = metrics.timed("handler")(handler)
+        if not (self.log_update_queries and self.settings.LOG_UPDATE_QUERIES):
+            return handler
 
-class Bot(BotServiceMixin, telebot.TeleBot):
-    commands = [
-        telebot.types.BotCommand("start", "Регистрация пользователя"),
-        telebot.types.BotCommand("get_chat_id", "Возвращение идентификатора чата"),
-        telebot.types.BotCommand("quiz", "Выбор опроса")
-    ]
-    _users: dict[int, core_models.User] = {}
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs) -> None:
+            # на каждое обновление вызывается один зарегистрированный обработчик
+            with QueryLog() as query_log:
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    self.logger.debug(f"{handler.__name__}: {query_log}")
 
+        return wrapper
+
+    def register_handlers(self) -> None:
+        for bot_command in self.commands:
+            self.message_handler(commands = [bot_command.command])(
+                self.wrap_handler(getattr(self, bot_command.command))
+            )
+
+        # команды зарегистрированы раньше, поэтому сюда попадает только текст без команды
+        self.message_handler(content_types = ["text"])(self.wrap_handler(self.retrieve_text_answer))
+        self.callback_handlers = self.get_callback_handlers()
+        # время измеряется у обработчика кнопки, выбранного process_callback, под его собственным именем
+        self.callback_query_handler(lambda callback: True)(self.wrap_handler(self.process_callback, False))
+
+    @staticmethod
+    def get_quizzes_markup(catalog: Catalog) -> telebot.types.InlineKeyboardMarkup:
+        keyboard = [[telebot.types.InlineKeyboardButton(
+            value.name,
+            callback_data = CALLBACK_DATA.quiz(catalog.stamp, key)
+        )] for key, value in catalog.QUIZZES_BY_ID.items()]
+        return telebot.types.InlineKeyboardMarkup(keyboard)
+
+    @staticmethod
+    def get_prepared_answers_markup(
+            question: survey_models.Question,
+            question_index: int,
+            catalog: Catalog
+    ) -> telebot.types.InlineKeyboardMarkup:
+        keyboard = [[telebot.types.InlineKeyboardButton(
+            x.text,
+            callback_data = CALLBACK_DATA.prepared_answer(catalog.stamp, x.id, question_index)
+        )] for x in catalog.PREPARED_ANSWERS[question]]
+        return telebot.types.InlineKeyboardMarkup(keyboard)
+
+    def get_callback_handlers(self) -> dict[CallbackType, tuple[str, Callable]]:
+        # {тип кнопки: (словарь каталога с объектами кнопок, обработчик)}
+        return {
+            CallbackType.QUIZ: ("QUIZZES_BY_ID", metrics.timed("handler")(self.start_quiz)),
+            CallbackType.PREPARED_ANSWER: (
+                "PREPARED_ANSWERS_BY_ID",
+                metrics.timed("handler")(self.retrieve_prepared_answer)
+            )
+        }
+
+    def resolve_callback(
+            self,
+            callback: telebot.types.CallbackQuery,
+            catalog: Catalog
+    ) -> tuple[Callable, Any, CallbackPayload] | None:
+        payload = CALLBACK_DATA.decode(callback.data)
+        # кнопка из старой версии каталога
+        if payload is None or payload.stamp != catalog.stamp:
+            return None
+        objects_name, handler = self.callback_handlers[payload.type]
+        callback_object = getattr(catalog, objects_name).get(payload.object_id)
+        if callback_object is None:
+            return None
+        return handler, callback_object, payload
+
+    @staticmethod
+    def resolve_state(
+            state: ChatState,
+            catalog: Catalog
+    ) -> tuple[survey_models.Quiz, survey_models.Question] | None:
+        quiz = catalog.QUIZZES_BY_ID.get(state.quiz_id)
+        questions = catalog.QUESTIONS.get(quiz, [])
+        # вопрос удален из каталога, пока пользователь отвечал
+        if state.question_index >= len(questions):
+            return None
+        return quiz, questions[state.question_index]
+
+
+class Bot(BotServiceMixin, telebot.TeleBot):
     def __init__(self, token: str = None):
         if token is None:
             token = self.settings.secrets.telegram_bot.token
 
-        super().__init__(token)
-        self.enable_saving_states()
+        self.setup_session()
+        self.scheduler = OutboundScheduler()
+        if self.settings.UPDATE_WORKERS > 0:
+            # обработчики выполняются в потоках диспетчера, а не в пуле telebot
+            super().__init__(token, threaded = False)
+            self.dispatcher = ChatDispatcher(super().process_new_updates, self.settings.UPDATE_WORKERS)
+        else:
+            super().__init__(token)
+            self.dispatcher = None
+
+    @classmethod
+    def setup_session(cls) -> None:
+        # одна бессрочная сессия с пулом keep-alive соединений на все потоки вместо новой сессии на каждый поток,
+        # которую telebot к тому же пересоздает раз в 10 минут
+        if telebot.apihelper.session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections = 1,
+                pool_maxsize = cls.settings.TELEGRAM_API_POOL_SIZE
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            telebot.apihelper.session = session
+            telebot.apihelper.SESSION_TIME_TO_LIVE = None
+            telebot.apihelper.CUSTOM_REQUEST_SENDER = cls.send_api_request
+
+    @staticmethod
+    def send_api_request(method: str, url: str, **kwargs) -> requests.Response:
+        # запрос отправляется так же, как в telebot без CUSTOM_REQUEST_SENDER, но с измерением времени
+        with metrics.track("telegram_api", url.rsplit("/", 1)[-1]):
+            return telebot.apihelper.session.request(method, url, **kwargs)
 
     def send_message(
             self,
@@ -176,6 +272,7 @@ class Bot(BotServiceMixin, telebot.TeleBot):
             parse_mode: str = None,
             reply_markup: telebot.REPLY_MARKUP_TYPES = None,
             link_preview_options: telebot.types.LinkPreviewOptions = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE,
             **kwargs
     ) -> telebot.types.Message:
         if isinstance(text, str):
@@ -184,15 +281,48 @@ class Bot(BotServiceMixin, telebot.TeleBot):
             parse_mode = self.ParseMode.MARKDOWN
 
         text_chunks = telebot.util.smart_split(self.Formatter.join(text))
-        for text_chunk in text_chunks:
-            return super().send_message(
+        message = None
+        # части отправляются строго по очереди, чтобы не перемешаться в чате,
+        # но по одному уже открытому соединению общей сессии
+        for number, text_chunk in enumerate(text_chunks):
+            message = self.scheduler.submit(
+                chat_id,
+                super().send_message,
                 chat_id,
                 text_chunk,
                 parse_mode,
-                reply_markup = reply_markup,
+                # клавиатура нужна только под последней частью сообщения
+                reply_markup = reply_markup if number == len(text_chunks) - 1 else None,
                 link_preview_options = link_preview_options,
+                priority = priority,
                 **kwargs
-            )
+            ).result()
+        return message
+
+    def broadcast(
+            self,
+            chat_ids: Iterable[int | str],
+            text: Iterable[str] | str,
+            parse_mode: str = None
+    ) -> list[Future]:
+        # массовая рассылка не ждет отправки и пропускает вперед ответы пользователям
+        if isinstance(text, str):
+            text = [text]
+        if parse_mode is None:
+            parse_mode = self.ParseMode.MARKDOWN
+
+        text_chunks = telebot.util.smart_split(self.Formatter.join(text))
+        return [
+            self.scheduler.submit(
+                chat_id,
+                telebot.TeleBot.send_message,
+                self,
+                chat_id,
+                text_chunk,
+                parse_mode,
+                priority = OutboundScheduler.Priority.BULK
+            ) for chat_id in chat_ids for text_chunk in text_chunks
+        ]
 
     def send_photo(
             self,
@@ -201,6 +331,7 @@ class Bot(BotServiceMixin, telebot.TeleBot):
             text: Iterable[str] | str = None,
             parse_mode: str = None,
             reply_markup: telebot.REPLY_MARKUP_TYPES = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE,
             **kwargs
     ) -> telebot.types.Message:
         if isinstance(text, str):
@@ -208,14 +339,17 @@ class Bot(BotServiceMixin, telebot.TeleBot):
         if parse_mode is None:
             parse_mode = self.ParseMode.MARKDOWN
 
-        return super().send_photo(
+        return self.scheduler.submit(
+            chat_id,
+            super().send_photo,
             chat_id,
             photo_or_id,
             self.Formatter.join(text) if text is not None else text,
             parse_mode,
             reply_markup = reply_markup,
+            priority = priority,
             **kwargs
-        )
+        ).result()
 
     def send_document(
             self,
@@ -224,6 +358,7 @@ class Bot(BotServiceMixin, telebot.TeleBot):
             text: Iterable[str] | str = None,
             parse_mode: str = None,
             reply_markup: telebot.REPLY_MARKUP_TYPES = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE,
             **kwargs
     ) -> telebot.types.Message:
         if isinstance(text, str):
@@ -231,44 +366,118 @@ class Bot(BotServiceMixin, telebot.TeleBot):
         if parse_mode is None:
             parse_mode = self.ParseMode.MARKDOWN
 
-        return super().send_document(
+        return self.scheduler.submit(
+            chat_id,
+            super().send_document,
             chat_id,
             document_or_id,
             caption = self.Formatter.join(text) if text is not None else text,
             parse_mode = parse_mode,
             reply_markup = reply_markup,
+            priority = priority,
             **kwargs
-        )
+        ).result()
 
-    copy_message = telebot.TeleBot.copy_message
+    def delete_message(
+            self,
+            chat_id: int | str,
+            message_id: int,
+            timeout: int = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE
+    ) -> bool:
+        return self.scheduler.submit(
+            chat_id,
+            super().delete_message,
+            chat_id,
+            message_id,
+            timeout = timeout,
+            priority = priority
+        ).result()
 
-    def register_handlers(self) -> None:
-        for bot_command in self.commands:
-            self.message_handler(commands = [bot_command.command])(getattr(self, bot_command.command))
+    def answer_callback_query(
+            self,
+            callback_query_id: int,
+            text: str = None,
+            show_alert: bool = None,
+            url: str = None,
+            cache_time: int = None,
+            chat_id: int | str = None,
+            priority: OutboundScheduler.Priority = OutboundScheduler.Priority.INTERACTIVE
+    ) -> bool:
+        # ответ на нажатие кнопки учитывается в лимите чата, в котором нажата кнопка
+        return self.scheduler.submit(
+            callback_query_id if chat_id is None else chat_id,
+            super().answer_callback_query,
+            callback_query_id,
+            text,
+            show_alert,
+            url,
+            cache_time,
+            priority = priority
+        ).result()
 
-        self.callback_query_handler(lambda callback: callback.data.startswith(CALLBACK_DATA.QUIZ))(
-            self.start_quiz
-        )
-        self.callback_query_handler(lambda callback: callback.data.startswith(CALLBACK_DATA.PREPARED_ANSWER))(
-            self.retrieve_prepared_answer
-        )
+    copy_message = telebot.TeleBot.copy_message
+
+    def process_new_updates(self, updates: list[telebot.types.Update]) -> None:
+        if self.dispatcher is None:
+            super().process_new_updates(updates)
+        else:
+            for update in updates:
+                # смещение для getUpdates сдвигается сразу, так как обновление уже принято в очередь
+                if update.update_id > self.last_update_id:
+                    self.last_update_id = update.update_id
+                self.dispatcher.put(update)
 
     def set_command_list(self) -> None:
         user_scope = telebot.types.BotCommandScopeAllPrivateChats()
         self.set_my_commands(self.commands, user_scope)
 
-    def start_polling(self) -> None:
+    def start_workers(self) -> None:
         self.register_handlers()
-        self.set_command_list()
+        metrics.COMPONENT_STATS.add_source("user_cache", self.users.get_stats)
+        CATALOG.start()
+        self.answers.start()
+        self.scheduler.start()
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+
+    def stop_workers(self) -> None:
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        self.scheduler.stop()
+        self.answers.stop()
+        metrics.COMPONENT_STATS.remove_source("user_cache")
 
+    def start_polling(self) -> None:
+        self.set_command_list()
+        self.start_workers()
+        # у процесса с long polling нет web-сервера с /metrics, поэтому сводка пишется в лог
+        metrics_logger = metrics.MetricsLogger()
+        metrics_logger.start()
         self.logger.info("Telegram bot is running")
-        self.infinity_polling(allowed_updates = telebot.util.update_types)
+        try:
+            self.infinity_polling(allowed_updates = telebot.util.update_types)
+        finally:
+            metrics_logger.stop()
+            self.stop_workers()
+
+    def start_webhook(self) -> None:
+        # обновления принимает telegram_bot.views.webhook и передает их в process_new_updates
+        self.start_workers()
+        self.logger.info("Telegram bot is waiting for webhook updates")
+
+    def set_webhook_url(self) -> None:
+        self.set_command_list()
+        self.set_webhook(
+            self.settings.secrets.telegram_bot.webhook_url,
+            allowed_updates = telebot.util.update_types,
+            secret_token = self.settings.secrets.telegram_bot.webhook_secret_token
+        )
+        self.logger.info(f"Webhook is set to {self.settings.secrets.telegram_bot.webhook_url}")
 
     @classmethod
     def get_user(cls, telegram_user: telebot.types.User) -> core_models.User:
-        if telegram_user.id not in cls._users:
-            cls._users[telegram_user.id] = core_models.User.objects.get(telegram_user_id = telegram_user.id)
-        return cls._users[telegram_user.id]
+        return cls.users.get(telegram_user.id)
 
     def start(self, message: telebot.types.Message) -> None:
         try:
@@ -280,7 +489,7 @@ class Bot(BotServiceMixin, telebot.TeleBot):
                 telegram_chat_id = message.chat.id
             )
             user.save()
-            self._users[user.telegram_user_id] = user
+            self.users.put(user)
             text = ["Вы были успешно зарегистрированы."]
 
         self.send_message(user.telegram_chat_id, text)
@@ -290,26 +499,51 @@ class Bot(BotServiceMixin, telebot.TeleBot):
 
     def quiz(self, message: telebot.types.Message) -> None:
         user = self.get_user(message.from_user)
-
-        keyboard = [[telebot.types.InlineKeyboardButton(
-            value.name,
-            callback_data = CALLBACK_DATA.QUIZZES[key]
-        )] for key, value in PREFETCHED_DATA.QUIZZES_BY_ID.items()]
-        reply_markup = telebot.types.InlineKeyboardMarkup(keyboard)
         self.send_message(
             user.telegram_chat_id,
             "Выберите опрос из предложенных.",
-            reply_markup = reply_markup
+            reply_markup = self.get_quizzes_markup(CATALOG.catalog)
         )
 
-    def start_quiz(self, callback: telebot.types.CallbackQuery) -> None:
-        user = self.get_user(callback.from_user)
-        quiz = CALLBACK_DATA.get_quiz(callback.data)
-        quiz_old_answers = survey_models.Answer.objects.filter(
-            user = user,
-            question__quiz = quiz
+    def process_callback(self, callback: telebot.types.CallbackQuery) -> None:
+        catalog = CATALOG.catalog
+        resolved = self.resolve_callback(callback, catalog)
+        if resolved is None:
+            self.reject_callback(callback, catalog)
+        else:
+            handler, callback_object, payload = resolved
+            handler(callback, callback_object, payload, catalog)
+
+    @metrics.timed("handler")
+    def reject_callback(self, callback: telebot.types.CallbackQuery, catalog: Catalog) -> None:
+        self.answer_callback_query(
+            callback.id,
+            "Опросы были изменены. Выберите опрос заново.",
+            show_alert = True,
+            chat_id = callback.message.chat.id
+        )
+        self.states.delete(callback.message.chat.id)
+        self.delete_message(
+            callback.message.chat.id,
+            callback.message.id
         )
-        quiz_old_answers.delete()
+        self.send_message(
+            callback.message.chat.id,
+            "Выберите опрос из предложенных.",
+            reply_markup = self.get_quizzes_markup(catalog)
+        )
+
+    # noinspection PyUnusedLocal
+    def start_quiz(
+            self,
+            callback: telebot.types.CallbackQuery,
+            quiz: survey_models.Quiz,
+            payload: CallbackPayload,
+            catalog: Catalog
+    ) -> None:
+        user = self.get_user(callback.from_user)
+        # старые ответы остаются в прошлых попытках, повторное прохождение - это один INSERT
+        attempt = survey_models.QuizAttempt.start(user, quiz)
 
         self.delete_message(
             user.telegram_chat_id,
@@ -320,48 +554,56 @@ class Bot(BotServiceMixin, telebot.TeleBot):
             quiz.name
         )
 
-        self.ask_question(user, quiz, 0)
+        self.ask_question(user, quiz, attempt.id, 0, catalog)
 
+    @metrics.timed("step")
     def ask_question(
             self,
             user: core_models.User,
             quiz: survey_models.Quiz,
-            question_index
+            attempt_id: int,
+            question_index: int,
+            catalog: Catalog = None
     ) -> None:
-        next_questions = PREFETCHED_DATA.QUESTIONS[quiz][question_index:]
+        if catalog is None:
+            catalog = CATALOG.catalog
+        next_questions = catalog.QUESTIONS.get(quiz, [])[question_index:]
         if len(next_questions) == 0:
-            self.end_quiz(user, quiz)
+            self.end_quiz(user, quiz, attempt_id)
         else:
             question = next_questions[0]
-            if question in PREFETCHED_DATA.PREPARED_ANSWERS:
-                keyboard = [[telebot.types.InlineKeyboardButton(
-                    x.text,
-                    callback_data = f"{CALLBACK_DATA.PREPARED_ANSWERS[x.id]}{CALLBACK_DATA.DELIMITER}{question_index}"
-                )] for x in PREFETCHED_DATA.PREPARED_ANSWERS[question]]
-                reply_markup = telebot.types.InlineKeyboardMarkup(keyboard)
-                self.send_message(
+            if question in catalog.PREPARED_ANSWERS:
+                question_message = self.send_message(
                     user.telegram_chat_id,
                     [next_questions[0].text, "Выберите ответ."],
-                    reply_markup = reply_markup
+                    reply_markup = self.get_prepared_answers_markup(question, question_index, catalog)
                 )
             else:
                 question_message = self.send_message(
                     user.telegram_chat_id,
                     [next_questions[0].text, "Введите ответ."],
                 )
-                self.register_next_step_handler_by_chat_id(
-                    user.telegram_chat_id,
-                    self.retrieve_text_answer,
-                    user,
-                    question,
-                    question_message,
-                    question_index
-                )
+            self.states.set(
+                user.telegram_chat_id,
+                ChatState(user.id, quiz.id, attempt_id, question_index, question_message.id)
+            )
 
-    def retrieve_prepared_answer(self, callback: telebot.types.CallbackQuery) -> None:
+    def retrieve_prepared_answer(
+            self,
+            callback: telebot.types.CallbackQuery,
+            prepared_answer: survey_models.PreparedAnswer,
+            payload: CallbackPayload,
+            catalog: Catalog
+    ) -> None:
         user = self.get_user(callback.from_user)
-        prepared_answer = CALLBACK_DATA.get_prepared_answer(callback.data)
-        question_index = CALLBACK_DATA.get_question_index(callback.data)
+        state = self.states.get(user.telegram_chat_id)
+        # повторное нажатие или кнопка вопроса, который уже не ожидает ответа
+        if state is None or state.question_index != payload.question_index:
+            return
+        resolved = self.resolve_state(state, catalog)
+        if resolved is None or resolved[1] != prepared_answer.question:
+            return
+        quiz, question = resolved
 
         self.delete_message(
             user.telegram_chat_id,
@@ -369,39 +611,58 @@ class Bot(BotServiceMixin, telebot.TeleBot):
         )
 
         answer = survey_models.Answer(
+            attempt_id = state.attempt_id,
             user = user,
-            question = prepared_answer.question,
+            quiz = quiz,
+            question = question,
             prepared_answer = prepared_answer
         )
-        answer.save()
-        self.ask_question(user, prepared_answer.question.quiz, question_index + 1)
+        self.answers.add(answer)
+        self.ask_question(user, quiz, state.attempt_id, state.question_index + 1, catalog)
+
+    def retrieve_text_answer(self, message: telebot.types.Message) -> None:
+        state = self.states.get(message.chat.id)
+        if state is None:
+            return
+        user = self.get_user(message.from_user)
+        catalog = CATALOG.catalog
+        resolved = self.resolve_state(state, catalog)
+        # на вопрос с вариантами ответов отвечают кнопками, а не текстом
+        if resolved is not None and resolved[1] in catalog.PREPARED_ANSWERS:
+            return
 
-    def retrieve_text_answer(
-            self,
-            message: telebot.types.Message,
-            user: core_models.User,
-            question: survey_models.Question,
-            question_message: telebot.types.Message,
-            question_index: int
-    ) -> None:
         self.delete_message(
             user.telegram_chat_id,
-            question_message.id
+            state.question_message_id
         )
+        # состояние следующего вопроса перезапишет текущее, а после последнего вопроса его удалит end_quiz
+        if resolved is None:
+            self.states.delete(message.chat.id)
+            self.send_message(
+                user.telegram_chat_id,
+                ["Опросы были изменены. Выберите опрос заново."],
+                reply_markup = self.get_quizzes_markup(catalog)
+            )
+            return
+        quiz, question = resolved
         self.delete_message(
             user.telegram_chat_id,
             message.id
         )
 
         answer = survey_models.Answer(
+            attempt_id = state.attempt_id,
             user = user,
+            quiz = quiz,
             question = question,
             message_id = message.id
         )
-        answer.save()
-        self.ask_question(user, question.quiz, question_index + 1)
+        self.answers.add(answer)
+        self.ask_question(user, quiz, state.attempt_id, state.question_index + 1, catalog)
 
-    def end_quiz(self, user: core_models.User, quiz: survey_models.Quiz) -> None:
+    def end_quiz(self, user: core_models.User, quiz: survey_models.Quiz, attempt_id: int) -> None:
+        self.states.delete(user.telegram_chat_id)
+        survey_models.QuizAttempt.finish(attempt_id, quiz.id)
         self.send_message(
             user.telegram_chat_id,
             f"Спасибо, что прошли опрос {quiz}."
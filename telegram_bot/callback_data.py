@@ -0,0 +1,49 @@
+import base64
+import binascii
+import enum
+import struct
+from typing import NamedTuple
+
+
+class CallbackType(enum.IntEnum):
+    QUIZ = 1
+    PREPARED_ANSWER = 2
+
+
+class CallbackPayload(NamedTuple):
+    type: CallbackType
+    # метка версии каталога, для которой была создана кнопка
+    stamp: int
+    object_id: int
+    question_index: int
+
+
+class CallbackData:
+    """Упаковывает данные кнопок в короткую строку фиксированной длины и распаковывает их за одну операцию.
+
+    Формат: тип, метка версии каталога, идентификатор объекта, номер вопроса - упакованы struct и закодированы
+    urlsafe base64 без выравнивания (18 символов при лимите Telegram в 64 байта).
+    """
+
+    FORMAT = struct.Struct("!BHQH")
+
+    def encode(self, callback_type: CallbackType, stamp: int, object_id: int, question_index: int = 0) -> str:
+        data = self.FORMAT.pack(callback_type, stamp, object_id, question_index)
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+    def decode(self, callback_data: str | None) -> CallbackPayload | None:
+        # устаревшие или чужие данные не должны ронять обработчик
+        if not callback_data:
+            return None
+        try:
+            data = base64.urlsafe_b64decode(callback_data + "=" * (-len(callback_data) % 4))
+            callback_type, stamp, object_id, question_index = self.FORMAT.unpack(data)
+            return CallbackPayload(CallbackType(callback_type), stamp, object_id, question_index)
+        except (binascii.Error, struct.error, ValueError):
+            return None
+
+    def quiz(self, stamp: int, quiz_id: int) -> str:
+        return self.encode(CallbackType.QUIZ, stamp, quiz_id)
+
+    def prepared_answer(self, stamp: int, prepared_answer_id: int, question_index: int) -> str:
+        return self.encode(CallbackType.PREPARED_ANSWER, stamp, prepared_answer_id, question_index)
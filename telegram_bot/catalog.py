@@ -0,0 +1,146 @@
+import threading
+import zlib
+from collections import defaultdict
+
+from django.db import close_old_connections, connections, models, transaction
+from django.db.models import signals
+
+import logger
+from survey import models as survey_models
+from telegram_bot import settings
+
+
+class Catalog:
+    """Неизменяемый снимок опросов, из которого читают обработчики бота."""
+
+    MODELS = (survey_models.Quiz, survey_models.Question, survey_models.PreparedAnswer)
+
+    def __init__(self, version: int, fingerprint: tuple) -> None:
+        self.version = version
+        self.fingerprint = fingerprint
+        # в отличие от version, одинакова во всех процессах и после перезапуска, поэтому пишется в кнопки
+        self.stamp = zlib.crc32(repr(fingerprint).encode()) & 0xFFFF
+
+        self.QUIZZES_BY_ID: dict[int, survey_models.Quiz] = {
+            x.id: x for x in survey_models.Quiz.objects.order_by("id")
+        }
+
+        questions = defaultdict(list)
+        for question in survey_models.Question.objects.select_related("quiz").order_by("id"):
+            questions[question.quiz].append(question)
+        self.QUESTIONS: dict[survey_models.Quiz, list[survey_models.Question]] = dict(questions)
+
+        prepared_answers = defaultdict(list)
+        for prepared_answer in survey_models.PreparedAnswer.objects.select_related(
+                "question",
+                "question__quiz"
+        ).order_by("id"):
+            prepared_answers[prepared_answer.question].append(prepared_answer)
+        self.PREPARED_ANSWERS: dict[survey_models.Question, list[survey_models.PreparedAnswer]] = dict(
+            prepared_answers
+        )
+
+        self.PREPARED_ANSWERS_BY_ID: dict[int, survey_models.PreparedAnswer] = {
+            y.id: y for x in self.PREPARED_ANSWERS.values() for y in x
+        }
+
+    @classmethod
+    def get_fingerprint(cls) -> tuple:
+        # количество строк ловит удаления, максимальное updated - вставки и изменения
+        return tuple(
+            tuple(model.objects.aggregate(models.Count("id"), models.Max("updated")).values())
+            for model in cls.MODELS
+        )
+
+
+class CatalogKeeper:
+    """Хранит актуальный снимок каталога и пересобирает его в фоне при изменении опросов."""
+
+    settings = settings.Settings()
+
+    def __init__(self) -> None:
+        self.logger = logger.Logger(self.__class__.__name__)
+        self.version = 0
+        self._catalog: Catalog | None = None
+        self._reload_lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        for model in Catalog.MODELS:
+            signals.post_save.connect(self.invalidate, model)
+            signals.post_delete.connect(self.invalidate, model)
+
+    @property
+    def catalog(self) -> Catalog:
+        # ссылка на снимок заменяется целиком, поэтому читатель всегда видит согласованные данные
+        catalog = self._catalog
+        if catalog is None:
+            catalog = self.load()
+        return catalog
+
+    @property
+    def snapshot(self) -> Catalog | None:
+        """Загруженный снимок без обращения к БД или None, если снимок еще не загружен."""
+
+        return self._catalog
+
+    def load(self) -> Catalog:
+        # снимок мог загрузить другой поток, пока этот ждал блокировку
+        with self._reload_lock:
+            if self._catalog is not None:
+                return self._catalog
+        return self.reload(False)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def reload(self, force: bool = True) -> Catalog:
+        with self._reload_lock:
+            with transaction.atomic():
+                fingerprint = Catalog.get_fingerprint()
+                if not force and self._catalog is not None and self._catalog.fingerprint == fingerprint:
+                    return self._catalog
+                catalog = Catalog(self.version + 1, fingerprint)
+            self.version = catalog.version
+            self._catalog = catalog
+        self.logger.info(f"Catalog version {catalog.version} is loaded")
+        return catalog
+
+    # noinspection PyUnusedLocal
+    def invalidate(self, *args, **kwargs) -> None:
+        if self.running:
+            self._changed.set()
+        else:
+            self._catalog = None
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.catalog
+        self._stopped.clear()
+        self._thread = threading.Thread(target = self.watch, name = self.__class__.__name__, daemon = True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def watch(self) -> None:
+        while not self._stopped.is_set():
+            changed = self._changed.wait(self.settings.CATALOG_POLL_PERIOD)
+            self._changed.clear()
+            if self._stopped.is_set():
+                break
+            close_old_connections()
+            try:
+                self.reload(force = changed)
+            except Exception as error:
+                # старый снимок остается рабочим до следующей удачной попытки
+                self.logger.exception(error)
+        # постоянные соединения завершившегося потока иначе остались бы открытыми до сборки мусора
+        connections.close_all()
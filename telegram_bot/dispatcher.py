@@ -0,0 +1,84 @@
+import queue
+import threading
+from typing import Callable
+
+import telebot
+from django.db import close_old_connections, connections
+
+import logger
+from core import metrics
+
+
+class ChatDispatcher:
+    """Обрабатывает обновления пулом потоков.
+
+    Обновления одного чата всегда попадают в один и тот же поток и обрабатываются строго по порядку, а обновления
+    разных чатов - параллельно.
+    """
+
+    # маркер остановки потока
+    STOP = None
+
+    def __init__(self, handler: Callable[[list[telebot.types.Update]], None], workers: int) -> None:
+        self.handler = handler
+        self.logger = logger.Logger(self.__class__.__name__)
+        self.queues: list[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        self.threads: list[threading.Thread] = []
+
+    @staticmethod
+    def get_chat_id(update: telebot.types.Update) -> int:
+        if update.message is not None:
+            return update.message.chat.id
+        if update.edited_message is not None:
+            return update.edited_message.chat.id
+        if update.callback_query is not None:
+            if update.callback_query.message is not None:
+                return update.callback_query.message.chat.id
+            return update.callback_query.from_user.id
+        if update.my_chat_member is not None:
+            return update.my_chat_member.chat.id
+        # прочие обновления не привязаны к чату и могут попасть в любой поток
+        return update.update_id
+
+    @property
+    def queue_size(self) -> int:
+        return sum(x.qsize() for x in self.queues)
+
+    def get_stats(self) -> dict[str, int]:
+        return {"queue_size": self.queue_size, "workers": len(self.threads)}
+
+    def start(self) -> None:
+        for number, updates_queue in enumerate(self.queues):
+            thread = threading.Thread(
+                target = self.work,
+                args = (updates_queue,),
+                name = f"{self.__class__.__name__}-{number}",
+                daemon = True
+            )
+            thread.start()
+            self.threads.append(thread)
+        metrics.COMPONENT_STATS.add_source("update_dispatcher", self.get_stats)
+        self.logger.info(f"Update workers are running: {len(self.threads)}")
+
+    def stop(self) -> None:
+        metrics.COMPONENT_STATS.remove_source("update_dispatcher")
+        for updates_queue in self.queues:
+            updates_queue.put(self.STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
+
+    def put(self, update: telebot.types.Update) -> None:
+        self.queues[self.get_chat_id(update) % len(self.queues)].put(update)
+
+    def work(self, updates_queue: queue.Queue) -> None:
+        while (update := updates_queue.get()) is not self.STOP:
+            try:
+                self.handler([update])
+            except Exception as error:
+                # ошибка одного обновления не должна останавливать обработку остальных обновлений чата
+                self.logger.exception(error)
+            finally:
+                close_old_connections()
+        # постоянные соединения завершившегося потока иначе остались бы открытыми до сборки мусора
+        connections.close_all()
@@ -0,0 +1,238 @@
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+import telebot
+import telebot.asyncio_helper
+
+from telegram_bot.views import SECRET_TOKEN_HEADER
+
+
+class FakeUpdates:
+    """Собирает обновления в формате Bot API."""
+
+    def __init__(self) -> None:
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    @staticmethod
+    def get_user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user_{user_id}"}
+
+    @staticmethod
+    def get_chat(user_id: int) -> dict:
+        # у личного чата тот же идентификатор, что и у пользователя
+        return {"id": user_id, "type": "private"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "from": self.get_user(user_id),
+            "chat": self.get_chat(user_id),
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def callback_query(self, user_id: int, data: str, message_id: int) -> dict:
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": self.get_user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": self.get_chat(user_id),
+                    "text": ""
+                }
+            }
+        }
+
+
+class FakeTelegramSender(FakeUpdates):
+    """Имитирует Telegram: собирает обновления в формате Bot API и отправляет их на webhook."""
+
+    def __init__(self, url: str, secret_token: str) -> None:
+        super().__init__()
+        self.url = url
+        self.secret_token = secret_token
+        self.session = requests.Session()
+
+    def get_headers(self) -> dict[str, str]:
+        return {SECRET_TOKEN_HEADER: self.secret_token, "Content-Type": "application/json"}
+
+    def send(self, update: dict) -> int:
+        response = self.session.post(self.url, data = json.dumps(update), headers = self.get_headers())
+        return response.status_code
+
+
+class FakeTelegramServer(FakeUpdates):
+    """Имитирует Bot API на локальном HTTP-сервере для long polling.
+
+    Отдает боту обновления через getUpdates и запоминает отправленные им сообщения, остальные методы отвечают успехом.
+    """
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        # keep-alive, как у настоящего Bot API, иначе каждый запрос открывает новое соединение
+        protocol_version = "HTTP/1.1"
+        # заголовки и тело отправляются отдельно, с алгоритмом Нейгла ответ задерживался бы на ~40 мс
+        disable_nagle_algorithm = True
+        server: "ThreadingHTTPServer"
+
+        def do_GET(self) -> None:
+            self.respond()
+
+        def do_POST(self) -> None:
+            self.respond()
+
+        def respond(self) -> None:
+            url = urlsplit(self.path)
+            params = dict(parse_qsl(url.query))
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                body = self.rfile.read(length).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params.update(json.loads(body))
+                else:
+                    params.update(parse_qsl(body))
+            result = self.server.telegram.call(url.path.rsplit("/", 1)[-1], params)
+            data = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        # noinspection PyShadowingBuiltins
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__()
+        self.host = host
+        self.port = port
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+        self._previous_api_url = None
+        self._condition = threading.Condition()
+        # обновления, которые бот еще не подтвердил смещением getUpdates
+        self.updates: list[dict] = []
+        # {чат: сообщения бота}
+        self.messages: dict[int, list[dict]] = {}
+        self.deleted_messages = 0
+        self.answered_callbacks = 0
+        self.handlers = {
+            "getMe": self.get_me,
+            "getUpdates": self.get_updates,
+            "sendMessage": self.send_message,
+            "deleteMessage": self.delete_message,
+            "answerCallbackQuery": self.answer_callback_query
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def api_url(self) -> str:
+        # формат telebot.apihelper.API_URL: {0} - токен, {1} - метод
+        return f"http://{self.host}:{self.port}/bot{{0}}/{{1}}"
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._server = ThreadingHTTPServer((self.host, self.port), self.RequestHandler)
+        self._server.daemon_threads = True
+        self._server.telegram = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target = self._server.serve_forever,
+            name = self.__class__.__name__,
+            daemon = True
+        )
+        self._thread.start()
+        # синхронный и асинхронный клиенты telebot берут адрес Bot API из разных модулей
+        self._previous_api_url = (telebot.apihelper.API_URL, telebot.asyncio_helper.API_URL)
+        telebot.apihelper.API_URL = telebot.asyncio_helper.API_URL = self.api_url
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        telebot.apihelper.API_URL, telebot.asyncio_helper.API_URL = self._previous_api_url
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def call(self, method: str, params: dict) -> dict | bool | list:
+        handler = self.handlers.get(method)
+        return True if handler is None else handler(params)
+
+    def put(self, update: dict) -> None:
+        with self._condition:
+            self.updates.append(update)
+            self._condition.notify_all()
+
+    # noinspection PyUnusedLocal
+    def get_me(self, params: dict) -> dict:
+        return {"id": 1, "is_bot": True, "first_name": "bot", "username": "fake_bot"}
+
+    def get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        deadline = time.monotonic() + float(params.get("timeout", 0))
+        with self._condition:
+            # обновления до offset бот уже получил
+            self.updates = [x for x in self.updates if x["update_id"] >= offset]
+            while not self.updates and (timeout := deadline - time.monotonic()) > 0:
+                self._condition.wait(timeout)
+            return self.updates[:limit]
+
+    def send_message(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": self.get_chat(chat_id),
+            "text": params.get("text", "")
+        }
+        if "reply_markup" in params:
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        with self._condition:
+            self.messages.setdefault(chat_id, []).append(message)
+            self._condition.notify_all()
+        return message
+
+    # noinspection PyUnusedLocal
+    def delete_message(self, params: dict) -> bool:
+        with self._condition:
+            self.deleted_messages += 1
+        return True
+
+    # noinspection PyUnusedLocal
+    def answer_callback_query(self, params: dict) -> bool:
+        with self._condition:
+            self.answered_callbacks += 1
+        return True
+
+    def wait_messages(self, chat_id: int, count: int, timeout: float) -> list[dict]:
+        """Ждет, пока бот отправит в чат count сообщений, и возвращает все сообщения чата."""
+
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(messages := self.messages.get(chat_id, [])) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Chat {chat_id} received {len(messages)} of {count} messages")
+                self._condition.wait(remaining)
+            return list(messages)
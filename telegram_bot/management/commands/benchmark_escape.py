@@ -0,0 +1,60 @@
+import timeit
+
+from django.core.management import CommandError
+
+from telegram_bot.bot import BotServiceMixin, NotEnoughEscapeWallsException
+from telegram_bot.management.commands import telegram_bot_command
+
+
+def legacy_escape(string: str) -> str:
+    # реализация BotServiceMixin.Formatter.escape до оптимизации
+    chars_to_escape = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+
+    chunks = string.split(BotServiceMixin.Formatter.ESCAPE_WALL)
+    if len(chunks) % 2 == 0:
+        raise NotEnoughEscapeWallsException()
+    for number in range(len(chunks)):
+        if number % 2 == 0:
+            for char in chars_to_escape:
+                chunks[number] = chunks[number].replace(char, '\\' + char)
+    return "".join(chunks)
+
+
+class Command(telegram_bot_command.TelegramBotCommand):
+    help = "Сравнивает скорость экранирования MarkdownV2 до и после оптимизации"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--number", type = int, default = 10000, help = "Количество повторов для каждого текста")
+
+    @staticmethod
+    def get_texts() -> dict[str, list[str]]:
+        formatter = BotServiceMixin.Formatter
+        broadcast_line = "Новый опрос уже доступен (см. /quiz)! Ответьте на 3 вопроса - это займет 1-2 минуты."
+        return {
+            "question": ["Вопрос 1", "Введите ответ."],
+            "quiz_end": ["Спасибо, что прошли опрос Опрос 3."],
+            "chat_id": [formatter.copyable(123456789)],
+            "plain_text": ["Текст без специальных символов " * 100],
+            "broadcast": [broadcast_line] * 45,
+            "broadcast_with_walls": [f"{broadcast_line} {formatter.bold('Важно')}"] * 40
+        }
+
+    def handle(self, *args, **options) -> None:
+        number = options["number"]
+        implementations = {
+            "legacy": legacy_escape,
+            "current": BotServiceMixin.Formatter.escape
+        }
+
+        for name, text in self.get_texts().items():
+            results = {}
+            for implementation_name, escape in implementations.items():
+                if [escape(x) for x in text] != [legacy_escape(x) for x in text]:
+                    raise CommandError(f"{implementation_name} escapes {name} differently from legacy")
+                seconds = timeit.timeit(lambda: "\n".join([escape(x) for x in text]), number = number)
+                results[implementation_name] = seconds / number * 1_000_000
+            size = sum(len(x) for x in text)
+            self.logger.info(
+                f"{name} ({size} chars): legacy {results['legacy']:.2f} us, current {results['current']:.2f} us, "
+                f"speedup x{results['legacy'] / results['current']:.1f}"
+            )
@@ -0,0 +1,60 @@
+from django.core.management import CommandError
+
+from core import metrics
+from survey import models as survey_models
+from telegram_bot.management.commands import telegram_bot_command
+from telegram_bot.simulator import Simulator
+
+
+class Command(telegram_bot_command.TelegramBotCommand):
+    help = "Нагрузочный тест бота: виртуальные пользователи проходят опросы через локальную имитацию Bot API"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--users", type = int, default = 50, help = "Количество одновременных пользователей")
+        parser.add_argument(
+            "--first-user-id",
+            type = int,
+            default = 9_000_000_000,
+            help = "Telegram user_id первого виртуального пользователя, остальные идут подряд"
+        )
+        parser.add_argument("--timeout", type = float, default = 10, help = "Время (в секундах) ожидания ответа бота")
+        parser.add_argument(
+            "--rate-limits",
+            action = "store_true",
+            help = "Отправлять сообщения через планировщик с ограничениями Telegram на частоту отправки"
+        )
+        parser.add_argument("--seed", type = int, default = 0, help = "Начальное значение выбора опросов и ответов")
+        parser.add_argument(
+            "--keep-data",
+            action = "store_true",
+            help = "Не удалять пользователей и ответы после теста"
+        )
+
+    def handle(self, *args, **options) -> None:
+        if not survey_models.Question.objects.exists():
+            raise CommandError("There are no quizzes with questions, run recreate_quizzes first")
+
+        simulator = Simulator(
+            options["users"],
+            options["first_user_id"],
+            options["timeout"],
+            options["rate_limits"],
+            options["seed"]
+        )
+        try:
+            result = simulator.run()
+        finally:
+            if not options["keep_data"]:
+                simulator.cleanup()
+
+        self.logger.info(
+            f"Processed updates: {result.updates} in {result.elapsed:.3f} s, {result.updates_per_second:.1f} updates/s"
+        )
+        self.logger.info(
+            f"Update latency: p50 {result.get_latency(0.5) * 1000:.1f} ms, p99 {result.get_latency(0.99) * 1000:.1f} ms"
+        )
+        self.logger.info(f"Database queries: {result.queries}, {result.queries_per_update:.1f} per update")
+        if result.failed_users:
+            self.logger.warning(f"Users that did not finish a quiz: {result.failed_users}")
+        # длительности отдельных обработчиков, запросов к Bot API и записей в БД
+        metrics.MetricsLogger().dump()
@@ -0,0 +1,12 @@
+import asyncio
+
+from telegram_bot.async_bot import AsyncBot
+from telegram_bot.management.commands import telegram_bot_command
+
+
+class Command(telegram_bot_command.TelegramBotCommand):
+    help = "Запускает асинхронного бота"
+
+    def handle(self, *args, **options) -> None:
+        bot = AsyncBot()
+        asyncio.run(bot.start_polling())
@@ -0,0 +1,20 @@
+from telegram_bot.fake_telegram import FakeTelegramSender
+from telegram_bot.management.commands import telegram_bot_command
+
+
+class Command(telegram_bot_command.TelegramBotCommand):
+    help = "Отправляет на webhook бота обновление от имени Telegram"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("url", help = "Адрес webhook, например http://127.0.0.1:8000/telegram_bot/webhook/")
+        parser.add_argument("user_id", type = int)
+        parser.add_argument("text", help = "Текст сообщения или callback_data при указании --message-id")
+        parser.add_argument("--message-id", type = int, help = "Сообщение, на кнопку которого нажали")
+
+    def handle(self, *args, **options) -> None:
+        sender = FakeTelegramSender(options["url"], self.settings.secrets.telegram_bot.webhook_secret_token)
+        if options["message_id"] is None:
+            update = sender.message(options["user_id"], options["text"])
+        else:
+            update = sender.callback_query(options["user_id"], options["text"], options["message_id"])
+        self.logger.info(f"Webhook response status: {sender.send(update)}")
@@ -0,0 +1,17 @@
+from telegram_bot.bot import Bot
+from telegram_bot.management.commands import telegram_bot_command
+
+
+class Command(telegram_bot_command.TelegramBotCommand):
+    help = "Подключает webhook бота или отключает его для возврата к long polling"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--delete", action = "store_true", help = "Отключить webhook")
+
+    def handle(self, *args, **options) -> None:
+        bot = Bot()
+        if options["delete"]:
+            bot.delete_webhook()
+            self.logger.info("Webhook is deleted")
+        else:
+            bot.set_webhook_url()
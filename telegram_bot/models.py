@@ -1,3 +1,20 @@
 from django.db import models
 
-# Create your models here.
+from core import models as core_models
+from survey import models as survey_models
+
+
+class TelegramBotModel(core_models.CoreModel):
+    class Meta:
+        abstract = True
+
+
+class ChatState(TelegramBotModel):
+    """Вопрос, ответ на который ожидается от пользователя в чате."""
+
+    chat_id = models.BigIntegerField(primary_key = True)
+    user = models.ForeignKey(core_models.User, models.CASCADE)
+    quiz = models.ForeignKey(survey_models.Quiz, models.CASCADE)
+    attempt = models.ForeignKey(survey_models.QuizAttempt, models.CASCADE)
+    question_index = models.PositiveIntegerField()
+    question_message_id = models.BigIntegerField()
@@ -0,0 +1,258 @@
+import enum
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+import telebot
+import telebot.asyncio_helper
+
+import logger
+from core import metrics
+from telegram_bot import settings
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # до этого момента Telegram просил не отправлять сообщения (retry_after)
+        self.blocked_until = 0.0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait(self, now: float) -> float:
+        self.refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0
+
+    def is_idle(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class OutboundScheduler:
+    """Отправляет сообщения с учетом ограничений Telegram на частоту отправки.
+
+    Общий и поканальные (по чатам) token bucket не дают превысить лимиты, интерактивные ответы обгоняют массовые
+    рассылки, а ответы 429 откладывают отправку на retry_after секунд вместо ошибки. В каждый чат одновременно
+    отправляется только одна задача, поэтому сообщения чата приходят в порядке отправки, даже после повтора.
+    """
+
+    class Priority(enum.IntEnum):
+        INTERACTIVE = 0
+        BULK = 1
+
+    class Item:
+        def __init__(
+                self,
+                priority: "OutboundScheduler.Priority",
+                sequence: int,
+                chat_id: int | str,
+                function: Callable,
+                args: tuple,
+                kwargs: dict
+        ) -> None:
+            self.priority = priority
+            self.sequence = sequence
+            self.chat_id = chat_id
+            self.function = function
+            self.args = args
+            self.kwargs = kwargs
+            self.future = Future()
+            self.not_before = 0.0
+            self.attempts = 0
+
+    settings = settings.Settings()
+    # ошибки Telegram синхронного и асинхронного клиентов, ответ 429 которых откладывает отправку
+    API_ERRORS = (telebot.apihelper.ApiTelegramException, telebot.asyncio_helper.ApiTelegramException)
+    # период (в секундах) удаления корзин чатов, в которые давно ничего не отправлялось
+    PRUNE_PERIOD = 60
+
+    def __init__(self) -> None:
+        self.logger = logger.Logger(self.__class__.__name__)
+        self.global_bucket = TokenBucket(self.settings.TELEGRAM_GLOBAL_RATE, self.settings.TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets: dict[int | str, TokenBucket] = {}
+        self.sequence = itertools.count()
+        # (приоритет, порядковый номер, задача) - задачи, которые можно отправлять
+        self._ready: list[tuple[int, int, OutboundScheduler.Item]] = []
+        # (время, порядковый номер, задача) - задачи, ждущие освобождения лимита чата или retry_after
+        self._delayed: list[tuple[float, int, OutboundScheduler.Item]] = []
+        # {чат: задачи чата в порядке отправки} - в _ready или _delayed находится только первая задача чата,
+        # остальные ждут, пока она не будет выполнена
+        self._chats: dict[int | str, deque[OutboundScheduler.Item]] = {}
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._pruned = time.monotonic()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def get_stats(self) -> dict[str, int]:
+        with self._condition:
+            ready = [x[0] for x in self._ready]
+            return {
+                "interactive_queue": ready.count(self.Priority.INTERACTIVE),
+                "bulk_queue": ready.count(self.Priority.BULK),
+                "delayed_queue": len(self._delayed),
+                # задачи, ждущие выполнения предыдущей задачи своего чата
+                "waiting_queue": sum(len(x) - 1 for x in self._chats.values()),
+                "chat_buckets": len(self.chat_buckets),
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed
+            }
+
+    def submit(
+            self,
+            chat_id: int | str,
+            function: Callable,
+            *args,
+            priority: Priority = Priority.BULK,
+            **kwargs
+    ) -> Future:
+        item = self.Item(priority, next(self.sequence), chat_id, function, args, kwargs)
+        if not self.running:
+            self.execute(item)
+        else:
+            with self._condition:
+                chat_items = self._chats.setdefault(chat_id, deque())
+                chat_items.append(item)
+                if len(chat_items) == 1:
+                    heapq.heappush(self._ready, (item.priority, item.sequence, item))
+                    self._condition.notify()
+        return item.future
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(self.settings.OUTBOUND_SENDERS, self.__class__.__name__)
+        self._thread = threading.Thread(target = self.work, name = self.__class__.__name__, daemon = True)
+        self._thread.start()
+        metrics.COMPONENT_STATS.add_source("outbound_scheduler", self.get_stats)
+
+    def stop(self) -> None:
+        metrics.COMPONENT_STATS.remove_source("outbound_scheduler")
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def get_chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.settings.TELEGRAM_CHAT_RATE, self.settings.TELEGRAM_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def work(self) -> None:
+        while not self._stopped.is_set():
+            with self._condition:
+                item, timeout = self.take()
+                if item is None:
+                    self._condition.wait(timeout)
+                    continue
+            self._executor.submit(self.execute, item)
+
+    def take(self) -> tuple[Item | None, float | None]:
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, item = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (item.priority, item.sequence, item))
+        if now - self._pruned > self.PRUNE_PERIOD:
+            self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.is_idle(now)}
+            self._pruned = now
+
+        next_delayed = self._delayed[0][0] - now if self._delayed else None
+        if not self._ready:
+            return None, next_delayed
+
+        global_wait = self.global_bucket.get_wait(now)
+        if global_wait > 0:
+            return None, global_wait if next_delayed is None else min(global_wait, next_delayed)
+
+        _, _, item = heapq.heappop(self._ready)
+        chat_bucket = self.get_chat_bucket(item.chat_id)
+        chat_wait = chat_bucket.get_wait(now)
+        if chat_wait > 0:
+            # остальные чаты не ждут, пока освободится лимит этого чата
+            item.not_before = now + chat_wait
+            heapq.heappush(self._delayed, (item.not_before, item.sequence, item))
+            return None, 0
+        self.global_bucket.consume()
+        chat_bucket.consume()
+        return item, None
+
+    def execute(self, item: Item) -> None:
+        item.attempts += 1
+        try:
+            result = item.function(*item.args, **item.kwargs)
+        except self.API_ERRORS as error:
+            if error.error_code == 429 and self.running and item.attempts < self.settings.OUTBOUND_MAX_ATTEMPTS:
+                # следующие задачи чата ждут повтора этой задачи
+                self.retry(item, error)
+            else:
+                self.complete(item)
+                item.future.set_exception(error)
+        except Exception as error:
+            self.complete(item)
+            item.future.set_exception(error)
+        else:
+            self.complete(item, True)
+            item.future.set_result(result)
+
+    def complete(self, item: Item, sent: bool = False) -> None:
+        with self._condition:
+            if sent:
+                self.sent += 1
+            else:
+                self.failed += 1
+            chat_items = self._chats.get(item.chat_id)
+            # задачи, выполненные без фонового потока, не попадают в очередь чата
+            if chat_items and chat_items[0] is item:
+                chat_items.popleft()
+                if chat_items:
+                    next_item = chat_items[0]
+                    heapq.heappush(self._ready, (next_item.priority, next_item.sequence, next_item))
+                    self._condition.notify()
+                else:
+                    del self._chats[item.chat_id]
+
+    def retry(self, item: Item, error: Exception) -> None:
+        retry_after = error.result_json.get("parameters", {}).get("retry_after", 1)
+        self.logger.warning(f"Telegram asked to retry after {retry_after} s for chat {item.chat_id}")
+        with self._condition:
+            self.retried += 1
+            item.not_before = time.monotonic() + retry_after
+            self.get_chat_bucket(item.chat_id).block(item.not_before)
+            heapq.heappush(self._delayed, (item.not_before, item.sequence, item))
+            self._condition.notify()
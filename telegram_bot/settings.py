@@ -4,3 +4,48 @@ from telegram_bot.apps import TelegramBotConfig
 
 class Settings(settings.Settings):
     APP_NAME = TelegramBotConfig.name
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        # Каталог опросов
+        # период (в секундах) проверки каталога на изменения
+        self.CATALOG_POLL_PERIOD = 5
+
+        # Кэш пользователей
+        self.USER_CACHE_SIZE = 10000
+        # время жизни (в секундах) записи о зарегистрированном пользователе
+        self.USER_CACHE_TTL = 600
+        # время жизни (в секундах) записи о незарегистрированном пользователе
+        self.USER_CACHE_MISSING_TTL = 30
+
+        # Обработка обновлений
+        # количество потоков обработки обновлений (0 - обработка средствами telebot без сохранения порядка в чате)
+        self.UPDATE_WORKERS = 8
+        # писать в DEBUG-лог SQL-запросы каждого обновления
+        # (только Bot: у AsyncBot запросы выполняются в других потоках)
+        self.LOG_UPDATE_QUERIES = False
+
+        # Запросы к Telegram
+        # максимальное количество одновременно открытых соединений с Bot API
+        self.TELEGRAM_API_POOL_SIZE = self.UPDATE_WORKERS + 4
+
+        # Ограничения Telegram на отправку сообщений
+        # сообщений в секунду на всех пользователей
+        self.TELEGRAM_GLOBAL_RATE = 30
+        # сообщений в секунду в один чат
+        self.TELEGRAM_CHAT_RATE = 1
+        # сообщений, которые можно отправить в чат подряд без ожидания
+        self.TELEGRAM_CHAT_BURST = 3
+        # потоков, отправляющих сообщения
+        self.OUTBOUND_SENDERS = self.UPDATE_WORKERS
+        # попыток отправки одного сообщения при ответах 429
+        self.OUTBOUND_MAX_ATTEMPTS = 5
+
+        # Состояния диалогов
+        # хранилище: "memory" - в памяти процесса, "database" - в таблице БД, "redis" - в Redis,
+        # "fake_redis" - в имитации Redis в памяти процесса
+        self.STATE_STORE = "database"
+        self.REDIS_URL = "redis://localhost:6379/0"
+        # время жизни (в секундах) состояния в памяти процесса и в Redis
+        self.STATE_TTL = 60 * 60 * 24
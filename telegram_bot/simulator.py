@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+from typing import NamedTuple
+
+from django.db import models as django_models
+
+import logger
+from core import models as core_models
+from core.database import QueryCounter
+from survey import models as survey_models
+from survey.statistics import Statistics
+from telegram_bot.bot import Bot, CATALOG
+from telegram_bot.fake_telegram import FakeTelegramServer
+
+
+class SimulationResult(NamedTuple):
+    updates: int
+    failed_users: int
+    elapsed: float
+    # время (в секундах) от отправки обновления до последнего ответа бота на него
+    latencies: list[float]
+    queries: int
+
+    @property
+    def updates_per_second(self) -> float:
+        return self.updates / self.elapsed if self.elapsed else 0
+
+    @property
+    def queries_per_update(self) -> float:
+        return self.queries / self.updates if self.updates else 0
+
+    def get_latency(self, quantile: float) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)] if latencies else 0
+
+
+class Simulator:
+    """Проводит виртуальных пользователей через опросы, общаясь с ботом через FakeTelegramServer.
+
+    Каждый пользователь регистрируется, выбирает опрос и отвечает на все вопросы: нажимает случайную кнопку или
+    отправляет текст. Следующее обновление отправляется только после всех ответов бота на предыдущее.
+    """
+
+    # сообщений бота в ответ на выбор опроса: название опроса и первый вопрос (или завершение опроса)
+    QUIZ_REPLIES = 2
+    TOKEN = "123456:simulator"
+
+    def __init__(
+            self,
+            users: int,
+            first_user_id: int = 9_000_000_000,
+            timeout: float = 10,
+            rate_limits: bool = False,
+            seed: int = 0
+    ) -> None:
+        self.logger = logger.Logger(self.__class__.__name__)
+        self.user_ids = range(first_user_id, first_user_id + users)
+        self.timeout = timeout
+        self.rate_limits = rate_limits
+        self.seed = seed
+        self.server = FakeTelegramServer()
+        self.question_counts: dict[str, int] = {}
+        self.latencies: list[float] = []
+        self.failed_users = 0
+        self._lock = threading.Lock()
+
+    def run(self) -> SimulationResult:
+        self.question_counts = dict(
+            survey_models.Quiz.objects.annotate(questions = django_models.Count("question")).values_list(
+                "name",
+                "questions"
+            )
+        )
+        self.server.start()
+        counter = QueryCounter()
+        polling: threading.Thread | None = None
+        bot: Bot | None = None
+        try:
+            bot = Bot(self.TOKEN)
+            counter.start()
+            bot.start_workers()
+            if not self.rate_limits:
+                # без планировщика сообщения отправляются сразу из потока обработчика
+                bot.scheduler.stop()
+            polling = threading.Thread(
+                target = bot.polling,
+                kwargs = {"non_stop": True, "timeout": self.timeout, "long_polling_timeout": 1},
+                name = "polling",
+                daemon = True
+            )
+            polling.start()
+
+            users = [threading.Thread(target = self.simulate_user, args = (x,)) for x in self.user_ids]
+            start = time.perf_counter()
+            for user in users:
+                user.start()
+            for user in users:
+                user.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            # API_URL и потоки бота восстанавливаются и при ошибке, чтобы не мешать остальному процессу
+            if polling is not None:
+                bot.stop_polling()
+                polling.join()
+            if bot is not None:
+                # буфер ответов записывается при остановке, эти запросы тоже учитываются
+                bot.stop_workers()
+            CATALOG.stop()
+            counter.stop()
+            self.server.stop()
+        return SimulationResult(len(self.latencies), self.failed_users, elapsed, self.latencies, counter.count)
+
+    def send(self, user_id: int, update: dict, replies: int) -> dict:
+        """Отправляет обновление боту, ждет replies новых сообщений и возвращает последнее из них."""
+
+        expected = len(self.server.messages.get(user_id, [])) + replies
+        start = time.perf_counter()
+        self.server.put(update)
+        messages = self.server.wait_messages(user_id, expected, self.timeout)
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.latencies.append(latency)
+        return messages[expected - 1]
+
+    def simulate_user(self, user_id: int) -> None:
+        rng = random.Random(self.seed + user_id)
+        try:
+            self.send(user_id, self.server.message(user_id, "/start"), 1)
+            message = self.send(user_id, self.server.message(user_id, "/quiz"), 1)
+            button = rng.choice(message["reply_markup"]["inline_keyboard"])[0]
+            message = self.send(
+                user_id,
+                self.server.callback_query(user_id, button["callback_data"], message["message_id"]),
+                self.QUIZ_REPLIES
+            )
+            for _ in range(self.question_counts.get(button["text"], 0)):
+                if "reply_markup" in message:
+                    answer = rng.choice(message["reply_markup"]["inline_keyboard"])[0]
+                    update = self.server.callback_query(user_id, answer["callback_data"], message["message_id"])
+                else:
+                    update = self.server.message(user_id, f"Ответ пользователя {user_id}")
+                message = self.send(user_id, update, 1)
+        except (TimeoutError, KeyError, IndexError) as error:
+            self.logger.warning(f"User {user_id} failed: {error!r}")
+            with self._lock:
+                self.failed_users += 1
+
+    def cleanup(self) -> None:
+        # попытки и ответы удаляются вместе с пользователями, счетчики статистики пересчитываются
+        core_models.User.objects.filter(telegram_user_id__in = self.user_ids).delete()
+        Statistics.rebuild()
@@ -0,0 +1,194 @@
+import abc
+import threading
+import time
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+
+from core import metrics
+from telegram_bot import models as telegram_bot_models, settings
+
+
+class ChatState(NamedTuple):
+    user_id: int
+    quiz_id: int
+    attempt_id: int
+    question_index: int
+    question_message_id: int
+
+
+class StateStore(abc.ABC):
+    """Хранилище состояний диалогов: какой вопрос какого опроса ждет ответа в чате."""
+
+    settings = settings.Settings()
+
+    @abc.abstractmethod
+    def get(self, chat_id: int) -> ChatState | None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def set(self, chat_id: int, state: ChatState) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete(self, chat_id: int) -> None:
+        raise NotImplementedError()
+
+    async def aget(self, chat_id: int) -> ChatState | None:
+        return await sync_to_async(self.get)(chat_id)
+
+    async def aset(self, chat_id: int, state: ChatState) -> None:
+        await sync_to_async(self.set)(chat_id, state)
+
+    async def adelete(self, chat_id: int) -> None:
+        await sync_to_async(self.delete)(chat_id)
+
+
+class MemoryStateStore(StateStore):
+    """Состояния в памяти процесса: самый быстрый вариант, но только для одного процесса бота."""
+
+    def __init__(self) -> None:
+        # {chat_id: (состояние, момент истечения)}
+        self._states: dict[int, tuple[ChatState, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: int) -> ChatState | None:
+        value = self._states.get(chat_id)
+        if value is None:
+            return None
+        state, expires = value
+        if time.monotonic() >= expires:
+            with self._lock:
+                # состояние могло быть перезаписано, пока блокировка была свободна
+                if self._states.get(chat_id) is value:
+                    del self._states[chat_id]
+            return None
+        return state
+
+    def set(self, chat_id: int, state: ChatState) -> None:
+        with self._lock:
+            self._states[chat_id] = (state, time.monotonic() + self.settings.STATE_TTL)
+
+    def delete(self, chat_id: int) -> None:
+        with self._lock:
+            self._states.pop(chat_id, None)
+
+    async def aget(self, chat_id: int) -> ChatState | None:
+        return self.get(chat_id)
+
+    async def aset(self, chat_id: int, state: ChatState) -> None:
+        self.set(chat_id, state)
+
+    async def adelete(self, chat_id: int) -> None:
+        self.delete(chat_id)
+
+
+class DatabaseStateStore(StateStore):
+    """Состояния в таблице БД, общей для всех процессов бота."""
+
+    model = telegram_bot_models.ChatState
+
+    def get(self, chat_id: int) -> ChatState | None:
+        values = self.model.objects.filter(chat_id = chat_id).values_list(*ChatState._fields).first()
+        return None if values is None else ChatState(*values)
+
+    @metrics.timed("db_write", "ChatState.set")
+    def set(self, chat_id: int, state: ChatState) -> None:
+        # один запрос INSERT ... ON CONFLICT DO UPDATE вместо SELECT и INSERT/UPDATE
+        self.model.objects.bulk_create(
+            [self.model(chat_id = chat_id, **state._asdict())],
+            update_conflicts = True,
+            unique_fields = ["chat_id"],
+            update_fields = list(ChatState._fields)
+        )
+
+    @metrics.timed("db_write", "ChatState.delete")
+    def delete(self, chat_id: int) -> None:
+        self.model.objects.filter(chat_id = chat_id).delete()
+
+
+class RedisStateStore(StateStore):
+    """Состояния в Redis (или совместимом хранилище) в виде коротких строк с временем жизни."""
+
+    DELIMITER = ":"
+
+    def __init__(self, client = None) -> None:
+        if client is None:
+            # redis - необязательная зависимость, нужна только для этого хранилища
+            import redis
+
+            client = redis.Redis.from_url(self.settings.REDIS_URL)
+        self.client = client
+
+    def get_key(self, chat_id: int) -> str:
+        return f"{self.settings.APP_NAME}{self.DELIMITER}state{self.DELIMITER}{chat_id}"
+
+    def get(self, chat_id: int) -> ChatState | None:
+        value = self.client.get(self.get_key(chat_id))
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+        return ChatState(*(int(x) for x in value.split(self.DELIMITER)))
+
+    def set(self, chat_id: int, state: ChatState) -> None:
+        self.client.set(
+            self.get_key(chat_id),
+            self.DELIMITER.join(str(x) for x in state),
+            ex = self.settings.STATE_TTL
+        )
+
+    def delete(self, chat_id: int) -> None:
+        self.client.delete(self.get_key(chat_id))
+
+
+class FakeRedis:
+    """Минимальная замена клиента Redis в памяти процесса для локального запуска и тестов."""
+
+    def __init__(self) -> None:
+        # {ключ: (значение, момент истечения или None для ключа без времени жизни)}
+        self._values: dict[str, tuple[bytes, float | None]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, key: str, value: str | bytes, ex: int = None) -> bool:
+        expires = None if ex is None else time.monotonic() + ex
+        with self._lock:
+            self._values[key] = (value.encode() if isinstance(value, str) else value, expires)
+        return True
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            return self.get_value(key)
+
+    def delete(self, *keys: str) -> int:
+        deleted = 0
+        with self._lock:
+            for key in keys:
+                # истекшие ключи, как и в Redis, не считаются удаленными
+                if self.get_value(key) is not None:
+                    del self._values[key]
+                    deleted += 1
+        return deleted
+
+    def get_value(self, key: str) -> bytes | None:
+        value = self._values.get(key)
+        if value is None:
+            return None
+        data, expires = value
+        if expires is not None and time.monotonic() >= expires:
+            del self._values[key]
+            return None
+        return data
+
+
+def get_state_store() -> StateStore:
+    store_name = StateStore.settings.STATE_STORE
+    if store_name == "memory":
+        return MemoryStateStore()
+    if store_name == "database":
+        return DatabaseStateStore()
+    if store_name == "redis":
+        return RedisStateStore()
+    if store_name == "fake_redis":
+        return RedisStateStore(FakeRedis())
+    raise ValueError(f"Unknown state store: {store_name}")
@@ -1,3 +1,812 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import functools
+import json
+import random
+import struct
+import threading
+import time
+from typing import Callable
+from unittest import mock
 
-# Create your tests here.
+import telebot
+from asgiref.sync import sync_to_async
+from telebot.async_telebot import AsyncTeleBot
+from django.db.models import signals
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core import metrics, models as core_models
+from survey import models as survey_models
+from survey.answer_sink import AnswerSink
+from secret_keeper import SecretKeeper
+from survey.statistics import Statistics
+from telegram_bot import views
+from telegram_bot.async_bot import AsyncBot
+from telegram_bot.bot import Bot, CATALOG
+from telegram_bot.callback_data import CallbackData, CallbackPayload, CallbackType
+from telegram_bot.catalog import Catalog, CatalogKeeper
+from telegram_bot.dispatcher import ChatDispatcher
+from telegram_bot.fake_telegram import FakeTelegramSender, FakeTelegramServer, FakeUpdates
+from telegram_bot.scheduler import OutboundScheduler
+from telegram_bot.simulator import Simulator
+from telegram_bot.state import (
+    ChatState,
+    DatabaseStateStore,
+    FakeRedis,
+    MemoryStateStore,
+    RedisStateStore,
+    StateStore,
+    get_state_store
+)
+from telegram_bot.user_cache import UserCache
+
+
+class CatalogKeeperTests(TestCase):
+    def setUp(self) -> None:
+        self.keeper = CatalogKeeper()
+        self.addCleanup(self.disconnect)
+        self.quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        question = survey_models.Question.objects.create(quiz = self.quiz, text = "Вопрос")
+        survey_models.PreparedAnswer.objects.create(question = question, text = "Да")
+
+    def disconnect(self) -> None:
+        for model in Catalog.MODELS:
+            signals.post_save.disconnect(self.keeper.invalidate, model)
+            signals.post_delete.disconnect(self.keeper.invalidate, model)
+
+    def test_snapshot_is_invalidated_on_save_and_delete(self) -> None:
+        catalog = self.keeper.catalog
+        with self.assertNumQueries(0):
+            self.assertIs(self.keeper.catalog, catalog)
+
+        quiz = survey_models.Quiz.objects.create(name = "Новый опрос")
+        self.assertIsNone(self.keeper.snapshot)
+        self.assertIn(quiz.id, self.keeper.catalog.QUIZZES_BY_ID)
+
+        quiz.delete()
+        self.assertIsNone(self.keeper.snapshot)
+        self.assertNotIn(quiz.id, self.keeper.catalog.QUIZZES_BY_ID)
+
+    def test_running_keeper_is_notified(self) -> None:
+        with mock.patch.object(CatalogKeeper, "running", new_callable = mock.PropertyMock, return_value = True):
+            catalog = self.keeper.catalog
+            self.quiz.save()
+        # снимок пересоберет фоновый поток, а до тех пор обработчики читают старый
+        self.assertIs(self.keeper.snapshot, catalog)
+        self.assertTrue(self.keeper._changed.is_set())
+
+    def test_poll_picks_up_changes_without_signals(self) -> None:
+        catalog = self.keeper.catalog
+        self.assertIs(self.keeper.reload(False), catalog)
+
+        # update не отправляет сигналы, изменение видно только по отпечатку каталога
+        survey_models.Quiz.objects.filter(id = self.quiz.id).update(
+            name = "Переименованный опрос",
+            updated = timezone.now() + datetime.timedelta(seconds = 1)
+        )
+        new_catalog = self.keeper.reload(False)
+
+        self.assertIsNot(new_catalog, catalog)
+        self.assertEqual(new_catalog.version, catalog.version + 1)
+        self.assertNotEqual(new_catalog.stamp, catalog.stamp)
+        self.assertEqual(new_catalog.QUIZZES_BY_ID[self.quiz.id].name, "Переименованный опрос")
+
+    def test_outdated_button_is_rejected(self) -> None:
+        bot = Bot(Simulator.TOKEN)
+        bot.callback_handlers = bot.get_callback_handlers()
+        old_catalog = self.keeper.catalog
+        survey_models.Quiz.objects.create(name = "Новый опрос")
+        catalog = self.keeper.catalog
+
+        callback = mock.Mock(data = CallbackData().quiz(old_catalog.stamp, self.quiz.id))
+        self.assertIsNone(bot.resolve_callback(callback, catalog))
+        callback.data = CallbackData().quiz(catalog.stamp, self.quiz.id)
+        handler, quiz, _ = bot.resolve_callback(callback, catalog)
+        # обработчик обернут измерением времени
+        self.assertEqual((handler.__wrapped__, quiz), (bot.start_quiz, self.quiz))
+
+
+class CallbackDataTests(TestCase):
+    # https://core.telegram.org/bots/api#inlinekeyboardbutton
+    MAX_SIZE = 64
+
+    def setUp(self) -> None:
+        self.callback_data = CallbackData()
+
+    def test_round_trip(self) -> None:
+        payloads = [
+            CallbackPayload(CallbackType.QUIZ, 1, 1, 0),
+            CallbackPayload(CallbackType.PREPARED_ANSWER, 2 ** 16 - 1, 2 ** 64 - 1, 2 ** 16 - 1)
+        ]
+        for payload in payloads:
+            with self.subTest(payload = payload):
+                data = self.callback_data.encode(*payload)
+                self.assertEqual(self.callback_data.decode(data), payload)
+                self.assertLessEqual(len(data.encode()), self.MAX_SIZE)
+                self.assertEqual(len(data), 18)
+
+    def test_helpers(self) -> None:
+        self.assertEqual(
+            self.callback_data.decode(self.callback_data.quiz(3, 10)),
+            CallbackPayload(CallbackType.QUIZ, 3, 10, 0)
+        )
+        self.assertEqual(
+            self.callback_data.decode(self.callback_data.prepared_answer(3, 11, 2)),
+            CallbackPayload(CallbackType.PREPARED_ANSWER, 3, 11, 2)
+        )
+
+    def test_out_of_range_values_are_not_encoded(self) -> None:
+        with self.assertRaises(struct.error):
+            self.callback_data.encode(CallbackType.QUIZ, 2 ** 16, 1)
+        with self.assertRaises(struct.error):
+            self.callback_data.encode(CallbackType.QUIZ, 1, 2 ** 64)
+
+    def test_foreign_data_is_ignored(self) -> None:
+        valid = self.callback_data.quiz(1, 1)
+        # пустые данные, прежний JSON-формат, неизвестный тип, обрезанные данные и не base64
+        for data in (None, "", '{"type": 1, "id": 1}', self.callback_data.encode(3, 1, 1), valid[:-2], "!" * 18):
+            with self.subTest(data = data):
+                self.assertIsNone(self.callback_data.decode(data))
+
+
+class UserCacheTests(TestCase):
+    USER_ID = 42
+
+    def setUp(self) -> None:
+        self.cache = UserCache()
+        self.addCleanup(self.disconnect)
+        self.user = core_models.User.objects.create(telegram_user_id = self.USER_ID, telegram_chat_id = self.USER_ID)
+
+    def disconnect(self) -> None:
+        signals.post_save.disconnect(self.cache.on_user_change, core_models.User)
+        signals.post_delete.disconnect(self.cache.on_user_change, core_models.User)
+
+    def test_user_is_cached(self) -> None:
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get(self.USER_ID), self.user)
+            self.assertEqual(self.cache.get(self.USER_ID), self.user)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_missing_user_is_cached(self) -> None:
+        with self.assertNumQueries(1):
+            for _ in range(2):
+                with self.assertRaises(core_models.User.DoesNotExist):
+                    self.cache.get(self.USER_ID + 1)
+
+    def test_user_is_invalidated_on_change(self) -> None:
+        self.cache.get(self.USER_ID)
+        self.user.telegram_chat_id = 1
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get(self.USER_ID).telegram_chat_id, 1)
+
+        self.user.delete()
+        with self.assertRaises(core_models.User.DoesNotExist):
+            self.cache.get(self.USER_ID)
+
+    def test_registration_invalidates_missing_user(self) -> None:
+        with self.assertRaises(core_models.User.DoesNotExist):
+            self.cache.get(self.USER_ID + 1)
+        core_models.User.objects.create(telegram_user_id = self.USER_ID + 1, telegram_chat_id = self.USER_ID + 1)
+        self.assertEqual(self.cache.get(self.USER_ID + 1).telegram_user_id, self.USER_ID + 1)
+
+    def test_least_recently_used_user_is_evicted(self) -> None:
+        self.cache.max_size = 2
+        other = core_models.User.objects.create(telegram_user_id = self.USER_ID + 1, telegram_chat_id = 1)
+        self.cache.get(self.USER_ID)
+        self.cache.put(other)
+        self.cache.get(self.USER_ID)
+        with self.assertRaises(core_models.User.DoesNotExist):
+            self.cache.get(self.USER_ID + 2)
+
+        self.assertEqual(len(self.cache), 2)
+        with self.assertNumQueries(0):
+            self.cache.get(self.USER_ID)
+        with self.assertNumQueries(1):
+            self.cache.get(self.USER_ID + 1)
+
+    def test_user_expires(self) -> None:
+        self.cache.get(self.USER_ID)
+        with mock.patch("time.monotonic", return_value = time.monotonic() + self.cache.ttl + 1):
+            with self.assertNumQueries(1):
+                self.cache.get(self.USER_ID)
+
+
+class StateStoreTests(TestCase):
+    CHAT_ID = 1
+
+    def setUp(self) -> None:
+        user = core_models.User.objects.create(telegram_user_id = self.CHAT_ID, telegram_chat_id = self.CHAT_ID)
+        quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        self.attempt = survey_models.QuizAttempt.objects.create(user = user, quiz = quiz)
+        self.state = ChatState(user.id, quiz.id, self.attempt.id, 0, 10)
+
+    def check_round_trip(self, store: StateStore) -> None:
+        self.assertIsNone(store.get(self.CHAT_ID))
+        store.set(self.CHAT_ID, self.state)
+        self.assertEqual(store.get(self.CHAT_ID), self.state)
+        # следующий вопрос перезаписывает состояние
+        next_state = self.state._replace(question_index = 1, question_message_id = 11)
+        store.set(self.CHAT_ID, next_state)
+        self.assertEqual(store.get(self.CHAT_ID), next_state)
+        self.assertIsNone(store.get(self.CHAT_ID + 1))
+
+        store.delete(self.CHAT_ID)
+        self.assertIsNone(store.get(self.CHAT_ID))
+        store.delete(self.CHAT_ID)
+
+    def check_expiry(self, store: StateStore) -> None:
+        store.set(self.CHAT_ID, self.state)
+        now = time.monotonic()
+        with mock.patch("time.monotonic", return_value = now + StateStore.settings.STATE_TTL - 1):
+            self.assertEqual(store.get(self.CHAT_ID), self.state)
+        with mock.patch("time.monotonic", return_value = now + StateStore.settings.STATE_TTL + 1):
+            self.assertIsNone(store.get(self.CHAT_ID))
+        self.assertIsNone(store.get(self.CHAT_ID))
+
+    def test_memory_store(self) -> None:
+        self.check_round_trip(MemoryStateStore())
+
+    def test_memory_state_expires(self) -> None:
+        store = MemoryStateStore()
+        self.check_expiry(store)
+        self.assertEqual(store._states, {})
+
+    def test_database_store(self) -> None:
+        self.check_round_trip(DatabaseStateStore())
+
+    def test_database_state_is_deleted_with_attempt(self) -> None:
+        # у состояний в БД нет времени жизни, они удаляются вместе с попыткой при архивации
+        store = DatabaseStateStore()
+        store.set(self.CHAT_ID, self.state)
+        self.attempt.delete()
+        self.assertIsNone(store.get(self.CHAT_ID))
+
+    def test_redis_store(self) -> None:
+        self.check_round_trip(RedisStateStore(FakeRedis()))
+
+    def test_redis_state_expires(self) -> None:
+        client = FakeRedis()
+        self.check_expiry(RedisStateStore(client))
+        self.assertEqual(client._values, {})
+        # ключ без времени жизни не истекает
+        client.set("key", "value")
+        with mock.patch("time.monotonic", return_value = time.monotonic() + StateStore.settings.STATE_TTL + 1):
+            self.assertEqual(client.get("key"), b"value")
+            self.assertEqual(client.delete("key", "missing"), 1)
+
+    def test_store_is_chosen_by_settings(self) -> None:
+        stores = {"memory": MemoryStateStore, "database": DatabaseStateStore, "fake_redis": RedisStateStore}
+        for name, store_class in stores.items():
+            with mock.patch.object(StateStore.settings, "STATE_STORE", name):
+                self.assertIsInstance(get_state_store(), store_class)
+        with mock.patch.object(StateStore.settings, "STATE_STORE", "unknown"):
+            with self.assertRaises(ValueError):
+                get_state_store()
+
+
+class ChatDispatcherTests(TestCase):
+    CHATS = 8
+    UPDATES = 20
+
+    def setUp(self) -> None:
+        self.updates = FakeUpdates()
+        # {chat_id: [(update_id, имя потока)]}
+        self.processed: dict[int, list[tuple[int, str]]] = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(0)
+
+    def handle(self, updates: list[telebot.types.Update]) -> None:
+        update = updates[0]
+        # обработка занимает разное время, поэтому без привязки к потоку порядок бы нарушался
+        time.sleep(self.rng.random() / 1000)
+        with self.lock:
+            self.processed.setdefault(update.message.chat.id, []).append(
+                (update.update_id, threading.current_thread().name)
+            )
+        if update.message.text == "error":
+            raise ValueError(update.update_id)
+
+    def test_chat_updates_are_ordered(self) -> None:
+        dispatcher = ChatDispatcher(self.handle, 4)
+        sent: dict[int, list[int]] = {}
+        for number in range(self.UPDATES):
+            for chat_id in range(1, self.CHATS + 1):
+                update = self.updates.message(chat_id, "error" if number == 0 else str(number))
+                sent.setdefault(chat_id, []).append(update["update_id"])
+                dispatcher.put(telebot.types.Update.de_json(update))
+        with self.assertLogs(dispatcher.logger.logger, "ERROR"):
+            dispatcher.start()
+            dispatcher.stop()
+
+        self.assertEqual(dispatcher.queue_size, 0)
+        for chat_id, updates in sent.items():
+            # ошибка первого обновления не останавливает обработку остальных
+            self.assertEqual([x[0] for x in self.processed[chat_id]], updates)
+            self.assertEqual(len({x[1] for x in self.processed[chat_id]}), 1)
+
+    def test_stats_are_exported(self) -> None:
+        dispatcher = ChatDispatcher(self.handle, 2)
+        dispatcher.start()
+        self.assertIn('component="update_dispatcher",name="queue_size"', metrics.REGISTRY.render())
+        dispatcher.stop()
+        self.assertNotIn('component="update_dispatcher"', metrics.REGISTRY.render())
+
+
+class OutboundSchedulerTests(TestCase):
+    CHAT_ID = 1
+    MESSAGES = 5
+
+    def setUp(self) -> None:
+        # лимит чата не должен замедлять тест
+        patch = mock.patch.object(OutboundScheduler.settings, "TELEGRAM_CHAT_RATE", 1000)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.scheduler = OutboundScheduler()
+        self.scheduler.start()
+        self.addCleanup(self.scheduler.stop)
+        self.sent: list[int] = []
+        # номера сообщений, на первую отправку которых Telegram ответит 429
+        self.limited = {0}
+        self.lock = threading.Lock()
+
+    def send(self, number: int) -> int:
+        with self.lock:
+            if number in self.limited:
+                self.limited.remove(number)
+                raise telebot.apihelper.ApiTelegramException(
+                    "sendMessage",
+                    None,
+                    {"error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 0.05}}
+                )
+        # более ранние сообщения отправляются дольше более поздних
+        time.sleep((self.MESSAGES - number) / 1000)
+        with self.lock:
+            self.sent.append(number)
+        return number
+
+    def test_chat_messages_are_ordered(self) -> None:
+        futures = [self.scheduler.submit(self.CHAT_ID, self.send, x) for x in range(self.MESSAGES)]
+
+        self.assertEqual([x.result(5) for x in futures], list(range(self.MESSAGES)))
+        # повтор первого сообщения не пропускает вперед следующие сообщения чата
+        self.assertEqual(self.sent, list(range(self.MESSAGES)))
+        stats = self.scheduler.get_stats()
+        self.assertEqual((stats["sent"], stats["retried"], stats["failed"]), (self.MESSAGES, 1, 0))
+        self.assertEqual(stats["waiting_queue"], 0)
+
+    def test_stats_are_exported(self) -> None:
+        self.scheduler.submit(self.CHAT_ID, self.send, 1).result(5)
+
+        self.assertIn(
+            'teleeng_component_stats{component="outbound_scheduler",name="sent"} 1',
+            metrics.REGISTRY.render()
+        )
+
+
+class WebhookTests(TestCase):
+    SECRET_TOKEN = "secret"
+
+    def setUp(self) -> None:
+        self.url = reverse("telegram_bot:webhook")
+        self.sender = FakeTelegramSender(self.url, self.SECRET_TOKEN)
+        self.bot = mock.Mock()
+
+        patches = [
+            mock.patch.object(
+                Bot.settings.secrets.telegram_bot,
+                "webhook_secret_token",
+                self.SECRET_TOKEN,
+                create = True
+            ),
+            mock.patch.object(views, "get_bot", return_value = self.bot)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def post(self, update: dict, headers: dict[str, str]):
+        return self.client.post(self.url, json.dumps(update), content_type = "application/json", headers = headers)
+
+    def test_update_is_enqueued(self) -> None:
+        response = self.post(self.sender.message(1, "/start"), self.sender.get_headers())
+
+        self.assertEqual(response.status_code, 200)
+        self.bot.process_new_updates.assert_called_once()
+        update = self.bot.process_new_updates.call_args.args[0][0]
+        self.assertEqual(update.message.text, "/start")
+
+    def test_callback_query_is_enqueued(self) -> None:
+        response = self.post(self.sender.callback_query(1, "AQAAAAAAAAAAAQAA", 10), self.sender.get_headers())
+
+        self.assertEqual(response.status_code, 200)
+        update = self.bot.process_new_updates.call_args.args[0][0]
+        self.assertEqual(update.callback_query.data, "AQAAAAAAAAAAAQAA")
+
+    def test_wrong_secret_token(self) -> None:
+        headers = {views.SECRET_TOKEN_HEADER: "wrong"}
+        response = self.post(self.sender.message(1, "/start"), headers)
+
+        self.assertEqual(response.status_code, 403)
+        self.bot.process_new_updates.assert_not_called()
+
+    def test_empty_secret_token(self) -> None:
+        headers = {views.SECRET_TOKEN_HEADER: ""}
+        with mock.patch.object(Bot.settings.secrets.telegram_bot, "webhook_secret_token", ""):
+            response = self.post(self.sender.message(1, "/start"), headers)
+
+        self.assertEqual(response.status_code, 403)
+        self.bot.process_new_updates.assert_not_called()
+
+    def test_missing_secret_token(self) -> None:
+        # модуль секретов без webhook_secret_token
+        with mock.patch.object(Bot.settings.secrets, "telegram_bot", SecretKeeper.TelegramBot()):
+            response = self.post(self.sender.message(1, "/start"), self.sender.get_headers())
+
+        self.assertEqual(response.status_code, 403)
+        self.bot.process_new_updates.assert_not_called()
+
+    def test_malformed_update(self) -> None:
+        response = self.client.post(
+            self.url,
+            "{",
+            content_type = "application/json",
+            headers = self.sender.get_headers()
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.bot.process_new_updates.assert_not_called()
+
+
+class HandlerQueryBudgetTests(TestCase):
+    """Обработчики Bot не выходят за заявленное количество запросов к БД на одно обновление.
+
+    Ответы, как и в работающем боте, копятся в буфере AnswerSink, savepoint вложенных транзакций тоже считаются.
+    """
+
+    USER_ID = 42
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.server = FakeTelegramServer()
+        cls.server.start()
+        cls.bot = Bot(Simulator.TOKEN)
+        cls.bot.register_handlers()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        question = survey_models.Question.objects.create(quiz = quiz, text = "Вопрос с вариантами")
+        for text in ("Да", "Нет"):
+            survey_models.PreparedAnswer.objects.create(question = question, text = text)
+        for number in range(2):
+            survey_models.Question.objects.create(quiz = quiz, text = f"Текстовый вопрос {number + 1}")
+        # строки счетчиков уже существуют, как у опросов, которые проходили раньше
+        Statistics.rebuild()
+
+    def setUp(self) -> None:
+        CATALOG.reload()
+        self.bot.users.clear()
+        self.server.messages.clear()
+        # буфер ответов работает без фонового потока, ответы из него не записываются
+        patch = mock.patch.object(AnswerSink, "running", new_callable = mock.PropertyMock, return_value = True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self.bot.answers._buffer.clear)
+
+    def process(self, update: dict, budget: int) -> None:
+        with self.assertNumQueries(budget):
+            telebot.TeleBot.process_new_updates(self.bot, [telebot.types.Update.de_json(update)])
+
+    def get_last_message(self) -> dict:
+        return self.server.messages[self.USER_ID][-1]
+
+    def press_button(self, row: int, budget: int) -> None:
+        message = self.get_last_message()
+        data = message["reply_markup"]["inline_keyboard"][row][0]["callback_data"]
+        self.process(self.server.callback_query(self.USER_ID, data, message["message_id"]), budget)
+
+    def register(self) -> None:
+        core_models.User.objects.create(telegram_user_id = self.USER_ID, telegram_chat_id = self.USER_ID)
+
+    def start_quiz(self) -> None:
+        self.register()
+        self.process(self.server.message(self.USER_ID, "/quiz"), 1)
+        self.press_button(0, 5)
+
+    def test_start_new_user(self) -> None:
+        # поиск пользователя, savepoint, INSERT с временным username, UPDATE на user_<id> и release
+        self.process(self.server.message(self.USER_ID, "/start"), 5)
+        # пользователь уже в кэше
+        self.process(self.server.message(self.USER_ID, "/start"), 0)
+
+    def test_get_chat_id(self) -> None:
+        self.process(self.server.message(self.USER_ID, "/get_chat_id"), 0)
+
+    def test_quiz(self) -> None:
+        self.register()
+        # каталог в памяти, запрос нужен только для пользователя, которого нет в кэше
+        self.process(self.server.message(self.USER_ID, "/quiz"), 1)
+        self.process(self.server.message(self.USER_ID, "/quiz"), 0)
+
+    def test_start_quiz(self) -> None:
+        self.register()
+        self.process(self.server.message(self.USER_ID, "/quiz"), 1)
+        # savepoint, попытка, счетчик начатых попыток, release и состояние чата
+        self.press_button(0, 5)
+
+    def test_callback_is_timed_once(self) -> None:
+        metrics.DURATION._values.clear()
+        self.start_quiz()
+        self.press_button(0, 2)
+        # кнопка измеряется один раз, обработчиком, который выбрал process_callback
+        counts = {key: value[2] for key, value in metrics.DURATION.get_snapshot().items()}
+        self.assertEqual(
+            {key[1]: value for key, value in counts.items() if key[0] == "handler"},
+            {"quiz": 1, "start_quiz": 1, "retrieve_prepared_answer": 1}
+        )
+        self.assertEqual(counts[("step", "ask_question")], 2)
+
+    def test_prepared_answer(self) -> None:
+        self.start_quiz()
+        # чтение и запись состояния, ответ - в буфере
+        self.press_button(0, 2)
+        self.assertEqual(len(self.bot.answers), 1)
+
+    def test_repeated_prepared_answer(self) -> None:
+        self.start_quiz()
+        message = self.get_last_message()
+        self.press_button(0, 2)
+        data = message["reply_markup"]["inline_keyboard"][1][0]["callback_data"]
+        # вопрос уже не ожидает ответа
+        self.process(self.server.callback_query(self.USER_ID, data, message["message_id"]), 1)
+        self.assertEqual(len(self.bot.answers), 1)
+
+    def test_text_answer(self) -> None:
+        self.start_quiz()
+        self.press_button(0, 2)
+        # чтение и перезапись состояния следующим вопросом
+        self.process(self.server.message(self.USER_ID, "Ответ"), 2)
+        # последний вопрос: чтение и удаление состояния, savepoint, завершение попытки, счетчик и release
+        self.process(self.server.message(self.USER_ID, "Ответ"), 6)
+        self.assertEqual(len(self.bot.answers), 3)
+
+    def test_text_without_quiz(self) -> None:
+        self.process(self.server.message(self.USER_ID, "Ответ"), 1)
+
+    def test_outdated_button(self) -> None:
+        self.start_quiz()
+        message = self.get_last_message()
+        data = message["reply_markup"]["inline_keyboard"][0][0]["callback_data"]
+        survey_models.Quiz.objects.create(name = "Новый опрос")
+        CATALOG.reload()
+        # удаление состояния
+        self.process(self.server.callback_query(self.USER_ID, data, message["message_id"]), 1)
+
+    def test_update_queries_are_logged(self) -> None:
+        self.register()
+        with mock.patch.object(self.bot.settings, "LOG_UPDATE_QUERIES", True):
+            handler = self.bot.wrap_handler(self.bot.quiz)
+        update = telebot.types.Update.de_json(self.server.message(self.USER_ID, "/quiz"))
+        with self.assertLogs(self.bot.logger.logger, "DEBUG") as logs:
+            handler(update.message)
+        self.assertIn("quiz: 1 queries", logs.output[0])
+        self.assertIn("core_user", logs.output[0])
+
+
+def closing_session(test: Callable) -> Callable:
+    # сессия aiohttp привязана к циклу событий теста и должна закрыться до его завершения
+    @functools.wraps(test)
+    async def wrapper(self, *args, **kwargs) -> None:
+        try:
+            await test(self, *args, **kwargs)
+        finally:
+            if telebot.asyncio_helper.session_manager.session is not None:
+                await self.bot.close_session()
+
+    return wrapper
+
+
+class AsyncBotTests(TestCase):
+    USER_ID = 42
+
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.bot = AsyncBot(Simulator.TOKEN)
+        self.bot.register_handlers()
+        self.bot.users.clear()
+
+        quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        question = survey_models.Question.objects.create(quiz = quiz, text = "Вопрос с вариантами")
+        for text in ("Да", "Нет"):
+            survey_models.PreparedAnswer.objects.create(question = question, text = text)
+        survey_models.Question.objects.create(quiz = quiz, text = "Текстовый вопрос")
+        CATALOG.reload()
+
+    async def process(self, update: dict, replies: int) -> dict:
+        expected = len(self.server.messages.get(self.USER_ID, [])) + replies
+        await self.bot.process_new_updates([telebot.types.Update.de_json(update)])
+        return self.server.messages[self.USER_ID][expected - 1]
+
+    async def press_button(self, message: dict, row: int, replies: int) -> dict:
+        data = message["reply_markup"]["inline_keyboard"][row][0]["callback_data"]
+        return await self.process(self.server.callback_query(self.USER_ID, data, message["message_id"]), replies)
+
+    @closing_session
+    async def test_quiz_flow(self) -> None:
+        await self.process(self.server.message(self.USER_ID, "/start"), 1)
+        message = await self.process(self.server.message(self.USER_ID, "/quiz"), 1)
+        # название опроса и первый вопрос
+        message = await self.press_button(message, 0, 2)
+        self.assertIn("Вопрос с вариантами", message["text"])
+        message = await self.press_button(message, 1, 1)
+        self.assertIn("Текстовый вопрос", message["text"])
+        message = await self.process(self.server.message(self.USER_ID, "Ответ"), 1)
+        self.assertIn("Спасибо", message["text"])
+
+        answers = await sync_to_async(list)(
+            survey_models.Answer.objects.order_by("id").values_list("prepared_answer__text", "message_id")
+        )
+        self.assertEqual([x[0] for x in answers], ["Нет", None])
+        self.assertIsNotNone(answers[1][1])
+        self.assertTrue(await survey_models.QuizAttempt.objects.exclude(finished = None).aexists())
+
+    @closing_session
+    async def test_outbound_requests_are_scheduled(self) -> None:
+        self.bot.scheduler.start()
+        try:
+            await self.process(self.server.message(self.USER_ID, "/start"), 1)
+            message = await self.process(self.server.message(self.USER_ID, "/quiz"), 1)
+            await self.press_button(message, 0, 2)
+        finally:
+            await sync_to_async(self.bot.scheduler.stop, thread_sensitive = False)()
+
+        # два ответа, удаление сообщения с опросами, название опроса и первый вопрос
+        self.assertEqual(self.bot.scheduler.get_stats()["sent"], 5)
+        self.assertEqual(self.bot.scheduler.get_stats()["failed"], 0)
+
+    @closing_session
+    async def test_catalog_snapshot_is_used(self) -> None:
+        await self.process(self.server.message(self.USER_ID, "/start"), 1)
+        # снимок уже загружен, поэтому обращения к БД через CatalogKeeper.load нет
+        with mock.patch.object(CATALOG, "load", side_effect = AssertionError):
+            await self.process(self.server.message(self.USER_ID, "/quiz"), 1)
+
+        CATALOG.invalidate()
+        self.assertIsNone(CATALOG.snapshot)
+        message = await self.process(self.server.message(self.USER_ID, "/quiz"), 1)
+        self.assertIsNotNone(CATALOG.snapshot)
+        self.assertEqual(len(message["reply_markup"]["inline_keyboard"]), 1)
+
+    @closing_session
+    async def test_chat_updates_are_ordered(self) -> None:
+        processed = []
+
+        # noinspection PyUnusedLocal
+        async def process_new_updates(bot, updates: list[telebot.types.Update]) -> None:
+            message = updates[0].message
+            if message.text == "slow":
+                await asyncio.sleep(0.05)
+            processed.append((message.chat.id, message.text))
+
+        updates = [
+            self.server.message(1, "slow"),
+            self.server.message(1, "fast"),
+            self.server.message(2, "fast")
+        ]
+        with mock.patch.object(AsyncTeleBot, "process_new_updates", process_new_updates):
+            await self.bot.process_new_updates([telebot.types.Update.de_json(x) for x in updates])
+
+        # чаты обрабатываются параллельно, а обновления одного чата - по порядку
+        self.assertEqual(processed, [(2, "fast"), (1, "slow"), (1, "fast")])
+        self.assertEqual(self.bot._chat_tasks, {})
+
+    @closing_session
+    async def test_polling_shutdown(self) -> None:
+        self.addCleanup(CATALOG.stop)
+        polling = asyncio.create_task(self.bot.start_polling())
+        # getUpdates вызывается после запуска фоновых потоков
+        while not self.bot.answers.running:
+            await asyncio.sleep(0.01)
+        self.assertIn('component="user_cache"', metrics.REGISTRY.render())
+
+        # AsyncTeleBot останавливается отменой задачи polling
+        polling.cancel()
+        await asyncio.wait_for(asyncio.gather(polling, return_exceptions = True), 5)
+
+        self.assertFalse(self.bot.answers.running)
+        self.assertFalse(self.bot.scheduler.running)
+        self.assertNotIn('component="user_cache"', metrics.REGISTRY.render())
+
+
+class FakeTelegramServerTests(TestCase):
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.bot = telebot.TeleBot(Simulator.TOKEN, threaded = False)
+
+    def test_updates_are_confirmed_by_offset(self) -> None:
+        self.server.put(self.server.message(1, "/start"))
+        self.server.put(self.server.message(1, "text"))
+
+        updates = self.bot.get_updates(long_polling_timeout = 1)
+        self.assertEqual([x.message.text for x in updates], ["/start", "text"])
+        self.assertEqual(self.server.get_updates({"offset": updates[-1].update_id + 1}), [])
+
+    def test_sent_messages_are_recorded(self) -> None:
+        markup = telebot.types.InlineKeyboardMarkup([[telebot.types.InlineKeyboardButton("1", callback_data = "a")]])
+        message = self.bot.send_message(1, "text", reply_markup = markup)
+
+        messages = self.server.wait_messages(1, 1, 1)
+        self.assertEqual(messages[0]["message_id"], message.message_id)
+        self.assertEqual(messages[0]["reply_markup"]["inline_keyboard"][0][0]["callback_data"], "a")
+        with self.assertRaises(TimeoutError):
+            self.server.wait_messages(1, 2, 0.1)
+
+
+class SendMessageTests(TestCase):
+    CHAT_ID = 1
+
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.bot = Bot(Simulator.TOKEN)
+
+    def test_long_message_is_sent_in_chunks(self) -> None:
+        lines = [f"Строка {number} " + "а" * 100 for number in range(100)]
+        markup = telebot.types.InlineKeyboardMarkup([[telebot.types.InlineKeyboardButton("1", callback_data = "a")]])
+        message = self.bot.send_message(self.CHAT_ID, lines, reply_markup = markup)
+
+        messages = self.server.messages[self.CHAT_ID]
+        self.assertGreater(len(messages), 1)
+        self.assertTrue(all(len(x["text"]) <= telebot.util.MAX_MESSAGE_LENGTH for x in messages))
+        # части приходят по порядку и без потерь
+        self.assertEqual("".join(x["text"] for x in messages).replace("\n", ""), "".join(lines))
+        # клавиатура только под последней частью, возвращается последнее сообщение
+        self.assertNotIn("reply_markup", messages[0])
+        self.assertIn("reply_markup", messages[-1])
+        self.assertEqual(message.message_id, messages[-1]["message_id"])
+
+
+class SimulatorTests(TransactionTestCase):
+    USERS = 3
+
+    def setUp(self) -> None:
+        quiz = survey_models.Quiz.objects.create(name = "Опрос")
+        question = survey_models.Question.objects.create(quiz = quiz, text = "Вопрос с вариантами")
+        for text in ("Да", "Нет"):
+            survey_models.PreparedAnswer.objects.create(question = question, text = text)
+        survey_models.Question.objects.create(quiz = quiz, text = "Вопрос с текстовым ответом")
+
+    def test_users_pass_quiz(self) -> None:
+        simulator = Simulator(self.USERS, timeout = 5)
+        result = simulator.run()
+
+        self.assertEqual(result.failed_users, 0)
+        # /start, /quiz, выбор опроса и два ответа
+        self.assertEqual(result.updates, self.USERS * 5)
+        self.assertGreater(result.queries, 0)
+        self.assertEqual(survey_models.Answer.objects.count(), self.USERS * 2)
+        self.assertEqual(survey_models.QuizAttempt.objects.exclude(finished = None).count(), self.USERS)
+
+        simulator.cleanup()
+        self.assertFalse(survey_models.Answer.objects.exists())
+
+    def test_teardown_on_error(self) -> None:
+        api_url = telebot.apihelper.API_URL
+        with mock.patch.object(Bot, "start_workers", side_effect = RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Simulator(self.USERS).run()
+        self.assertEqual(telebot.apihelper.API_URL, api_url)
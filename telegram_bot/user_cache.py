@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import signals
+
+from core import models as core_models
+from telegram_bot import settings
+
+
+class UserCache:
+    """Ограниченный по размеру LRU-кэш пользователей с временем жизни записей.
+
+    Запоминает и отсутствие пользователя в БД, чтобы незарегистрированные пользователи не вызывали запрос на каждое
+    сообщение.
+    """
+
+    settings = settings.Settings()
+
+    def __init__(self) -> None:
+        self.max_size = self.settings.USER_CACHE_SIZE
+        self.ttl = self.settings.USER_CACHE_TTL
+        self.missing_ttl = self.settings.USER_CACHE_MISSING_TTL
+        self.hits = 0
+        self.misses = 0
+        # {telegram_user_id: (время устаревания, пользователь или None, если он не зарегистрирован)}
+        self._items: OrderedDict[int, tuple[float, core_models.User | None]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        signals.post_save.connect(self.on_user_change, core_models.User)
+        signals.post_delete.connect(self.on_user_change, core_models.User)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, telegram_user_id: int) -> core_models.User:
+        found, user = self._lookup(telegram_user_id)
+        if not found:
+            try:
+                user = core_models.User.objects.get(telegram_user_id = telegram_user_id)
+            except core_models.User.DoesNotExist:
+                self._set(telegram_user_id, None, self.missing_ttl)
+                raise
+            self._set(telegram_user_id, user, self.ttl)
+        elif user is None:
+            raise core_models.User.DoesNotExist()
+        return user
+
+    async def aget(self, telegram_user_id: int) -> core_models.User:
+        found, user = self._lookup(telegram_user_id)
+        if not found:
+            try:
+                user = await core_models.User.objects.aget(telegram_user_id = telegram_user_id)
+            except core_models.User.DoesNotExist:
+                self._set(telegram_user_id, None, self.missing_ttl)
+                raise
+            self._set(telegram_user_id, user, self.ttl)
+        elif user is None:
+            raise core_models.User.DoesNotExist()
+        return user
+
+    def put(self, user: core_models.User) -> None:
+        self._set(user.telegram_user_id, user, self.ttl)
+
+    def invalidate(self, telegram_user_id: int) -> None:
+        with self._lock:
+            self._items.pop(telegram_user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    # noinspection PyUnusedLocal
+    def on_user_change(self, sender, instance: core_models.User, **kwargs) -> None:
+        if instance.telegram_user_id is not None:
+            self.invalidate(instance.telegram_user_id)
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def _lookup(self, telegram_user_id: int) -> tuple[bool, core_models.User | None]:
+        with self._lock:
+            item = self._items.get(telegram_user_id)
+            if item is not None and item[0] > time.monotonic():
+                self._items.move_to_end(telegram_user_id)
+                self.hits += 1
+                return True, item[1]
+            self.misses += 1
+        return False, None
+
+    def _set(self, telegram_user_id: int, user: core_models.User | None, ttl: float) -> None:
+        with self._lock:
+            self._items[telegram_user_id] = (time.monotonic() + ttl, user)
+            self._items.move_to_end(telegram_user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last = False)
@@ -1,3 +1,48 @@
-from django.shortcuts import render
+import atexit
+import hmac
+import threading
 
-# Create your views here.
+import telebot
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from telegram_bot.bot import Bot
+
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_bot: Bot | None = None
+_bot_lock = threading.Lock()
+
+
+def get_bot() -> Bot:
+    # каждый web-процесс поднимает своего бота с пулом обработчиков при первом обновлении
+    global _bot
+    if _bot is None:
+        with _bot_lock:
+            if _bot is None:
+                bot = Bot()
+                bot.start_webhook()
+                # при завершении web-процесса обработчики дорабатывают очередь, а буфер ответов записывается
+                atexit.register(bot.stop_workers)
+                _bot = bot
+    return _bot
+
+
+@csrf_exempt
+@require_POST
+def webhook(request: HttpRequest) -> HttpResponse:
+    secret_token = getattr(Bot.settings.secrets.telegram_bot, "webhook_secret_token", None)
+    # без заданного токена любой запрос прошел бы проверку, поэтому такие запросы отклоняются
+    if not secret_token or not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ""), secret_token):
+        return HttpResponseForbidden()
+
+    try:
+        update = telebot.types.Update.de_json(request.body.decode("utf-8"))
+    except (ValueError, KeyError):
+        return HttpResponseBadRequest()
+
+    # обработка идет в фоне, Telegram сразу получает ответ и не повторяет отправку
+    get_bot().process_new_updates([update])
+    return HttpResponse()